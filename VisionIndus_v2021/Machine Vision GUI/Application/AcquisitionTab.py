@@ -1,8 +1,7 @@
 from PyQt5 import QtWidgets as Qtw
 from PyQt5 import QtGui as Qtg
 from PyQt5 import QtCore as Qtc
-from math import floor
-from pyueye import ueye
+from math import floor, ceil
 import numpy as np
 import cv2
 import serial
@@ -10,8 +9,9 @@ import serial.tools.list_ports
 import threading
 
 
-from Utils import QLabelRect, v_line, h_line, convert_cv_to_qpixmap, WarningWidget
-from camera import uEyeCamera
+from Utils import QLabelRect, v_line, h_line, convert_cv_to_qpixmap, ImageDisplay, WarningWidget
+from frame_recorder import FrameRecorder
+from camera_backend import Capability
 from Dictionary_EN import *
 
 
@@ -31,16 +31,15 @@ class AcquisitionTab(Qtw.QWidget):
 
 
         self.cam = cam
-        self.max_width_AOI = self.cam.width_max.value
-        self.max_height_AOI = self.cam.height_max.value
-        self.cam.set_colormode(ueye.IS_CM_MONO8)
+        self.max_width_AOI, self.max_height_AOI = self.cam.get_sensor_info()[:2]
+        self.cam.set_color(False)
         self.cam.set_aoi(0, 0, self.max_width_AOI, self.max_height_AOI)
-        self.cam.alloc()
-        self.cam.capture_video()
+        self.cam.start()
 
         # Creating and connecting the QThread for read the video from the camera
         self.get_video_thread = video_thread
         self.get_video_thread.new_cv_img_signal.connect(self.update_video_qlabel)
+        self.get_video_thread.fps_signal.connect(self.update_fps)
 
         # Creating icons for acquisition_button QPushButton
         self.start_icon = Qtg.QIcon(":/start_icon.png")
@@ -48,6 +47,7 @@ class AcquisitionTab(Qtw.QWidget):
 
         # QLabel for showing pixmap of the live video  from the camera
         self.video_qlabel = QLabelRect()  # QLabel from a overriding class (see below)
+        self.video_display = ImageDisplay(self.video_qlabel)
         self.video_qlabel.setAlignment(Qtc.Qt.AlignLeft)
         self.video_qlabel.setAlignment(Qtc.Qt.AlignTop)
         self.video_qlabel.setSizePolicy(Qtw.QSizePolicy.MinimumExpanding, Qtw.QSizePolicy.MinimumExpanding)
@@ -79,11 +79,28 @@ class AcquisitionTab(Qtw.QWidget):
         self.clipboard_screenshot_button.clicked.connect(self.clipboard_screenshot)
         self.clipboard_screenshot_shortcut = Qtw.QShortcut(Qtg.QKeySequence('Ctrl+C'), self)
 
+        # QPushButton, QSpinBox and QLabel for recording a burst of frames into a raw file
+        self.recorder = None
+        self.record_button = Qtw.QPushButton(STR_RECORD_VIDEO)
+        self.record_button.setEnabled(False)
+        self.record_button.clicked.connect(self.clicked_record_button)
+        self.record_frames_spinbox = Qtw.QSpinBox()
+        self.record_frames_spinbox.setRange(1, 100000)
+        self.record_frames_spinbox.setValue(500)
+        self.record_frames_spinbox.setSuffix(' ' + STR_FRAMES)
+        self.record_qlabel = Qtw.QLabel()
+        self.record_timer = Qtc.QTimer()
+        self.record_timer.setInterval(200)
+        self.record_timer.timeout.connect(self.update_record_status)
+
         # QPushButton for launching and stop live acquisition
         self.acquisition_button = Qtw.QPushButton()
         self.state_acquisition_button = False
         self.acquisition_button.clicked.connect(self.clicked_acquisition_button)
 
+        # QLabel for showing the acquisition, processing and display frame rates measured by GetVideoThread
+        self.fps_qlabel = Qtw.QLabel()
+
         # # All QObject for the lighting setting
         # self.belt_on_off = Qtw.QCheckBox(STR_CONVEYOR)
         # self.belt_speed_slider = Qtw.QSlider(Qtc.Qt.Horizontal)
@@ -127,6 +144,10 @@ class AcquisitionTab(Qtw.QWidget):
 
         self.aoi_button = Qtw.QPushButton(STR_NEW_AOI)
         self.aoi_button.clicked.connect(self.new_aoi)
+        # The new AOI crops the frames in software (no restart of the acquisition), unless the sensor AOI is asked
+        # for a faster readout
+        self.sensor_aoi_checkbox = Qtw.QCheckBox(STR_SENSOR_AOI)
+        self.sensor_aoi_checkbox.setEnabled(self.cam.has_capability(Capability.AOI))
 
         self.gray_radio = Qtw.QRadioButton(STR_GRAYSACLE)
         self.gray_radio.setChecked(True)
@@ -145,7 +166,10 @@ class AcquisitionTab(Qtw.QWidget):
         main_grid_layout = Qtw.QGridLayout()  # the grid layout will have 3(row)*3(column) cases
         main_grid_layout.addWidget(self.video_qlabel, 1, 0)
         main_grid_layout.addWidget(self.screenshot_qlabel, 1, 2)
-        main_grid_layout.addWidget(self.acquisition_button, 2, 0)
+        acquisition_h_layout = Qtw.QHBoxLayout()
+        acquisition_h_layout.addWidget(self.acquisition_button)
+        acquisition_h_layout.addWidget(self.fps_qlabel)
+        main_grid_layout.addLayout(acquisition_h_layout, 2, 0)
         main_grid_layout.addLayout(self.screenshot_buttons_layout(), 2, 2)
         #main_grid_layout.addLayout(LightSettingAndCamInfo(), 0, 2)
         main_grid_layout.addWidget(self.light_setting_and_camera_info_widget, 0, 2)
@@ -179,21 +203,12 @@ class AcquisitionTab(Qtw.QWidget):
     @Qtc.pyqtSlot(bool)
     def update_colormode(self, gray_checked):
         """Slot connected to the toggled signal of gray_radio (QRadioBox)"""
-        if gray_checked:  # if gray_radio is checked
-            colormode = ueye.IS_CM_MONO8
-        else:  # else rgb_radio is checked
-            colormode = ueye.IS_CM_BGR8_PACKED
-
         self.get_video_thread.stop()
-        self.cam.stop_video()
-        self.cam.un_alloc()
-        self.cam.set_colormode(colormode)
-        self.cam.alloc()
+        self.cam.set_color(not gray_checked)  # gray_radio checked or rgb_radio checked
         self.update_min_max_framerate()
         self.update_framerate()
         self.update_min_max_exposure()
         self.update_exposure()
-        self.cam.capture_video()
         self.get_video_thread.start()
 
     @Qtc.pyqtSlot(np.ndarray)
@@ -203,10 +218,16 @@ class AcquisitionTab(Qtw.QWidget):
         #qt_img = convert_cv_to_qpixmap(cv_img[self.aoi[0]:self.aoi[2], self.aoi[1]:self.aoi[3]],
         #                               self.video_qlabel.size())
 
-        qt_img = convert_cv_to_qpixmap(cv_img, self.video_qlabel.size())
         self.displayed_cv_img = cv_img
-        self.displayed_qt_img = qt_img
-        self.video_qlabel.setPixmap(qt_img)
+        self.displayed_qt_img = self.video_display.show(cv_img)
+
+    @Qtc.pyqtSlot(float, float, float)
+    def update_fps(self, acquisition_fps, processing_fps, display_fps):
+        """Slot connected to the fps_signal signal of GetVideoThread"""
+        self.fps_qlabel.setText(f'{STR_ACQUISITION}: {acquisition_fps:.1f} {STR_FPS} | '
+                                f'{STR_PROCESSING}: {processing_fps:.0f} {STR_FPS} | '
+                                f'{STR_DISPLAY}: {display_fps:.1f} {STR_FPS} | '
+                                f'{self.get_video_thread.nb_dropped} {STR_FRAMES_DROPPED}')
 
     @Qtc.pyqtSlot()
     def take_screenshot(self):
@@ -238,40 +259,75 @@ class AcquisitionTab(Qtw.QWidget):
     def clipboard_screenshot(self):
         Qtw.QApplication.clipboard().setPixmap(convert_cv_to_qpixmap(self.displayed_cv_screenshot, None))
 
+    @Qtc.pyqtSlot()
+    def clicked_record_button(self):
+        """Slot connected to the clicked signal of record_button. Start a record in a raw file or stop it"""
+        if self.recorder is not None:
+            self.recorder.stop(wait=False)
+            return
+
+        frame = self.cam.get_frame()
+        if frame is None:
+            return
+        filename = Qtw.QFileDialog.getSaveFileName(self, STR_SAVE_IMAGE, '', STR_RECORD_FORMAT)
+        if filename[0] == "":
+            return
+
+        self.recorder = FrameRecorder(filename[0], frame.shape, frame.dtype, self.record_frames_spinbox.value())
+        self.recorder.record(self.cam, self.record_frames_spinbox.value())
+        self.record_button.setText(STR_STOP_RECORD)
+        # The frame size can not change during a record
+        self.aoi_button.setEnabled(False)
+        self.gray_radio.setEnabled(False)
+        self.rgb_radio.setEnabled(False)
+        self.record_timer.start()
+
+    @Qtc.pyqtSlot()
+    def update_record_status(self):
+        """Slot connected to the timeout signal of record_timer. Shows the counters of the record in progress"""
+        recorder = self.recorder
+        self.record_qlabel.setText(f'{recorder.nb_written} / {recorder.max_frames} {STR_FRAMES}, '
+                                   f'{recorder.nb_dropped} {STR_FRAMES_DROPPED}, '
+                                   f'{recorder.nb_missed} {STR_FRAMES_MISSED}')
+        if not recorder.is_recording():
+            self.record_timer.stop()
+            recorder.close()
+            self.recorder = None
+            self.record_button.setText(STR_RECORD_VIDEO)
+            self.aoi_button.setEnabled(self.state_acquisition_button)
+            self.gray_radio.setEnabled(self.state_acquisition_button)
+            self.rgb_radio.setEnabled(self.state_acquisition_button)
+
     @Qtc.pyqtSlot(Qtc.QPoint, Qtc.QPoint)
     def get_release_pos(self, qpos0, qpos1):
 
-        # Retrieving the total width and height of the displayed picture
+        # Retrieving the total width and height of the displayed picture, and of the full frame it shows
         xt = self.video_qlabel.pixmap().width()
         yt = self.video_qlabel.pixmap().height()
+        height, width = self.displayed_cv_img.shape[:2]
 
         # Calculating the coordinates in the original image and in the displayed one (with is scaled)
-        x0 = floor(qpos0.x()/xt*self.max_width_AOI)
-        y0 = floor(qpos0.y()/yt*self.max_height_AOI)
-        x1 = floor(qpos1.x()/xt*self.max_width_AOI)
-        y1 = floor(qpos1.y()/yt*self.max_height_AOI)
+        x0 = min(max(floor(qpos0.x()/xt*width), 0), width)
+        y0 = min(max(floor(qpos0.y()/yt*height), 0), height)
+        x1 = min(max(floor(qpos1.x()/xt*width), 0), width)
+        y1 = min(max(floor(qpos1.y()/yt*height), 0), height)
 
         # Setting the new AOI, first mouse click can any corner of the rectangle AOI
-        self.get_video_thread.stop()
-        self.cam.stop_video()
-        self.cam.un_alloc()
-        self.cam.set_aoi(min(x0, x1), min(y0, y1), max(x0, x1)-min(x0, x1), max(y0, y1)-min(y0, y1))
-
-        # print(min(x0, x1), min(y0, y1), max(x0, x1)-min(x0, x1), max(y0, y1)-min(y0, y1))
-        self.cam.alloc()
-        self.update_min_max_framerate()
-        self.update_framerate()
-        self.update_min_max_exposure()
-        self.update_exposure()
-        self.cam.capture_video()
-        self.get_video_thread.start()
-
-        self.light_setting_and_camera_info_widget.update_aoi(self.cam.get_aoi())
+        aoi = (min(x0, x1), min(y0, y1), max(x0, x1)-min(x0, x1), max(y0, y1)-min(y0, y1))
+        if aoi[2] == 0 or aoi[3] == 0:  # Simple click, the full frame is kept
+            self.light_setting_and_camera_info_widget.update_aoi((0, 0, width, height))
+        elif self.sensor_aoi_checkbox.isChecked():
+            self.set_sensor_aoi(*aoi)
+            self.light_setting_and_camera_info_widget.update_aoi(self.cam.get_aoi())
+        else:
+            self.get_video_thread.set_roi(aoi)
+            self.light_setting_and_camera_info_widget.update_aoi(aoi)
 
         # Enabling all the buttons once AOI is set.
         self.acquisition_button.setEnabled(True)
         self.aoi_button.setEnabled(True)
         self.take_screenshot_button.setEnabled(True)
+        self.record_button.setEnabled(True)
         if self.displayed_cv_screenshot.size != 0:
             self.save_screenshot_button.setEnabled(True)
             self.clipboard_screenshot_button.setEnabled(True)
@@ -286,23 +342,18 @@ class AcquisitionTab(Qtw.QWidget):
 
     @Qtc.pyqtSlot()
     def new_aoi(self):
-        # Setting the AOI to maximum (displaying the all picture) in order to choose the new AOI
-        self.get_video_thread.stop()
-        self.cam.stop_video()
-        self.cam.un_alloc()
-        self.cam.set_aoi(0, 0, self.max_width_AOI, self.max_height_AOI)
-        self.cam.alloc()
-        self.update_min_max_framerate()
-        self.update_framerate()
-        self.update_min_max_exposure()
-        self.update_exposure()
-        self.cam.capture_video()
-        self.get_video_thread.start()
+        # Displaying the all picture in order to choose the new AOI. The acquisition is only restarted if the sensor
+        # AOI was reduced.
+        self.get_video_thread.set_roi(None)
+        aoi = self.cam.get_aoi()
+        if aoi is not None and tuple(aoi[2:]) != (self.max_width_AOI, self.max_height_AOI):
+            self.set_sensor_aoi(0, 0, self.max_width_AOI, self.max_height_AOI)
 
         # Disabling all the buttons while in AOI setting mode.
         self.acquisition_button.setEnabled(False)
         self.aoi_button.setEnabled(False)
         self.take_screenshot_button.setEnabled(False)
+        self.record_button.setEnabled(False)
         self.save_screenshot_button.setEnabled(False)
         self.clipboard_screenshot_button.setEnabled(False)
         self.framerate_spinbox.setEnabled(False)
@@ -314,6 +365,16 @@ class AcquisitionTab(Qtw.QWidget):
         self.video_qlabel.mouse_released_signal.connect(self.get_release_pos)
         self.video_qlabel.setting_aoi = True
 
+    def set_sensor_aoi(self, x, y, w, h):
+        """Reprogram the AOI of the sensor (faster readout of a small AOI), the acquisition is restarted"""
+        self.get_video_thread.stop()
+        self.cam.set_aoi(x, y, w, h)
+        self.update_min_max_framerate()
+        self.update_framerate()
+        self.update_min_max_exposure()
+        self.update_exposure()
+        self.get_video_thread.start()
+
     @Qtc.pyqtSlot()
     def send_screenshot(self):
         self.send_screenshot_signal.emit(self.displayed_cv_screenshot)
@@ -324,19 +385,19 @@ class AcquisitionTab(Qtw.QWidget):
 
     def update_min_max_exposure(self):
         mini, maxi = self.cam.get_exposure_range()
+        mini, maxi = ceil(mini), floor(maxi)
         self.min_value_exposure_qlabel.setText(str(mini))
         self.max_value_exposure_qlabel.setText(str(maxi))
         self.exposure_spinbox.setRange(mini, maxi)
 
     def update_framerate(self):
         framerate = self.framerate_spinbox.value()
-        self.cam.set_framerate(framerate)
+        self.cam.set_frame_rate(framerate)
         self.update_min_max_exposure()
 
     def update_min_max_framerate(self):
-        a = self.cam.get_frame_time_range()
-        mini = floor(1/a[1])
-        maxi = floor(1/a[0])
+        mini, maxi = self.cam.get_frame_rate_range()
+        mini, maxi = floor(mini), floor(maxi)
         self.min_value_framerate_qlabel.setText(str(mini))
         self.max_value_framerate_qlabel.setText(str(maxi))
         self.framerate_spinbox.setRange(mini, maxi)
@@ -355,6 +416,9 @@ class AcquisitionTab(Qtw.QWidget):
         self.aoi_button.setEnabled(state)
         self.state_acquisition_button = state
         self.take_screenshot_button.setEnabled(state)
+        self.record_button.setEnabled(state)
+        if self.recorder is not None and not state:
+            self.recorder.stop(wait=False)
         if state:
             self.acquisition_button.setText(STR_STOP_VIDEO)
             self.acquisition_button.setIcon(self.stop_icon)
@@ -387,6 +451,7 @@ class AcquisitionTab(Qtw.QWidget):
 
         right_v_layout = Qtw.QVBoxLayout()
         right_v_layout.addWidget(self.aoi_button)
+        right_v_layout.addWidget(self.sensor_aoi_checkbox)
         right_v_layout.addWidget(self.gray_radio)
         right_v_layout.addWidget(self.rgb_radio)
 
@@ -405,6 +470,9 @@ class AcquisitionTab(Qtw.QWidget):
         h_layout.addWidget(self.take_screenshot_button, 0, 0, 1, 2)
         h_layout.addWidget(self.save_screenshot_button, 1, 0)
         h_layout.addWidget(self.clipboard_screenshot_button, 1, 1)
+        h_layout.addWidget(self.record_frames_spinbox, 2, 0)
+        h_layout.addWidget(self.record_button, 2, 1)
+        h_layout.addWidget(self.record_qlabel, 3, 0, 1, 2)
 
         return h_layout
 
@@ -577,10 +645,11 @@ class LightSettingAndCamInfo(Qtw.QTabWidget):
 
         self.cam_ser_no_qlabel.setText(str(cam_info[0]))
         self.cam_id_qlabel.setText(str(cam_info[1]))
-        self.cam_sensor_width_qlabel.setText(str(sensor_info[0].value))
-        self.cam_sensor_height_qlabel.setText(str(sensor_info[1].value))
+        self.cam_sensor_width_qlabel.setText(str(sensor_info[0]))
+        self.cam_sensor_height_qlabel.setText(str(sensor_info[1]))
         self.cam_name_qlabel.setText(str(sensor_info[2]))
-        self.cam_pixel_size_qlabel.setText(str(sensor_info[3]/100.0))
+        if sensor_info[3] is not None:
+            self.cam_pixel_size_qlabel.setText(str(sensor_info[3]/100.0))
         self.cam_aoi_width.setText(str(aoi[2]))
         self.cam_aoi_height.setText(str(aoi[3]))
 
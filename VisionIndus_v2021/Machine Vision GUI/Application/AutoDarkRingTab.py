@@ -20,9 +20,13 @@ ET SURTOUT de :
     - détecter les contours des objets
     - déterminer leur centre et sa distance avec le centre de l'anneau
     - si l'objet est au centre de l'anneau, baisser l'anneau et prendre une photo enregistrée automatiquement dans un dossier, puis relever l'anneau
+Les commandes ne sont envoyées à l'anneau qu'aux changements d'état (RingStateMachine), par un thread ; les photos sont
+enregistrées par un autre thread (background_io.py), la vidéo n'attend jamais le port série ou le disque.
 
 --------------------------------------------------------------------------------"""
 
+import os
+
 import numpy as np
 
 #permet de créer des interfaces en python :
@@ -33,19 +37,61 @@ from PyQt5 import QtCore as Qtc
 import cv2
 
 #fonctions programmées pendant les semaines PIMS
-from Utils import convert_cv_to_qpixmap, Timer, h_line, is_gray
-from PreProcessingFunction import func_contours_list, gray_to_binary
-from FormDetectionFunction import is_outside
+from Utils import convert_cv_to_qpixmap, ImageDisplay, Timer, h_line, is_gray, ProcessingWorker
+from PreProcessingFunction import func_components_list, gray_to_binary, ProcessingContext
+from background_io import SerialWriter, ImageSaver
 
 #dictionnaire de chaines de caractères fait pendant les semaines PIMS
 from Dictionary_EN import *
 
+RING_DOWN = chr(65)  # 'A' : baisser l'anneau, l'objet est au centre (une photo est prise)
+RING_UP = chr(100)  # 'd' : relever l'anneau
+
+
+class RingStateMachine:
+    """
+    État de l'anneau (RING_DOWN ou RING_UP). Il ne change que si le même état est demandé par nb_frames images
+    successives (anti-rebond), seules les transitions sont envoyées à l'anneau.
+    """
+
+    def __init__(self, nb_frames=2):
+        self.nb_frames = nb_frames
+        self.reset()
+
+    def reset(self):
+        """État inconnu : la prochaine demande confirmée est envoyée"""
+        self.state = None
+        self._candidate = None
+        self._count = 0
+
+    def update(self, request):
+        """
+        :param request: état demandé par une image, None si aucun objet n'est dans la zone d'intérêt (l'anneau ne
+        bouge pas)
+        :return: commande à envoyer si l'état change, None sinon
+        """
+        if request is None or request == self.state:
+            self._candidate, self._count = None, 0
+            return None
+        if request != self._candidate:
+            self._candidate, self._count = request, 0
+        self._count += 1
+        if self._count < self.nb_frames:
+            return None
+        self.state = request
+        self._candidate, self._count = None, 0
+        return request
+
 
 class AutoDarkRingTab(Qtw.QMainWindow):
     def __init__(self, video_thread, ser):
         super().__init__()
         self.nb=0 # numérotation des photos
         self.ser = ser # pour la conection usb
+        self.ring = RingStateMachine()
+        self.serial_writer = SerialWriter(self.ser) # écriture des commandes dans un thread
+        self.snapshot_directory = os.path.join(os.getcwd(), 'snapshots')
+        self.image_saver = ImageSaver(self.snapshot_directory) # enregistrement des photos dans un thread
 
         self.raw_cv_img = None
         self.shown_cv_img = None
@@ -56,6 +102,7 @@ class AutoDarkRingTab(Qtw.QMainWindow):
         self.get_video_thread.stopped_signal.connect(self.video_stopped)
 
         self.video_qlabel = Qtw.QLabel()
+        self.video_display = ImageDisplay(self.video_qlabel)
         self.setCentralWidget(self.video_qlabel)
 
         self.setting_dock = Qtw.QDockWidget('Setting', self)
@@ -66,6 +113,11 @@ class AutoDarkRingTab(Qtw.QMainWindow):
         self.calculate_btn.setEnabled(False)
 
         self.fps_qlabel = Qtw.QLabel()
+        self.latency_qlabel = Qtw.QLabel()
+
+        # traitement des images en dehors du thread de l'interface
+        self.worker = ProcessingWorker(find_objects_in_ring, parent=self)
+        self.worker.result_signal.connect(self.show_result)
 
         """Pre-processing Buttons"""
 
@@ -104,6 +156,10 @@ class AutoDarkRingTab(Qtw.QMainWindow):
         self.clipboard_btn.clicked.connect(self.clipboard_screenshot)
         self.clipboard_btn.setEnabled(False)
 
+        self.directory_qlabel = Qtw.QLabel(self.snapshot_directory) # dossier des photos prises automatiquement
+        self.change_folder_btn = Qtw.QPushButton(STR_CHANGE_FOLDER)
+        self.change_folder_btn.clicked.connect(self.change_directory)
+
         """Layout"""
         #on ajoute tous les éléments au layout
 
@@ -111,6 +167,7 @@ class AutoDarkRingTab(Qtw.QMainWindow):
         setting_form_layout.addRow(self.calculate_btn) # ajout du bouton pour le calcul de la position des objets
         setting_form_layout.addRow(h_line()) # petite ligne horizontale pour que ca soit joli
         setting_form_layout.addRow(Qtw.QLabel(STR_FPS), self.fps_qlabel) #chaîne de caractères pour indiquer le nombre d'images par secondes
+        setting_form_layout.addRow(Qtw.QLabel(STR_LATENCY), self.latency_qlabel) #temps de traitement d'une image
         setting_form_layout.addRow(h_line()) # petite ligne horizontale pour que ca soit joli
         setting_form_layout.addRow(self.show_binary_checkbox) # petite checkbox pour montrer l'image binaire
         setting_form_layout.addRow(self.opening_checkbox) # petite checkbox pour effectuer une ouverture
@@ -121,6 +178,9 @@ class AutoDarkRingTab(Qtw.QMainWindow):
         setting_form_layout.addRow(STR_MAX_SURFACE, self.max_area_spinbox)
         setting_form_layout.addRow(h_line())
         setting_form_layout.addRow(self.screenshot_btn, self.clipboard_btn)
+        setting_form_layout.addRow(h_line())
+        setting_form_layout.addRow(STR_SNAPSHOTS_FOLDER, self.directory_qlabel)
+        setting_form_layout.addRow(self.change_folder_btn)
 
         setting_widget.setLayout(setting_form_layout)
 
@@ -133,6 +193,7 @@ class AutoDarkRingTab(Qtw.QMainWindow):
         self.video_qlabel.setText(STR_PLS_LAUNCH_ACQUISITION)
         self.shown_cv_img = None
         self.fps_qlabel.setText('')
+        self.latency_qlabel.setText('')
         self.calculating = False
         self.calculate_btn.setEnabled(False)
         self.calculate_btn.setText(STR_START_CALCULATION)
@@ -150,15 +211,27 @@ class AutoDarkRingTab(Qtw.QMainWindow):
     def clipboard_screenshot(self): # permet de copier l'image dans le clipboard
         Qtw.QApplication.clipboard().setPixmap(convert_cv_to_qpixmap(self.shown_cv_img, None))
 
+    @Qtc.pyqtSlot()
+    def change_directory(self): # choix du dossier des photos prises automatiquement
+        directory = Qtw.QFileDialog.getExistingDirectory(self, 'Open directory', self.snapshot_directory,
+                                                         Qtw.QFileDialog.ShowDirsOnly |
+                                                         Qtw.QFileDialog.DontResolveSymlinks)
+        if directory != '':
+            self.snapshot_directory = directory
+            self.image_saver.directory = directory # pour les prochaines photos
+            self.directory_qlabel.setText(directory)
+
     @Qtc.pyqtSlot()
     def start_calculation(self):
         if not self.calculating:
             self.calculate_btn.setText(STR_STOP_CALCULATION)
             self.calculating = True
+            self.ring.reset() # la première position demandée est envoyée
         else:
             self.calculate_btn.setText(STR_START_CALCULATION)
             self.calculating = False
             self.fps_qlabel.setText('')
+            self.latency_qlabel.setText('')
 
     @Qtc.pyqtSlot(np.ndarray)
     def update_video_qlabel(self, cv_img): # met à jour l'image avec la nouvelle image de la caméra
@@ -170,57 +243,15 @@ class AutoDarkRingTab(Qtw.QMainWindow):
             self.fps_qlabel.setText(str(int(1 / d_t)))
 
             if self.calculating:
-                binary_img = gray_to_binary(cv_img, self.threshold_spinbox.value(), self.opening_checkbox.isChecked(),self.closing_checkbox.isChecked(), self.blur_checkbox.isChecked())
-                [l,c]=np.shape(binary_img)
-
-                #paramètres pour déteriner la position de l'image par rapport au centre
-                center_l = round(l/2) # coordonnée du centre
-                center_c = round(c/2) # coordonnée du centre
-                AOI = 400 #tous les objets dont le centre est à plus de 400 pix du centre de la zone d'intérêt ne sont pas pris en compte
-                contours_list = func_contours_list(binary_img, self.min_area_spinbox.value(), self.max_area_spinbox.value()) #liste des contours des formes sur l'image
-
-                if self.show_binary_checkbox.isChecked():
-                    contours_img = cv2.merge([binary_img, binary_img, binary_img])
-                else:
-                    contours_img = cv2.merge([cv_img, cv_img, cv_img])
-
-                # sélection des formes de la liste qui sont au centre de l'image
-                for cnt in contours_list:
-                    # on calcule le centre de la forme à l'aide des moments de Hu
-                    m = cv2.moments(cnt)
-                    center_x = int(m["m10"] / m["m00"])
-                    center_y = int(m["m01"] / m["m00"])
-                    R = np.sqrt((center_x-center_l)**2 +(center_y-center_c)**2)
-                    if not is_outside(cnt, cv_img.shape):
-                        if R<AOI:
-                            if R<250: #si l'objet est proche du centre on baisse l'anneau et on prend la photo
-                                self.ser.write(chr(65).encode('utf-8'))
-                                self.nb+=1 #mise a jour du numéro de la photo
-                                cv2.imwrite("C:/Users/victo/PycharmProjects/PIMSProTis/Picture/piece/piece"+str(self.nb)+".png", contours_img) #enregistrement de l'image
-                            if R>250: #si l'objet est loin du centre on relève l'anneau
-                                self.ser.write(chr(100).encode('utf-8'))
-                            #on dessine sur l'image les contours des formes
-                            cv2.drawContours(contours_img, cnt, -1, (0, 0, 255), 3)
-
-                            #on affiche le centre de la forme
-                            cv2.circle(contours_img, (center_x, center_y), 4, (0, 0, 255), -1)
-                            cv2.putText(contours_img, str(center_x) + "," + str(center_y), (center_x - 55, center_y - 10), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 2, cv2.LINE_AA)
-
-
-                #on trace sur l'image la région d'interêt
-                cv2.circle(contours_img, (center_l, center_c), AOI, (0, 0, 255), 4)
-                cv2.circle(contours_img, (center_l,center_c),4,(0,0,255),-1)
-                cv2.putText(contours_img, "center", (center_l,center_c),cv2.FONT_HERSHEY_SIMPLEX,1, (255, 0, 0), 2, cv2.LINE_AA)
-
-                #on affiche l'image
-                self.shown_cv_img = contours_img
-
+                # le traitement est fait par le worker, le résultat est affiché par show_result
+                self.worker.submit(cv_img, self.threshold_spinbox.value(), self.opening_checkbox.isChecked(),
+                                   self.closing_checkbox.isChecked(), self.blur_checkbox.isChecked(),
+                                   self.min_area_spinbox.value(), self.max_area_spinbox.value(),
+                                   self.show_binary_checkbox.isChecked())
             else: #si le bouton de calcul n'a pas été cliqué
                 self.shown_cv_img = cv_img
-
-            #l'image à afficher (avec ou sans les calculs réalisés) est convertie puis ajoutée à l'interface
-            qt_img = convert_cv_to_qpixmap(self.shown_cv_img, self.video_qlabel.size())
-            self.video_qlabel.setPixmap(qt_img)
+                #l'image à afficher est convertie puis ajoutée à l'interface
+                self.video_display.show(self.shown_cv_img)
 
         else: # si l'aquisition d'image en noir est blanc n'est pas lancée
             self.calculating = False
@@ -231,21 +262,78 @@ class AutoDarkRingTab(Qtw.QMainWindow):
             self.video_qlabel.setText(STR_COLOR_TO_GRAY)
             self.shown_cv_img = None # il n'y a aucune image affichée
             self.fps_qlabel.setText('')
+            self.latency_qlabel.setText('')
+
+    @Qtc.pyqtSlot(object)
+    def show_result(self, result): # affiche le résultat du traitement et commande l'anneau
+        if not self.calculating:
+            return
+        contours_img, request = result
+        command = self.ring.update(request)
+        if command is not None: # l'anneau change d'état
+            self.serial_writer.send(command)
+            if command == RING_DOWN:
+                self.nb+=1 #mise a jour du numéro de la photo
+                self.image_saver.save(contours_img, 'piece'+str(self.nb)+'.png') #enregistrement de l'image
+
+        #on affiche l'image
+        self.shown_cv_img = contours_img
+        self.video_display.show(self.shown_cv_img)
+        self.latency_qlabel.setText(f'{self.worker.latency * 1000:.0f} ms')
 
     def resizeEvent(self, event):
         Qtw.QWidget.resizeEvent(self, event)  # Calling the basic resizeEvent of QWidget
         if self.shown_cv_img is not None:
-            qt = convert_cv_to_qpixmap(self.shown_cv_img, self.video_qlabel.size())
-            self.video_qlabel.setPixmap(qt)
+            self.video_display.show(self.shown_cv_img)
+
 
+_CONTEXT = ProcessingContext()
 
 
+def find_objects_in_ring(cv_img, threshold, opening, closing, blur, min_area, max_area, show_binary):
+    """
+    Détecte les objets proches du centre de l'anneau. Appelée dans les threads du ProcessingWorker de AutoDarkRingTab.
 
+    :return: image avec les contours des objets et la zone d'intérêt, état demandé pour l'anneau (RING_DOWN si un
+    objet est proche du centre, RING_UP si les objets de la zone d'intérêt en sont loin, None si la zone est vide)
+    """
+    binary_img = gray_to_binary(cv_img, threshold, opening, closing, blur, _CONTEXT)
+    [l,c]=np.shape(binary_img)
 
+    #paramètres pour déteriner la position de l'image par rapport au centre
+    center_l = round(l/2) # coordonnée du centre
+    center_c = round(c/2) # coordonnée du centre
+    AOI = 400 #tous les objets dont le centre est à plus de 400 pix du centre de la zone d'intérêt ne sont pas pris en compte
+    #liste des contours et des centres des formes sur l'image, sans celles qui touchent le bord
+    contours_list, _, centers = func_components_list(binary_img, min_area, max_area, border_margin=5)
 
+    if show_binary:
+        contours_img = cv2.merge([binary_img, binary_img, binary_img])
+    else:
+        contours_img = cv2.merge([cv_img, cv_img, cv_img])
 
+    request = None # état demandé pour l'anneau
 
+    # sélection des formes de la liste qui sont au centre de l'image
+    R_list = np.hypot(centers[:, 0].astype(int) - center_l, centers[:, 1].astype(int) - center_c)
+    for cnt, center, R in zip(contours_list, centers.astype(int).tolist(), R_list):
+        center_x, center_y = center
+        if R<AOI:
+            if R<250: #si un objet est proche du centre on baisse l'anneau et on prend la photo
+                request = RING_DOWN
+            elif request is None: #si les objets sont loin du centre on relève l'anneau
+                request = RING_UP
+            #on dessine sur l'image les contours des formes
+            cv2.drawContours(contours_img, cnt, -1, (0, 0, 255), 3)
 
+            #on affiche le centre de la forme
+            cv2.circle(contours_img, (center_x, center_y), 4, (0, 0, 255), -1)
+            cv2.putText(contours_img, str(center_x) + "," + str(center_y), (center_x - 55, center_y - 10), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 2, cv2.LINE_AA)
 
 
+    #on trace sur l'image la région d'interêt
+    cv2.circle(contours_img, (center_l, center_c), AOI, (0, 0, 255), 4)
+    cv2.circle(contours_img, (center_l,center_c),4,(0,0,255),-1)
+    cv2.putText(contours_img, "center", (center_l,center_c),cv2.FONT_HERSHEY_SIMPLEX,1, (255, 0, 0), 2, cv2.LINE_AA)
 
+    return contours_img, request
@@ -0,0 +1,322 @@
+import functools
+
+import numpy as np
+import cv2
+
+
+def dominant_color(i):
+    if i<=15:
+        char = 'red'
+    if i>15 and i<=35:
+        char = 'orange'
+    if i>35 and i<=45:
+        char = 'yellow'
+    if i>45 and i<=110:
+        char = 'green'
+    if i>110 and i<=120:
+        char = 'blue-green'
+    if i>120 and i<=135:
+        char = 'cyan'
+    if i>135 and i<=180:
+        char = 'blue'
+    if i>180 and i<=205:
+        char = 'purple'
+    if i>205 and i<=245:
+        char = 'pink'
+    if i>245:
+        char = 'red'
+    return char
+
+
+# Name of the color of each hue index (hue in [0, 1] scaled to 0..255), computed once
+HUE_NAMES = np.array([dominant_color(i) for i in range(256)])
+# Color classes of the pixel classification (see build_color_lut), class 0 is for the unsaturated or dark pixels
+COLOR_CLASSES = ['none'] + [str(name) for name in dict.fromkeys(HUE_NAMES)]
+_HUE_CLASSES = np.array([COLOR_CLASSES.index(name) for name in HUE_NAMES], np.uint8)
+
+
+def rgb_to_hls(rgb):
+    """
+    Hue, lightness and saturation of RGB colors, as colorsys.rgb_to_hls of (r / 255, g / 255, b / 255) but for arrays
+    (same operations, so the same values to the last bit)
+
+    :param rgb: array (..., 3) of R, G, B values, 0..255
+    :return: arrays (...) of hues, lightnesses and saturations in [0, 1]
+    """
+    rgb = np.asarray(rgb, float) / 255
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    maxc = rgb.max(axis=-1)
+    minc = rgb.min(axis=-1)
+    rangec = maxc - minc
+    light = (maxc + minc) / 2.
+    gray = rangec == 0
+    safe_range = np.where(gray, 1., rangec)
+    sat = np.where(light <= 0.5, rangec / np.where(gray, 1., maxc + minc),
+                   rangec / np.where(gray, 1., 2. - maxc - minc))
+    rc, gc, bc = (maxc - r) / safe_range, (maxc - g) / safe_range, (maxc - b) / safe_range
+    hue = np.select([r == maxc, g == maxc], [bc - gc, 2. + rc - bc], 4. + gc - rc)
+    hue = (hue / 6.) % 1.
+    return np.where(gray, 0., hue), light, np.where(gray, 0., sat)
+
+
+def hue_index(rgb):
+    """
+    Index of the hue of RGB colors in HUE_NAMES: the hue of the nearest color of the color diagram (hues and
+    lightnesses i / 255 for i in 0..254, saturation 250 / 255). Only the 3 x 3 colors of the diagram around the color
+    are compared, with the distance and in the order of the former search over the whole diagram, so the ties are
+    broken the same way.
+
+    :param rgb: array (..., 3) of R, G, B values, 0..255
+    :return: int array (...)
+    """
+    hue, light, sat = rgb_to_hls(rgb)
+    # Values scaled to 0..255 and back, as the former search did
+    hue, light, sat = hue * 255 / 255, light * 255 / 255, sat * 255 / 255
+    offsets = np.arange(-1, 2)
+    i = np.clip(np.rint(hue * 255), 1, 253).astype(int)[..., None, None] + offsets[:, None]  # (..., 3, 1)
+    j = np.clip(np.rint(light * 255), 1, 253).astype(int)[..., None, None] + offsets[None, :]  # (..., 1, 3)
+    similarity = ((i / 255 - hue[..., None, None]) ** 2 + (250 / 255 - sat[..., None, None]) ** 2
+                  + (j / 255 - light[..., None, None]) ** 2) / 3
+    similarity = similarity.reshape(similarity.shape[:-2] + (9,))
+    return i[..., 0, 0] + np.argmin(similarity, axis=-1) // 3  # First minimum, i then j
+
+
+def color_names(rgb):
+    """
+    Names of RGB colors, by a lookup in HUE_NAMES
+
+    :param rgb: array (..., 3) of R, G, B values
+    :return: array (...) of color names
+    """
+    return HUE_NAMES[hue_index(rgb)]
+
+
+# position sur le diagramme des couleurs
+def dominant_position(r, g, b):
+    return int(hue_index((r, g, b)))
+
+
+def what_is_this_color(triplet):
+    return str(color_names(triplet))
+
+
+def color_clusters(img,nclusters):
+    # les samples pour cv2.kmean doivent être sous dorme d'une unique colonne
+    pixels = np.float32(img.reshape(-1, 3))
+    # définition du critère de terminaision pour l'algo itératif cv2.kmean
+    # dès que la precision eps est atteinte ou des que le nombre max d'iteraitions est atteinte
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1.)
+    # pour ruptures de lignes :
+    flags = cv2.KMEANS_RANDOM_CENTERS
+    _, labels, centers = cv2.kmeans(pixels, nclusters, None, criteria, 10, flags)
+    return labels, centers
+
+
+def color_diagram_data(img,labels):
+    # counts : nombre de fois que chaque couleur apparaît :
+    _, counts = np.unique(labels, return_counts=True)
+    # indices (0: couleur dominante, nclusters-1 : couleur minoritaire)
+    indices = np.argsort(counts)[::-1]
+    # fréquences cumulées d'apparition des couleurs (dominantes d'abord, minoritaires après):
+    freqs = np.cumsum(np.hstack([[0], counts[indices] / counts.sum()]))
+    # nombre de lignes corresppndant pour chaque couleur
+    rows = np.int_(img.shape[0] * freqs)
+    return rows, indices
+
+
+# quantification des couleurs : réduction du nombre de couleurs de l'image
+def average_dominant(img,nclusters):
+    labels, centers = color_clusters(img,nclusters)
+    rows, indices = color_diagram_data(img,labels)
+    liste_legende=[]
+    for i in range(len(rows) - 1):
+        dominant = centers[indices[i]]
+        [B, G, R] = dominant
+        dominant = [int(R), int(G), int(B)]
+        liste_legende.append(dominant)
+    return liste_legende
+
+
+def object_color_stats(img, mask, min_area=0, nb_hue_bins=16, min_saturation=40):
+    """
+    Color statistics of all the objects of an image in one pass: the objects are labelled once
+    (connectedComponentsWithStats), the image is converted to HSV once and the statistics of all the labels are
+    weighted sums computed with np.bincount.
+
+    :param img: BGR image
+    :param mask: binary image of the objects (non-zero pixels)
+    :param min_area: minimum area of an object in pixels
+    :param nb_hue_bins: number of bins of the hue histograms (dividing 256)
+    :param min_saturation: pixels less saturated (gray, black or white) are not counted in the hue statistics
+    :return: dictionary of arrays with a row for each object:
+        - 'area', 'bbox' (x, y, width, height), 'center' (x, y)
+        - 'mean_hue' (circular mean), 'median_hue', 'dominant_hue': hue on 0..255 (full circle)
+        - 'mean_saturation', 'median_saturation', 'mean_value', 'median_value': 0..255
+        - 'hue_histogram': (number of objects, nb_hue_bins) counts of the saturated pixels
+        - 'name': color name of the dominant hue (see HUE_NAMES)
+    """
+    nb_labels, labels, stats, centroids = cv2.connectedComponentsWithStats((mask > 0).view(np.uint8), connectivity=8)
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV_FULL)
+
+    objects = np.flatnonzero(stats[:, cv2.CC_STAT_AREA] >= max(min_area, 1))
+    objects = objects[objects > 0]  # Label 0 is the background
+
+    flat_labels = labels.ravel()
+    pixels = flat_labels > 0
+    object_labels = flat_labels[pixels]
+    h, s, v = (hsv[..., i].ravel()[pixels] for i in range(3))
+
+    counts = np.maximum(np.bincount(object_labels, minlength=nb_labels), 1)
+
+    # Full 256-bin histograms of each label, for the medians
+    def medians(channel):
+        histograms = np.bincount(object_labels * 256 + channel, minlength=nb_labels * 256).reshape(nb_labels, 256)
+        cumulated = np.cumsum(histograms, axis=1)
+        return np.argmax(cumulated >= (cumulated[:, -1:] + 1) // 2, axis=1)
+
+    saturated = s >= min_saturation
+    sat_labels = object_labels[saturated]
+    sat_h = h[saturated]
+    angles = sat_h * (2 * np.pi / 256)
+    cos_sum = np.bincount(sat_labels, np.cos(angles), nb_labels)
+    sin_sum = np.bincount(sat_labels, np.sin(angles), nb_labels)
+    mean_hue = (np.arctan2(sin_sum, cos_sum) * 256 / (2 * np.pi)) % 256
+
+    bin_size = 256 // nb_hue_bins
+    bins = sat_labels * nb_hue_bins + sat_h // bin_size
+    hue_histograms = np.bincount(bins, minlength=nb_labels * nb_hue_bins).reshape(nb_labels, nb_hue_bins)
+    hue_sums = np.bincount(bins, sat_h, nb_labels * nb_hue_bins).reshape(nb_labels, nb_hue_bins)
+    # Dominant hue: mean hue of the most populated bin
+    peak = np.argmax(hue_histograms, axis=1)
+    rows = np.arange(nb_labels)
+    dominant_hue = hue_sums[rows, peak] / np.maximum(hue_histograms[rows, peak], 1)
+
+    # HUE_NAMES is indexed by 255 * hue, the full-range hue of OpenCV is 256 * hue
+    names = HUE_NAMES[np.clip(np.round(dominant_hue * 255 / 256), 0, 254).astype(int)]
+
+    return {'area': stats[objects, cv2.CC_STAT_AREA],
+            'bbox': stats[objects, :4],
+            'center': centroids[objects],
+            'mean_hue': mean_hue[objects],
+            'median_hue': medians(h)[objects],
+            'dominant_hue': dominant_hue[objects],
+            'mean_saturation': (np.bincount(object_labels, s, nb_labels) / counts)[objects],
+            'median_saturation': medians(s)[objects],
+            'mean_value': (np.bincount(object_labels, v, nb_labels) / counts)[objects],
+            'median_value': medians(v)[objects],
+            'hue_histogram': hue_histograms[objects],
+            'name': names[objects]}
+
+
+@functools.lru_cache(maxsize=4)
+def build_color_lut(bits=5, min_saturation=60, min_value=50):
+    """
+    Lookup table of the color class (index in COLOR_CLASSES) of every color of a quantized RGB cube, built once
+
+    :param bits: bits kept of each channel, 5 for a 32x32x32 cube, 8 for the full 256x256x256 cube
+    :param min_saturation: less saturated colors (gray, white) are in class 0
+    :param min_value: darker colors (black) are in class 0
+    :return: uint8 array (2**bits, 2**bits, 2**bits) indexed by the quantized (B, G, R)
+    """
+    size = 1 << bits
+    step = 256 // size
+    levels = np.arange(size, dtype=np.uint8) * step + step // 2  # Color at the center of each cell
+    b, g, r = np.meshgrid(levels, levels, levels, indexing='ij')
+    cube = np.stack([b, g, r], axis=-1).reshape(-1, 1, 3)
+    hsv = cv2.cvtColor(cube, cv2.COLOR_BGR2HSV_FULL).reshape(-1, 3)
+
+    # HUE_NAMES is indexed by 255 * hue, the full-range hue of OpenCV is 256 * hue
+    hue_indexes = np.clip(np.round(hsv[:, 0] * (255 / 256)), 0, 254).astype(int)
+    lut = _HUE_CLASSES[hue_indexes]
+    lut[(hsv[:, 1] < min_saturation) | (hsv[:, 2] < min_value)] = 0
+    return lut.reshape(size, size, size)
+
+
+def classify_pixels(img, lut, dst=None):
+    """
+    Color class of each pixel of an image, by a single lookup in a table of build_color_lut
+
+    :param img: BGR image
+    :param lut: lookup table of build_color_lut
+    :param dst: uint8 array of the size of the image for the result (allocated if None)
+    :return: uint8 array of the size of the image, class of each pixel (index in COLOR_CLASSES)
+    """
+    bits = lut.shape[0].bit_length() - 1
+    quantized = img >> (8 - bits)
+    index = quantized[..., 0].astype(np.intp) << (2 * bits)
+    index |= quantized[..., 1].astype(np.intp) << bits
+    index |= quantized[..., 2]
+    if dst is None:
+        dst = np.empty(index.shape, np.uint8)
+    np.take(lut.ravel(), index, out=dst)
+    return dst
+
+
+def class_contours(class_map, min_area=0):
+    """
+    Contours of the objects of each color class
+
+    :param class_map: class of each pixel (see classify_pixels)
+    :param min_area: minimum area of an object in pixels
+    :return: dictionary {class name: list of contours}, only for the classes in the image (not class 0)
+    """
+    contours_by_class = {}
+    present = np.flatnonzero(np.bincount(class_map.ravel(), minlength=len(COLOR_CLASSES)))
+    for class_id in present[present > 0]:
+        mask = cv2.compare(class_map, int(class_id), cv2.CMP_EQ)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        contours = [cnt for cnt in contours if cv2.contourArea(cnt) >= min_area]
+        if contours:
+            contours_by_class[COLOR_CLASSES[class_id]] = contours
+    return contours_by_class
+
+
+@functools.lru_cache(maxsize=1)
+def class_palette():
+    """BGR color of each class of COLOR_CLASSES (black for class 0), as a table for cv2.LUT (256 x 1 x 3)"""
+    palette = np.zeros((256, 1, 3), np.uint8)
+    for class_id in range(1, len(COLOR_CLASSES)):
+        hue = np.flatnonzero(_HUE_CLASSES == class_id).mean()
+        if class_id == _HUE_CLASSES[0]:  # Red is on both sides of the hue circle
+            hue = 0
+        palette[class_id, 0] = cv2.cvtColor(np.uint8([[[round(hue * 256 / 255) % 256, 255, 255]]]),
+                                         cv2.COLOR_HSV2BGR_FULL)[0, 0]
+    return palette
+
+
+def display_classes(img, lut, min_area=0):
+    """
+    Image of the color classes of the pixels of an image, with the contours and the names of the objects of each class
+
+    :param img: BGR image
+    :param lut: lookup table of build_color_lut
+    :param min_area: minimum area of an object in pixels
+    :return: BGR image
+    """
+    class_map = classify_pixels(img, lut)
+    classes_img = cv2.LUT(cv2.merge([class_map, class_map, class_map]), class_palette())
+    for name, contours in class_contours(class_map, min_area).items():
+        cv2.drawContours(classes_img, contours, -1, (255, 255, 255), 2)
+        for cnt in contours:
+            x, y, w, h = cv2.boundingRect(cnt)
+            cv2.putText(classes_img, name, (x, y + h // 2), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
+    return classes_img
+
+
+def display_name(mask, img, min_area=0, dst=None):
+    """
+    Write the name of the dominant color of each object of an image
+
+    :param mask: binary image of the objects
+    :param img: BGR image, modified if dst is None
+    :param min_area: minimum area of an object in pixels
+    :param dst: BGR image on which the boxes and the names are drawn (img if None)
+    :return: image with the boxes and the color names of the objects
+    """
+    if dst is None:
+        dst = img
+    stats = object_color_stats(img, mask, min_area)
+    for (x, y, w, h), (cX, cY), char in zip(stats['bbox'], stats['center'], stats['name']):
+        cv2.rectangle(dst, (int(x), int(y)), (int(x + w), int(y + h)), (0, 255, 0), 3)
+        cv2.putText(dst, str(char), (int(cX), int(cY)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+    return dst
@@ -7,11 +7,12 @@ from PyQt5 import Qt as Qt
 from PyQt5 import QtGui as Qtg
 import cv2
 import time
-import colorsys
 
-from Utils import convert_cv_to_qpixmap, Timer, h_line, QLabelLin, midpoint, distance, is_color
-from PreProcessingFunction import func_contours_list, gray_to_binary
+from Utils import convert_cv_to_qpixmap, ImageDisplay, Timer, h_line, QLabelLin, midpoint, distance, is_color, \
+    ProcessingWorker
+from PreProcessingFunction import func_contours_list, gray_to_binary, ProcessingContext
 from FormDetectionFunction import is_outside
+from ColorDetectionFunction import display_name, display_classes, build_color_lut
 
 from Dictionary_EN import *
 
@@ -28,6 +29,7 @@ class ColorDetectionInVideoTab(Qtw.QMainWindow):
         self.get_video_thread.stopped_signal.connect(self.video_stopped)
 
         self.video_qlabel = QLabelLin()
+        self.video_display = ImageDisplay(self.video_qlabel)
         self.video_qlabel.setText(STR_PLS_LAUNCH_ACQUISITION)
         self.setCentralWidget(self.video_qlabel)
 
@@ -39,10 +41,17 @@ class ColorDetectionInVideoTab(Qtw.QMainWindow):
         self.calculate_btn.setEnabled(False)
 
         self.fps_qlabel = Qtw.QLabel()
+        self.latency_qlabel = Qtw.QLabel()
+
+        self.worker = ProcessingWorker(name_colors_in_frame, parent=self)
+        self.worker.result_signal.connect(self.show_result)
 
         self.show_binary_checkbox = Qtw.QCheckBox(STR_SHOW_BINARY_IMAGE)
         self.show_binary_checkbox.setChecked(False)
 
+        self.show_classes_checkbox = Qtw.QCheckBox(STR_SHOW_COLOR_CLASSES)
+        self.show_classes_checkbox.setChecked(False)
+
         self.opening_checkbox = Qtw.QCheckBox(STR_OPENING)
         self.opening_checkbox.setChecked(False)
 
@@ -72,8 +81,10 @@ class ColorDetectionInVideoTab(Qtw.QMainWindow):
         setting_form_layout.addRow(self.calculate_btn)
         setting_form_layout.addRow(h_line())
         setting_form_layout.addRow(STR_FPS, self.fps_qlabel)
+        setting_form_layout.addRow(STR_LATENCY, self.latency_qlabel)
         setting_form_layout.addRow(h_line())
         setting_form_layout.addRow(self.show_binary_checkbox)
+        setting_form_layout.addRow(self.show_classes_checkbox)
         setting_form_layout.addRow(self.opening_checkbox)
         setting_form_layout.addRow(self.closing_checkbox)
         setting_form_layout.addRow(self.blur_checkbox)
@@ -96,6 +107,7 @@ class ColorDetectionInVideoTab(Qtw.QMainWindow):
         self.video_qlabel.setText(STR_PLS_LAUNCH_ACQUISITION)
         self.shown_cv_img = None
         self.fps_qlabel.setText('')
+        self.latency_qlabel.setText('')
         self.calculating = False
         self.calculate_btn.setEnabled(False)
         self.calculate_btn.setText(STR_START_CALCULATION)
@@ -124,6 +136,7 @@ class ColorDetectionInVideoTab(Qtw.QMainWindow):
             self.calculate_btn.setText(STR_START_CALCULATION)
             self.calculating = False
             self.fps_qlabel.setText('')
+            self.latency_qlabel.setText('')
 
     @Qtc.pyqtSlot(np.ndarray)
     def update_video_qlabel(self, cv_img):
@@ -139,21 +152,14 @@ class ColorDetectionInVideoTab(Qtw.QMainWindow):
             self.fps_qlabel.setText(str(int(1 / d_t)))
 
             if self.calculating:
-
-                gray_img = cv2.cvtColor(cv_img, cv2.COLOR_BGR2GRAY)
-
-                #cv2.imshow("Image", mask_img);
-                #cv2.waitKey(0);
-
-
-
-                self.shown_cv_img = display_name(gray_img, cv_img)
-
+                # The processing is done by the worker, the result is shown by show_result
+                self.worker.submit(cv_img, self.threshold_spinbox.value(), self.opening_checkbox.isChecked(),
+                                   self.closing_checkbox.isChecked(), self.blur_checkbox.isChecked(),
+                                   self.min_area_spinbox.value(), self.show_binary_checkbox.isChecked(),
+                                   self.show_classes_checkbox.isChecked())
             else:
                 self.shown_cv_img = cv_img
-
-            qt_img = convert_cv_to_qpixmap(self.shown_cv_img, self.video_qlabel.size())
-            self.video_qlabel.setPixmap(qt_img)
+                self.video_display.show(self.shown_cv_img)
 
         else:
             self.calculating = False
@@ -164,138 +170,46 @@ class ColorDetectionInVideoTab(Qtw.QMainWindow):
             self.video_qlabel.setText(STR_GRAY_TO_COLOR)
             self.shown_cv_img = None
             self.fps_qlabel.setText('')
+            self.latency_qlabel.setText('')
+
+    @Qtc.pyqtSlot(object)
+    def show_result(self, named_img):
+        """Slot connected to the result_signal signal of the ProcessingWorker"""
+        if not self.calculating:
+            return
+        self.shown_cv_img = named_img
+        self.video_display.show(self.shown_cv_img)
+        self.latency_qlabel.setText(f'{self.worker.latency * 1000:.0f} ms')
 
     def resizeEvent(self, event):
         """Overriding the resizeEvent methode for resize the Qlabels containing image each time the main window
          is resized """
         Qtw.QWidget.resizeEvent(self, event)  # Calling the basic resizeEvent of QWidget
         if self.shown_cv_img is not None:
-            qt = convert_cv_to_qpixmap(self.shown_cv_img, self.video_qlabel.size())
-            self.video_qlabel.setPixmap(qt)
-
-
-
-
-
-
-
-def color_clusters(img,nclusters):
-    # les samples pour cv2.kmean doivent être sous dorme d'une unique colonne
-    pixels = np.float32(img.reshape(-1, 3))
-    # définition du critère de terminaision pour l'algo itératif cv2.kmean
-    # dès que la precision eps est atteinte ou des que le nombre max d'iteraitions est atteinte
-    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1.)
-    # pour ruptures de lignes :
-    flags = cv2.KMEANS_RANDOM_CENTERS
-    _, labels, centers = cv2.kmeans(pixels, nclusters, None, criteria, 10, flags)
-    return labels, centers
-
-
-def color_diagram_data(img,labels):
-    # counts : nombre de fois que chaque couleur apparaît :
-    _, counts = np.unique(labels, return_counts=True)
-    # indices (0: couleur dominante, nclusters-1 : couleur minoritaire)
-    indices = np.argsort(counts)[::-1]
-    # fréquences cumulées d'apparition des couleurs (dominantes d'abord, minoritaires après):
-    freqs = np.cumsum(np.hstack([[0], counts[indices] / counts.sum()]))
-    # nombre de lignes corresppndant pour chaque couleur
-    rows = np.int_(img.shape[0] * freqs)
-    return rows, indices
-
-
-# quantification des couleurs : réduction du nombre de couleurs de l'image
-def average_dominant(img,nclusters):
-    labels, centers = color_clusters(img,nclusters)
-    rows, indices = color_diagram_data(img,labels)
-    liste_legende=[]
-    for i in range(len(rows) - 1):
-        dominant = centers[indices[i]]
-        [B, G, R] = dominant
-        dominant = [int(R), int(G), int(B)]
-        liste_legende.append(dominant)
-    return liste_legende
-
-
-def hls2rgb(h,l,s):
-    return tuple((i*255) for i in colorsys.hls_to_rgb(h,l,s))
-
-
-def rgb2hls(r,g,b):
-    return tuple((i*255) for i in colorsys.rgb_to_hls(r,g,b))
-
-
-# position sur le diagramme des couleurs
-def dominant_position(r, g, b):
-    print(r,g,b)
-    imgHL = np.zeros((255,255,3))
-    [h,l,s]=rgb2hls(r/255,g/255,b/255)
-    h,l,s=h/255,l/255,s/255
-    min=10
-    imin=0
-    jmin=0
-    for i in range(255):
-        for j in range(255):
-            H=i/255
-            S=250/255
-            L=j/255
-            [R,G,B]=hls2rgb(H,L,S)
-            imgHL[i, j, 0] = R/255
-            imgHL[i, j, 1] = G/255
-            imgHL[i, j, 2] = B/255
-            similarity = ((H-h)**2 +(S-s)**2 +(L-l)**2)/3
-            if similarity<min:
-                min=similarity
-                imin=i
-                jmin=j
-    return imin
-
-
-def dominant_color(i):
-    if i<=15:
-        char = 'red'
-    if i>15 and i<=35:
-        char = 'orange'
-    if i>35 and i<=45:
-        char = 'yellow'
-    if i>45 and i<=110:
-        char = 'green'
-    if i>110 and i<=120:
-        char = 'blue-green'
-    if i>120 and i<=135:
-        char = 'cyan'
-    if i>135 and i<=180:
-        char = 'blue'
-    if i>180 and i<=205:
-        char = 'purple'
-    if i>205 and i<=245:
-        char = 'pink'
-    if i>245:
-        char = 'red'
-    return char
-
-
-def what_is_this_color(triplet):
-    [r,g,b] = triplet
-    i = dominant_position(r, g, b)
-    char = dominant_color(i)
-    return char
-
-
-def display_name(mask,img):
-    contours, _ = cv2.findContours(mask, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE);
-    print(len(contours))
-    for c in contours:
-        mask[:] = 0;
-        mask = cv2.drawContours(mask, [c], -1, 255, -1);
-        one_color = img.copy()
-        one_color[mask != 255] = (0, 0, 0);
-        dominant_list = average_dominant(one_color, 2)
-        char = what_is_this_color(dominant_list[1])
-        M = cv2.moments(c)
-        cX = int(M["m10"] / M["m00"])
-        cY = int(M["m01"] / M["m00"])
-        cv2.drawContours(img, [c], -1, (0, 255, 0), 3)
-        cv2.putText(img, char, (cX, cY), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-    return img
-    #cv2.imshow("Image", img);
-    #cv2.waitKey(0);
\ No newline at end of file
+            self.video_display.show(self.shown_cv_img)
+
+
+
+
+
+
+
+_CONTEXT = ProcessingContext()
+
+
+def name_colors_in_frame(cv_img, threshold, opening, closing, blur, min_area, show_binary, show_classes=False):
+    """
+    Write the name of the color of each object of a color frame. Called in the threads of the ProcessingWorker of
+    ColorDetectionInVideoTab.
+
+    :param show_classes: return the map of the color class of each pixel, with the objects of each class
+    :return: frame (or binary image) with the boxes and the color names of the objects
+    """
+    if show_classes:
+        return display_classes(cv_img, build_color_lut(), min_area)
+
+    gray_img = _CONTEXT.run(cv2.cvtColor, cv_img, cv2.COLOR_BGR2GRAY)
+    binary_img = gray_to_binary(gray_img, threshold, opening, closing, blur, _CONTEXT)
+    if show_binary:
+        return display_name(binary_img, cv_img, min_area, dst=cv2.merge([binary_img, binary_img, binary_img]))
+    return display_name(binary_img, cv_img, min_area, dst=cv_img.copy())  # The frame is shared with the other tabs
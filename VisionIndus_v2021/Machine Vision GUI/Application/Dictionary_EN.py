@@ -41,16 +41,31 @@ STR_CALCULATE = 'Calculate'
 STR_TAKE_SCREENSHOT = 'Take screenshot'
 STR_SAVE_SCREENSHOT = 'Save screenshot'
 STR_NEW_AOI = 'New AOI'
+STR_SENSOR_AOI = 'Sensor AOI (faster readout)'
 STR_GRAYSACLE = 'Grayscacle'
 STR_RGB = 'RGB'
 STR_SAVE_IMAGE = 'Select a folder and enter a file name'
 STR_IMAGE_FORMAT = 'Images (*.png '' *.jpg)'
+STR_LARGE_IMAGE_FORMAT = 'Images (*.png *.jpg *.bmp *.tif *.pgm *.ppm *.npy *.raw)'
+STR_RECORD_VIDEO = 'Record video'
+STR_STOP_RECORD = 'Stop record'
+STR_RECORD_FORMAT = 'Raw record (*.raw)'
+STR_SAVE_RECIPE = 'Save recipe'
+STR_LOAD_RECIPE = 'Load recipe'
+STR_RECIPE_FORMAT = 'Recipe (*.json)'
+STR_EXPORT_TIMINGS = 'Export stage timings'
+STR_CSV_FORMAT = 'CSV (*.csv)'
+STR_HISTORY_MEMORY = 'History memory: '
+STR_FRAMES = 'frames'
+STR_FRAMES_DROPPED = 'dropped'
+STR_FRAMES_MISSED = 'missed'
 STR_STOP_VIDEO = 'Stop video'
 STR_START_VIDEO = 'Start video'
 STR_MAX = 'max'
 STR_MIN = 'min'
 STR_SELECT_CAMERA_AND_CLICK = 'Please select a camera in the list and click on select'
 STR_SELECT_CAMERA = 'Select a camera...'
+STR_SYNTHETIC_CAMERA = 'Synthetic camera (no camera connected)'
 STR_ID = 'ID: '
 STR_SER_NO = ', Serial No: '
 STR_MODEL = ', Model: '
@@ -124,12 +139,33 @@ STR_NO = 'NO'
 STR_DETECTED_SHAPE = 'Detected shape:'
 STR_IS_IT_TRUE = 'Is it true?'
 STR_SHOW_BINARY_IMAGE = "Show binary image"
+STR_SHOW_COLOR_CLASSES = 'Show color classes'
 STR_FPS = 'FPS'
+STR_LATENCY = 'Latency'
+STR_PROCESSING = 'Processing'
+STR_DISPLAY = 'Display'
+STR_COUNTING_LINE = 'Counting line'
+STR_COUNTED_OBJECTS = 'Counted objects:'
+STR_RESET_COUNT = 'Reset count'
 STR_MEASUREMENT_IN_VIDEO = 'Measurement in video'
 STR_NEW_SCALE = 'New scale'
 STR_NB_PIXELS = 'Nb pixels'
 STR_DISTANCE = 'Corresponding distance [µm]'
 STR_SCALE = 'Scale [mm/pix]'
+STR_CALIBRATION = 'Calibration'
+STR_CHECKERBOARD_CORNERS = 'Inner corners (columns x rows)'
+STR_SQUARE_SIZE = 'Square size [mm]'
+STR_CAPTURE_CHECKERBOARD = 'Capture checkerboard view'
+STR_CHECKERBOARD_NOT_FOUND = 'Checkerboard not found in the frame'
+STR_CALIBRATE = 'Calibrate'
+STR_LOAD_CALIBRATION = 'Load calibration'
+STR_CALIBRATION_FORMAT = 'Calibration (*.json)'
+STR_NO_CALIBRATION = 'No calibration'
+STR_USE_CALIBRATION = 'Measure with the calibration'
+STR_UNDISTORT_FRAMES = 'Undistort the whole frames'
+STR_VIEWS = 'views'
+STR_SUBPIXEL_EDGES = 'Measure on the sub-pixel edges'
+STR_SEPARATE_PROCESS = 'Measure in a separate process'
 STR_COLOR_DETECTION_IN_VIDEO = 'Color detection in video'
 STR_COLOR_TO_GRAY = 'Change color to gray scale'
 STR_PLS_LAUNCH_ACQUISITION = 'Please, start the acquisition'
@@ -144,6 +180,8 @@ STR_ARM_HEIGHT = 'Height'
 STR_UV = 'UV'
 STR_MAIN_SETTING = 'Main settings'
 STR_AUTO_DARK_RING = 'Auto Dark Ring'
+STR_SNAPSHOTS_FOLDER = 'Snapshots folder:'
+STR_CHANGE_FOLDER = 'Change folder'
 STR_MAX_SURFACE = 'Max area:'
 
 
@@ -41,16 +41,31 @@ STR_CALCULATE = 'Calculer'
 STR_TAKE_SCREENSHOT = 'Prendre un screenshot'
 STR_SAVE_SCREENSHOT = 'Enregistrer le screenshot'
 STR_NEW_AOI = 'Nouvelle AOI'
+STR_SENSOR_AOI = 'AOI du capteur (lecture plus rapide)'
 STR_GRAYSACLE = 'Niveau de gris'
 STR_RGB = 'RVB'
 STR_SAVE_IMAGE = 'Selectionner un dossier et entrer un nom de fichier'
 STR_IMAGE_FORMAT = 'Images (*.png '' *.jpg)'
+STR_LARGE_IMAGE_FORMAT = 'Images (*.png *.jpg *.bmp *.tif *.pgm *.ppm *.npy *.raw)'
+STR_RECORD_VIDEO = 'Enregistrer la video'
+STR_STOP_RECORD = "Arrêter l'enregistrement"
+STR_RECORD_FORMAT = 'Enregistrement brut (*.raw)'
+STR_SAVE_RECIPE = 'Enregistrer la recette'
+STR_LOAD_RECIPE = 'Charger une recette'
+STR_RECIPE_FORMAT = 'Recette (*.json)'
+STR_EXPORT_TIMINGS = 'Exporter les durées des étapes'
+STR_CSV_FORMAT = 'CSV (*.csv)'
+STR_HISTORY_MEMORY = "Mémoire de l'historique: "
+STR_FRAMES = 'images'
+STR_FRAMES_DROPPED = 'perdues'
+STR_FRAMES_MISSED = 'manquées'
 STR_STOP_VIDEO = 'Arrêter la  video'
 STR_START_VIDEO = 'Démarer la video'
 STR_MAX = 'max'
 STR_MIN = 'min'
 STR_SELECT_CAMERA_AND_CLICK = 'Sélectionner une caméra dans la liste et cliquer sur sélectionner'
 STR_SELECT_CAMERA = 'Séletionner une caméra...'
+STR_SYNTHETIC_CAMERA = 'Caméra simulée (aucune caméra connectée)'
 STR_ID = 'ID: '
 STR_SER_NO = ', Serial No: '
 STR_MODEL = ', Model: '
@@ -125,12 +140,33 @@ STR_NO = 'NON'
 STR_DETECTED_SHAPE = 'Forme detectée:'
 STR_IS_IT_TRUE = 'Est-ce vrai?'
 STR_SHOW_BINARY_IMAGE = 'Afficher l''image binarisée'
+STR_SHOW_COLOR_CLASSES = 'Afficher les classes de couleur'
 STR_FPS = 'FPS'
+STR_LATENCY = 'Latence'
+STR_PROCESSING = 'Traitement'
+STR_DISPLAY = 'Affichage'
+STR_COUNTING_LINE = 'Ligne de comptage'
+STR_COUNTED_OBJECTS = 'Objets comptés :'
+STR_RESET_COUNT = 'Remettre à zéro'
 STR_MEASUREMENT_IN_VIDEO = 'Mesure sur la video'
 STR_NEW_SCALE = 'Nouvelle échelle'
 STR_NB_PIXELS = 'Nb pixels'
 STR_DISTANCE = 'Distance correspondante [µm]'
 STR_SCALE = 'Echelle [mm/px]'
+STR_CALIBRATION = 'Calibration'
+STR_CHECKERBOARD_CORNERS = 'Coins intérieurs (colonnes x lignes)'
+STR_SQUARE_SIZE = 'Taille des cases [mm]'
+STR_CAPTURE_CHECKERBOARD = 'Capturer une vue du damier'
+STR_CHECKERBOARD_NOT_FOUND = "Damier non trouvé dans l'image"
+STR_CALIBRATE = 'Calibrer'
+STR_LOAD_CALIBRATION = 'Charger une calibration'
+STR_CALIBRATION_FORMAT = 'Calibration (*.json)'
+STR_NO_CALIBRATION = 'Pas de calibration'
+STR_USE_CALIBRATION = 'Mesurer avec la calibration'
+STR_UNDISTORT_FRAMES = 'Corriger la distorsion des images entières'
+STR_VIEWS = 'vues'
+STR_SUBPIXEL_EDGES = 'Mesurer sur les bords au sous-pixel'
+STR_SEPARATE_PROCESS = 'Mesurer dans un processus séparé'
 STR_COLOR_DETECTION_IN_VIDEO = 'Détection de couleur sur la video'
 STR_COLOR_TO_GRAY = 'Changez la couleur en niveau de gris'
 STR_PLS_LAUNCH_ACQUISITION = 'Veuillez lancer l''acquisition'
@@ -145,4 +181,6 @@ STR_ARM_HEIGHT = 'Hauteur'
 STR_UV = 'UV'
 STR_MAIN_SETTING = 'Paramètre généraux'
 STR_AUTO_DARK_RING = 'Auto Dark Ring'
+STR_SNAPSHOTS_FOLDER = 'Dossier des photos :'
+STR_CHANGE_FOLDER = 'Changer de dossier'
 STR_MAX_SURFACE = 'Aire max:'
@@ -2,11 +2,21 @@ import numpy as np
 import cv2
 import csv
 import os
+import threading
 
 from Dictionary_EN import *
 from PreProcessingFunction import func_contours_list
 
 SHAPES_NAME_LIST = [STR_SQUARE, STR_TRIANGLE, STR_STAR, STR_CIRCLE, STR_HEXAGON, STR_PENTAGON]
+TEMPLATE_IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+# Hu moments smaller than these are ignored. cv2.matchShapes ignores the moments smaller than 1e-5 of the 8-bit images
+# of the shapes (pixels at 255), the same thresholds for the moments of the binary shapes or of the contours. A
+# normalized moment eta_pq of the binary shape is 255**((p + q) / 2) times the one of the 8-bit image, so a Hu moment
+# scales with 255 to the power of the sum of (p + q) / 2 over the normalized moments it multiplies.
+HU_EPS = 1.e-5 * 255. ** np.array([1, 2, 3, 3, 6, 4, 6])
+
+_template_indexes = {}
+_template_indexes_lock = threading.Lock()
 
 
 def sort_shapes(index_detected_shapes_list):
@@ -19,14 +29,50 @@ def sort_shapes(index_detected_shapes_list):
 
 
 def shape_2b_tested(img, cnt):
+    """Image of a filled contour, cropped with a margin. Only the cropped area is allocated and drawn."""
     x_min, x_max, y_min, y_max = coordinates(cnt)
-    shape_img = np.zeros(img.shape, np.uint8)
-    cv2.drawContours(shape_img, [cnt], 0, 255, -1)
-    shape_img = crop_image_w_margin(shape_img, x_min, x_max, y_min, y_max)
+    x0, x1, y0, y1 = margin_limits(img.shape, x_min, x_max, y_min, y_max)
+    shape_img = np.zeros((max(y1 - y0, 0), max(x1 - x0, 0)), np.uint8)
+    cv2.drawContours(shape_img, [cnt], 0, 255, -1, offset=(-int(x0), -int(y0)))
 
     return shape_img
 
 
+def get_shape_features(contours_list):
+    """
+    Features of shapes computed from their contours only, no image of the shapes is drawn
+
+    :param contours_list: list of contours
+    :return: dictionary of arrays with a row for each contour:
+        - 'center': (x, y) of the center of mass
+        - 'area', 'perimeter': in pixels
+        - 'hu': log-scaled Hu moments (see log_hu_moments)
+        - 'convexity': area of the shape / area of its convex hull
+        - 'nb_vertices': number of vertices of the approximated polygon
+    """
+    nb_shapes = len(contours_list)
+    features = {'center': np.zeros((nb_shapes, 2)), 'area': np.zeros(nb_shapes), 'perimeter': np.zeros(nb_shapes),
+                'hu': np.full((nb_shapes, 7), np.nan), 'convexity': np.zeros(nb_shapes),
+                'nb_vertices': np.zeros(nb_shapes, int)}
+
+    for i, cnt in enumerate(contours_list):
+        m = cv2.moments(cnt)
+        area = m['m00']
+        perimeter = cv2.arcLength(cnt, True)
+        features['area'][i] = area
+        features['perimeter'][i] = perimeter
+        if area > 0:
+            features['center'][i] = m['m10'] / area, m['m01'] / area
+        else:
+            features['center'][i] = cnt[0, 0]
+        features['hu'][i] = log_hu_moments(cnt, m)
+        hull_area = cv2.contourArea(cv2.convexHull(cnt))
+        features['convexity'][i] = area / hull_area if hull_area > 0 else 0
+        features['nb_vertices'][i] = len(cv2.approxPolyDP(cnt, 0.02 * perimeter, True))
+
+    return features
+
+
 def cv2_to_outline(filename):
     outline = []
     file = open(filename, 'r')
@@ -48,15 +94,109 @@ def what_is_this_shape(shape, test_shapes_list):
     return np.argmin(sim_coef_list)
 
 
-def identify_shapes(shape_list, directory):
-    detected_shapes_index_list = []
-    test_shapes_list = get_test_img(directory)
+def log_hu_moments(shape, moments=None):
+    """
+    Log-scaled Hu moments of a shape, the values compared by cv2.matchShapes
+
+    :param shape: binary image of the shape (all the non-zero pixels belong to the shape) or contour
+    :param moments: moments of the shape if they are already computed
+    :return: array of 7 values sign(h) * log10(|h|), NaN for the moments too small to be compared
+    """
+    if moments is None:
+        # binaryImage: the moments of an image of the shape are the ones of its contour, whatever the pixel values
+        moments = cv2.moments(shape, True)
+    hu = cv2.HuMoments(moments).ravel()
+    abs_hu = np.abs(hu)
+    log_hu = np.full(7, np.nan)
+    valid = abs_hu > HU_EPS
+    log_hu[valid] = np.sign(hu[valid]) * np.log10(abs_hu[valid])
+    return log_hu
+
+
+class ShapeTemplateIndex:
+    """
+    Log-scaled Hu moments of all the test shapes of a directory: every image (or csv outline) of the folder of each
+    shape, not only the first one. Built once by get_template_index, which rebuilds it when the folders change.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.signature = template_signature(directory)
+        hu_list = []
+        class_list = []
+        for shape_index, shape_name in enumerate(SHAPES_NAME_LIST):
+            for filename in template_files(directory, shape_name):
+                if filename.lower().endswith('.csv'):
+                    shape = cv2_to_outline(filename)[0].astype(np.int32)
+                else:
+                    shape = cv2.imread(filename, cv2.IMREAD_GRAYSCALE)
+                    if shape is None:
+                        continue
+                    shape = cv2.threshold(shape, 127, 255, cv2.THRESH_BINARY)[1]  # Removes the jpeg artifacts
+                hu_list.append(log_hu_moments(shape))
+                class_list.append(shape_index)
+        self.hu = np.array(hu_list).reshape(-1, 7)
+        self.classes = np.array(class_list, int)
+
+    def classify(self, hu):
+        """
+        Nearest test shape of each shape, with the distance of cv2.matchShapes (CONTOURS_MATCH_I2)
+
+        :param hu: array (number of shapes, 7) of log-scaled Hu moments
+        :return: array of shape indexes in SHAPES_NAME_LIST
+        """
+        if len(hu) == 0 or len(self.hu) == 0:
+            return np.zeros(len(hu), int)
+        # Distance between every shape and every test shape, the moments too small in one of them are skipped
+        diff = np.abs(hu[:, None, :] - self.hu[None, :, :])
+        distances = np.where(np.isnan(diff), 0, diff).sum(axis=2)
+        return self.classes[np.argmin(distances, axis=1)]
+
+
+def template_files(directory, shape_name):
+    folder = os.path.join(directory, shape_name)
+    if not os.path.isdir(folder):
+        return []
+    # Test images first: the csv outlines are only used if the folder has no image, as before with the first image
+    files = sorted(os.listdir(folder))
+    img_files = [f for f in files if f.lower().endswith(TEMPLATE_IMG_EXTENSIONS)]
+    if not img_files:
+        img_files = [f for f in files if f.lower().endswith('.csv')]
+    return [os.path.join(folder, f) for f in img_files]
+
+
+def template_signature(directory):
+    """Modification times of the folders of the test shapes, changed when a file is added, removed or renamed"""
+    signature = []
+    for shape_name in SHAPES_NAME_LIST:
+        try:
+            signature.append(os.stat(os.path.join(directory, shape_name)).st_mtime_ns)
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def get_template_index(directory):
+    """Return the ShapeTemplateIndex of a directory, built on the first call and when its folders change"""
+    with _template_indexes_lock:
+        index = _template_indexes.get(directory)
+        if index is None or index.signature != template_signature(directory):
+            index = ShapeTemplateIndex(directory)
+            _template_indexes[directory] = index
+        return index
+
 
-    for shape in shape_list:
-        shape_index = what_is_this_shape(shape, test_shapes_list)
-        detected_shapes_index_list.append(shape_index)
+def identify_shapes(shape_list, directory):
+    """
+    Identify shapes with the test shapes of a directory
 
-    return detected_shapes_index_list
+    :param shape_list: images or contours of the shapes
+    :param directory: directory with a folder of test shapes for each name of SHAPES_NAME_LIST
+    :return: list of shape indexes in SHAPES_NAME_LIST
+    """
+    index = get_template_index(directory)
+    hu = np.array([log_hu_moments(shape) for shape in shape_list]).reshape(-1, 7)
+    return list(index.classify(hu))
 
 
 def get_img_shape_list(img, contours_list=None,):
@@ -108,10 +248,11 @@ def coordinates(cnt):
     return leftmost[0], rightmost[0], topmost[1], bottommost[1]
 
 
-def crop_image_w_margin(img, x_min, x_max, y_min, y_max):
+def margin_limits(img_shape, x_min, x_max, y_min, y_max):
+    """Limits (x0, x1, y0, y1) of the crop of crop_image_w_margin"""
     px = int((x_max - x_min) / 32)
     py = int((y_max - y_min) / 32)
-    Y, X = img.shape
+    Y, X = img_shape[:2]
     if y_max + py >= Y:
         py = Y - y_max
     if x_max + px >= X:
@@ -120,7 +261,11 @@ def crop_image_w_margin(img, x_min, x_max, y_min, y_max):
         px = x_min
     if y_min - py <= 0:
         py = y_min
-    img4 = crop_image(img, x_min - px, x_max + px, y_min - py, y_max + py)
+    return x_min - px, x_max + px, y_min - py, y_max + py
+
+
+def crop_image_w_margin(img, x_min, x_max, y_min, y_max):
+    img4 = crop_image(img, *margin_limits(img.shape, x_min, x_max, y_min, y_max))
     return img4
 
 
@@ -133,11 +133,7 @@ class TrainTab(Qtw.QWidget):
                                                          Qtw.QFileDialog.DontResolveSymlinks)
         if directory != '':
             for cnt in self.contours_list:
-                x_min, x_max, y_min, y_max = coordinates(cnt)
-
-                shape_img = np.zeros(self.img_cv.shape, np.uint8)
-                cv2.drawContours(shape_img, [cnt], 0, 255, -1)
-                shape_img = crop_image_w_margin(shape_img, x_min, x_max, y_min, y_max)
+                shape_img = shape_2b_tested(self.img_cv, cnt)
 
                 shape_img = convert_CV_64F_to_uint8(shape_img)
 
@@ -9,10 +9,11 @@ import cv2
 import time
 
 
-from Utils import convert_cv_to_qpixmap, Timer, h_line, is_gray
+from Utils import convert_cv_to_qpixmap, ImageDisplay, Timer, h_line, is_gray, ProcessingWorker
 from PreProcessingFunction import func_closing, func_opening, func_simple_thresholding, func_otsu_thresholding, \
-    func_contours_list, func_gaus_blurring, gray_to_binary
-from FormDetectionFunction import identify_shapes, SHAPES_NAME_LIST, get_img_shape_list, is_outside
+    func_components_list, func_gaus_blurring, gray_to_binary, ProcessingContext
+from FormDetectionFunction import get_template_index, get_shape_features, SHAPES_NAME_LIST
+from tracking import ObjectTracker
 
 from Dictionary_EN import *
 
@@ -31,6 +32,7 @@ class FormDetectionInVideoTab(Qtw.QMainWindow):
         self.get_video_thread.stopped_signal.connect(self.video_stopped)
 
         self.video_qlabel = Qtw.QLabel()
+        self.video_display = ImageDisplay(self.video_qlabel)
         self.setCentralWidget(self.video_qlabel)
 
         self.setting_dock = Qtw.QDockWidget('Setting', self)
@@ -41,6 +43,22 @@ class FormDetectionInVideoTab(Qtw.QMainWindow):
         self.calculate_btn.setEnabled(False)
 
         self.fps_qlabel = Qtw.QLabel()
+        self.latency_qlabel = Qtw.QLabel()
+
+        # The shapes are followed from frame to frame, the frames must be processed in their order (a single thread)
+        self.tracker = ObjectTracker()
+        self.worker = ProcessingWorker(detect_shapes_in_frame, max_workers=1, parent=self)
+        self.worker.result_signal.connect(self.show_result)
+
+        self.counting_checkbox = Qtw.QCheckBox(STR_COUNTING_LINE)
+        self.counting_checkbox.setChecked(False)
+        self.line_position_spinbox = Qtw.QSpinBox()
+        self.line_position_spinbox.setRange(0, 100)
+        self.line_position_spinbox.setValue(50)
+        self.line_position_spinbox.setSuffix(' %')
+        self.count_qlabel = Qtw.QLabel('0')
+        self.reset_count_btn = Qtw.QPushButton(STR_RESET_COUNT)
+        self.reset_count_btn.clicked.connect(self.reset_count)
 
         self.show_binary_checkbox = Qtw.QCheckBox(STR_SHOW_BINARY_IMAGE)
         self.show_binary_checkbox.setChecked(False)
@@ -84,6 +102,7 @@ class FormDetectionInVideoTab(Qtw.QMainWindow):
         setting_form_layout.addRow(self.calculate_btn)
         setting_form_layout.addRow(h_line())
         setting_form_layout.addRow(Qtw.QLabel(STR_FPS), self.fps_qlabel)
+        setting_form_layout.addRow(Qtw.QLabel(STR_LATENCY), self.latency_qlabel)
         setting_form_layout.addRow(h_line())
         setting_form_layout.addRow('Current directory:', self.directory_qlabel)
         setting_form_layout.addRow(self.directory_qlabel)
@@ -97,6 +116,10 @@ class FormDetectionInVideoTab(Qtw.QMainWindow):
         setting_form_layout.addRow(STR_MIN_SURFACE, self.min_area_spinbox)
         setting_form_layout.addRow(STR_MAX_SURFACE, self.max_area_spinbox)
         setting_form_layout.addRow(h_line())
+        setting_form_layout.addRow(self.counting_checkbox, self.line_position_spinbox)
+        setting_form_layout.addRow(STR_COUNTED_OBJECTS, self.count_qlabel)
+        setting_form_layout.addRow(self.reset_count_btn)
+        setting_form_layout.addRow(h_line())
         setting_form_layout.addRow(self.screenshot_btn, self.clipboard_btn)
 
         setting_widget.setLayout(setting_form_layout)
@@ -113,6 +136,7 @@ class FormDetectionInVideoTab(Qtw.QMainWindow):
         self.video_qlabel.setText(STR_PLS_LAUNCH_ACQUISITION)
         self.shown_cv_img = None
         self.fps_qlabel.setText('')
+        self.latency_qlabel.setText('')
         self.calculating = False
         self.calculate_btn.setEnabled(False)
         self.calculate_btn.setText(STR_START_CALCULATION)
@@ -140,6 +164,11 @@ class FormDetectionInVideoTab(Qtw.QMainWindow):
         if self.directory != '':
             self.directory_qlabel.setText(self.directory)
 
+    @Qtc.pyqtSlot()
+    def reset_count(self):
+        self.tracker.reset()
+        self.count_qlabel.setText('0')
+
     @Qtc.pyqtSlot()
     def start_calculation(self):
         if not self.calculating:
@@ -149,6 +178,7 @@ class FormDetectionInVideoTab(Qtw.QMainWindow):
             self.calculate_btn.setText(STR_START_CALCULATION)
             self.calculating = False
             self.fps_qlabel.setText('')
+            self.latency_qlabel.setText('')
 
     @Qtc.pyqtSlot(np.ndarray)
     def update_video_qlabel(self, cv_img):
@@ -163,49 +193,15 @@ class FormDetectionInVideoTab(Qtw.QMainWindow):
             self.fps_qlabel.setText(str(int(1 / d_t)))
 
             if self.calculating:
-
-                binary_img = gray_to_binary(cv_img, self.threshold_spinbox.value(), self.opening_checkbox.isChecked(),
-                                            self.closing_checkbox.isChecked(), self.blur_checkbox.isChecked())
-
-                contours_list = func_contours_list(binary_img, self.min_area_spinbox.value(), self.max_area_spinbox.value())
-
-                if self.show_binary_checkbox.isChecked():
-                    contours_img = cv2.merge([binary_img, binary_img, binary_img])
-                else:
-                    contours_img = cv2.merge([cv_img, cv_img, cv_img])
-
-                good_contours_list = []
-
-                for cnt in contours_list:
-                    if not is_outside(cnt, cv_img.shape):
-                        good_contours_list.append(cnt)
-
-                nb_shapes = len(good_contours_list)
-                img_shapes_list = get_img_shape_list(binary_img, good_contours_list)
-
-                cv2.drawContours(contours_img, good_contours_list, -1, (0, 0, 255), 3)
-
-                detected_shapes_index_list = identify_shapes(img_shapes_list, self.directory)
-
-                for i in range(nb_shapes):
-                    cnt = good_contours_list[i]
-
-                    m = cv2.moments(cnt)
-                    center_x = int(m["m10"] / m["m00"])
-                    center_y = int(m["m01"] / m["m00"])
-
-                    cv2.circle(contours_img, (center_x, center_y), 4, (0, 0, 255), -1)
-
-                    shape_name = SHAPES_NAME_LIST[detected_shapes_index_list[i]]
-                    cv2.putText(contours_img, shape_name, (center_x-55, center_y-10), cv2.FONT_HERSHEY_SIMPLEX,
-                                1, (255, 0, 0), 2, cv2.LINE_AA)
-
-                self.shown_cv_img = contours_img
-
+                # The processing is done by the worker, the result is shown by show_result
+                self.worker.submit(cv_img, self.threshold_spinbox.value(), self.opening_checkbox.isChecked(),
+                                   self.closing_checkbox.isChecked(), self.blur_checkbox.isChecked(),
+                                   self.min_area_spinbox.value(), self.max_area_spinbox.value(),
+                                   self.show_binary_checkbox.isChecked(), self.directory, self.tracker,
+                                   self.line_position_spinbox.value() if self.counting_checkbox.isChecked() else None)
             else:
                 self.shown_cv_img = cv_img
-            qt_img = convert_cv_to_qpixmap(self.shown_cv_img, self.video_qlabel.size())
-            self.video_qlabel.setPixmap(qt_img)
+                self.video_display.show(self.shown_cv_img)
 
         else:
             self.calculating = False
@@ -216,17 +212,89 @@ class FormDetectionInVideoTab(Qtw.QMainWindow):
             self.video_qlabel.setText(STR_COLOR_TO_GRAY)
             self.shown_cv_img = None
             self.fps_qlabel.setText('')
+            self.latency_qlabel.setText('')
+
 
+    @Qtc.pyqtSlot(object)
+    def show_result(self, result):
+        """Slot connected to the result_signal signal of the ProcessingWorker"""
+        if not self.calculating:
+            return
+        contours_img, nb_crossings = result
+        self.count_qlabel.setText(str(nb_crossings))
+        self.shown_cv_img = contours_img
+        self.video_display.show(self.shown_cv_img)
+        self.latency_qlabel.setText(f'{self.worker.latency * 1000:.0f} ms')
 
     def resizeEvent(self, event):
         """Overriding the resizeEvent methode for resize the Qlabels containing image each time the main window
          is resized """
         Qtw.QWidget.resizeEvent(self, event)  # Calling the basic resizeEvent of QWidget
         if self.shown_cv_img is not None:
-            qt = convert_cv_to_qpixmap(self.shown_cv_img, self.video_qlabel.size())
-            self.video_qlabel.setPixmap(qt)
+            self.video_display.show(self.shown_cv_img)
 
 
+_CONTEXT = ProcessingContext()
 
 
+def detect_shapes_in_frame(cv_img, threshold, opening, closing, blur, min_area, max_area, show_binary, directory,
+                           tracker=None, line_position=None):
+    """
+    Detect the shapes of a grayscale frame and identify them with the test shapes of directory. Called in the threads
+    of the ProcessingWorker of FormDetectionInVideoTab.
 
+    :param tracker: ObjectTracker following the shapes, a shape is only identified again when it changes
+    :param line_position: position of the vertical counting line in % of the width (None for no counting)
+    :return: image with the contours, the centers, the IDs and the names of the shapes, number of shapes which
+    crossed the counting line
+    """
+    binary_img = gray_to_binary(cv_img, threshold, opening, closing, blur, _CONTEXT)
+
+    # Objects touching the border of the frame are removed, only the contours of the remaining objects are extracted
+    good_contours_list = func_components_list(binary_img, min_area, max_area, border_margin=5)[0]
+
+    if show_binary:
+        contours_img = cv2.merge([binary_img, binary_img, binary_img])
+    else:
+        contours_img = cv2.merge([cv_img, cv_img, cv_img])
+
+    nb_shapes = len(good_contours_list)
+    # The shapes are identified from the moments of their contours, no image of the shapes is needed
+    features = get_shape_features(good_contours_list)
+
+    cv2.drawContours(contours_img, good_contours_list, -1, (0, 0, 255), 3)
+
+    if tracker is None:
+        detected_shapes_index_list = get_template_index(directory).classify(features['hu'])
+        labels = [SHAPES_NAME_LIST[i] for i in detected_shapes_index_list]
+        nb_crossings = 0
+    else:
+        height, width = cv_img.shape[:2]
+        if line_position is None:
+            tracker.line = None
+        else:
+            x = line_position * (width - 1) / 100
+            tracker.set_line((x, height - 1), (x, 0))
+            cv2.line(contours_img, (int(x), 0), (int(x), height - 1), (0, 255, 0), 2)
+        boxes = [cv2.boundingRect(cnt) for cnt in good_contours_list]
+        tracks = tracker.update(features['center'], boxes)
+
+        # Only the new shapes and the ones which changed are identified
+        to_update = [i for i in range(nb_shapes) if tracks[i].needs_update('shape')]
+        if to_update:
+            indexes = get_template_index(directory).classify(features['hu'][to_update])
+            for i, shape_index in zip(to_update, indexes):
+                tracks[i].set_result('shape', SHAPES_NAME_LIST[shape_index])
+        labels = [f'#{track.id} {track.get_result("shape")}' for track in tracks]
+        # Net count: the belt can move in both directions, an object going back and forth is counted once
+        nb_crossings = abs(tracker.nb_crossings - tracker.nb_crossings_back)
+
+    for i in range(nb_shapes):
+        center_x, center_y = features['center'][i].astype(int)
+
+        cv2.circle(contours_img, (center_x, center_y), 4, (0, 0, 255), -1)
+
+        cv2.putText(contours_img, labels[i], (center_x-55, center_y-10), cv2.FONT_HERSHEY_SIMPLEX,
+                    1, (255, 0, 0), 2, cv2.LINE_AA)
+
+    return contours_img, nb_crossings
@@ -8,12 +8,17 @@ from PyQt5 import QtGui as Qtg
 import cv2
 import time
 
-from Utils import convert_cv_to_qpixmap, Timer, h_line, QLabelLin, midpoint, distance, is_gray
-from PreProcessingFunction import func_contours_list, gray_to_binary
-from FormDetectionFunction import is_outside
+from Utils import convert_cv_to_qpixmap, ImageDisplay, Timer, h_line, QLabelLin, midpoint, distance, is_gray, \
+    ProcessingWorker, BusProcessingWorker
+from PreProcessingFunction import func_components_list, gray_to_binary, ProcessingContext
+from tracking import ObjectTracker
+from calibration import Calibration, find_checkerboard
+from edge_measurement import measure_rects
 
 from Dictionary_EN import *
 
+CALIBRATION_FILE = 'calibration.json'  # Saved by each new calibration, loaded when the tab is created
+
 
 class MeasurementInVideoTab(Qtw.QMainWindow):
     def __init__(self, video_thread):
@@ -24,11 +29,18 @@ class MeasurementInVideoTab(Qtw.QMainWindow):
         self.distance_pix = None
         self.scale = 1
 
+        # Camera calibration (see calibration.py) and corners of the checkerboard views captured for a new one
+        self.raw_cv_img = None
+        self.calibration = None
+        self.checkerboard_views = []
+        self.calibration_image_size = None
+
         self.get_video_thread = video_thread
         self.get_video_thread.new_cv_img_signal.connect(self.update_video_qlabel)
         self.get_video_thread.stopped_signal.connect(self.video_stopped)
 
         self.video_qlabel = QLabelLin()
+        self.video_display = ImageDisplay(self.video_qlabel)
         self.video_qlabel.setText(STR_PLS_LAUNCH_ACQUISITION)
         self.setCentralWidget(self.video_qlabel)
 
@@ -40,6 +52,16 @@ class MeasurementInVideoTab(Qtw.QMainWindow):
         self.calculate_btn.setEnabled(False)
 
         self.fps_qlabel = Qtw.QLabel()
+        self.latency_qlabel = Qtw.QLabel()
+
+        # The objects are followed from frame to frame, the frames must be processed in their order (a single thread)
+        self.tracker = ObjectTracker()
+        self.worker = ProcessingWorker(measure_objects_in_frame, max_workers=1, parent=self)
+        self.worker.result_signal.connect(self.show_result)
+        # The measurement can run in another process, reading the frames published by the video thread
+        self.separate_process_checkbox = Qtw.QCheckBox(STR_SEPARATE_PROCESS)
+        self.separate_process_checkbox.setEnabled(hasattr(video_thread, 'add_frame_bus'))
+        self.separate_process_checkbox.toggled.connect(self.set_separate_process)
 
         self.nb_pixels_qlabel = Qtw.QLabel()
         self.scale_qlabel = Qtw.QLabel()
@@ -54,6 +76,39 @@ class MeasurementInVideoTab(Qtw.QMainWindow):
         self.set_scale_btn.clicked.connect(self.set_scale)
         self.set_scale_btn.setEnabled(False)
 
+        self.columns_spinbox = Qtw.QSpinBox()
+        self.columns_spinbox.setRange(3, 50)
+        self.columns_spinbox.setValue(9)
+        self.rows_spinbox = Qtw.QSpinBox()
+        self.rows_spinbox.setRange(3, 50)
+        self.rows_spinbox.setValue(6)
+        corners_layout = Qtw.QHBoxLayout()
+        corners_layout.addWidget(self.columns_spinbox)
+        corners_layout.addWidget(self.rows_spinbox)
+
+        self.square_size_spinbox = Qtw.QDoubleSpinBox()
+        self.square_size_spinbox.setRange(0.1, 1000)
+        self.square_size_spinbox.setValue(10)
+
+        self.capture_view_btn = Qtw.QPushButton(STR_CAPTURE_CHECKERBOARD)
+        self.capture_view_btn.clicked.connect(self.capture_checkerboard_view)
+        self.capture_view_btn.setEnabled(False)
+        self.calibrate_btn = Qtw.QPushButton(STR_CALIBRATE)
+        self.calibrate_btn.clicked.connect(self.calibrate)
+        self.calibrate_btn.setEnabled(False)
+        self.load_calibration_btn = Qtw.QPushButton(STR_LOAD_CALIBRATION)
+        self.load_calibration_btn.clicked.connect(self.load_calibration)
+        self.calibration_qlabel = Qtw.QLabel(STR_NO_CALIBRATION)
+
+        self.use_calibration_checkbox = Qtw.QCheckBox(STR_USE_CALIBRATION)
+        self.use_calibration_checkbox.setEnabled(False)
+        # The whole frames are corrected with precomputed maps, otherwise only the contours of the objects
+        self.undistort_frames_checkbox = Qtw.QCheckBox(STR_UNDISTORT_FRAMES)
+        self.undistort_frames_checkbox.setChecked(False)
+        # Dimensions from the edges fitted in the gray frame, to a fraction of pixel
+        self.subpixel_checkbox = Qtw.QCheckBox(STR_SUBPIXEL_EDGES)
+        self.subpixel_checkbox.setChecked(True)
+
         self.show_binary_checkbox = Qtw.QCheckBox(STR_SHOW_BINARY_IMAGE)
         self.show_binary_checkbox.setChecked(False)
 
@@ -91,12 +146,23 @@ class MeasurementInVideoTab(Qtw.QMainWindow):
         setting_form_layout.addRow(self.calculate_btn)
         setting_form_layout.addRow(h_line())
         setting_form_layout.addRow(STR_FPS, self.fps_qlabel)
+        setting_form_layout.addRow(STR_LATENCY, self.latency_qlabel)
+        setting_form_layout.addRow(self.separate_process_checkbox)
         setting_form_layout.addRow(h_line())
         setting_form_layout.addRow(self.set_scale_btn)
         setting_form_layout.addRow(STR_NB_PIXELS, self.nb_pixels_qlabel)
         setting_form_layout.addRow(STR_DISTANCE, self.distance_spinbox)
         setting_form_layout.addRow(STR_SCALE, self.scale_qlabel)
         setting_form_layout.addRow(h_line())
+        setting_form_layout.addRow(STR_CHECKERBOARD_CORNERS, corners_layout)
+        setting_form_layout.addRow(STR_SQUARE_SIZE, self.square_size_spinbox)
+        setting_form_layout.addRow(self.capture_view_btn)
+        setting_form_layout.addRow(self.calibrate_btn, self.load_calibration_btn)
+        setting_form_layout.addRow(STR_CALIBRATION, self.calibration_qlabel)
+        setting_form_layout.addRow(self.use_calibration_checkbox)
+        setting_form_layout.addRow(self.undistort_frames_checkbox)
+        setting_form_layout.addRow(h_line())
+        setting_form_layout.addRow(self.subpixel_checkbox)
         setting_form_layout.addRow(self.show_binary_checkbox)
         setting_form_layout.addRow(self.opening_checkbox)
         setting_form_layout.addRow(self.closing_checkbox)
@@ -116,11 +182,18 @@ class MeasurementInVideoTab(Qtw.QMainWindow):
         self.timer = Timer()
         self.timer.start()
 
+        if os.path.exists(CALIBRATION_FILE):
+            try:
+                self.set_calibration(Calibration.load(CALIBRATION_FILE))
+            except (OSError, ValueError) as error:
+                print(f'{CALIBRATION_FILE}: {error}')
+
     @Qtc.pyqtSlot()
     def video_stopped(self):
         self.video_qlabel.setText(STR_PLS_LAUNCH_ACQUISITION)
         self.shown_cv_img = None
         self.fps_qlabel.setText('')
+        self.latency_qlabel.setText('')
         self.calculating = False
         self.calculate_btn.setEnabled(False)
         self.calculate_btn.setText(STR_START_CALCULATION)
@@ -164,6 +237,59 @@ class MeasurementInVideoTab(Qtw.QMainWindow):
         self.video_qlabel.mouse_released_signal.disconnect(self.new_scale)
         self.video_qlabel.setting_scale = False
 
+    @Qtc.pyqtSlot()
+    def capture_checkerboard_view(self):
+        """Slot connected to capture_view_btn, add the corners of the checkerboard of the current frame to the
+        views of the next calibration. The last view must be taken with the checkerboard on the plane of measurement"""
+        pattern_size = (self.columns_spinbox.value(), self.rows_spinbox.value())
+        corners = find_checkerboard(self.raw_cv_img, pattern_size)
+        if corners is None:
+            Qtw.QMessageBox.warning(self, "Warning", STR_CHECKERBOARD_NOT_FOUND)
+            return
+        if self.checkerboard_views and self.checkerboard_views[-1].shape != corners.shape:
+            self.checkerboard_views = []  # Other pattern size
+        self.checkerboard_views.append(corners)
+        self.calibration_image_size = (self.raw_cv_img.shape[1], self.raw_cv_img.shape[0])
+        self.calibrate_btn.setText(f'{STR_CALIBRATE} ({len(self.checkerboard_views)} {STR_VIEWS})')
+        self.calibrate_btn.setEnabled(len(self.checkerboard_views) >= 3)
+
+    @Qtc.pyqtSlot()
+    def calibrate(self):
+        """Slot connected to calibrate_btn, compute the calibration from the captured views and save it"""
+        pattern_size = (self.columns_spinbox.value(), self.rows_spinbox.value())
+        try:
+            calibration = Calibration.from_views(self.checkerboard_views, pattern_size,
+                                                 self.square_size_spinbox.value(), self.calibration_image_size)
+        except cv2.error as error:
+            Qtw.QMessageBox.warning(self, "Warning", str(error))
+            return
+        self.checkerboard_views = []
+        self.calibrate_btn.setText(STR_CALIBRATE)
+        self.calibrate_btn.setEnabled(False)
+        self.set_calibration(calibration)
+        try:
+            calibration.save(CALIBRATION_FILE)
+        except OSError as error:
+            Qtw.QMessageBox.warning(self, "Warning", str(error))
+
+    @Qtc.pyqtSlot()
+    def load_calibration(self):
+        """Slot connected to load_calibration_btn"""
+        filename = Qtw.QFileDialog.getOpenFileName(self, STR_LOAD_CALIBRATION, '', STR_CALIBRATION_FORMAT)
+        if filename[0] != "":
+            try:
+                self.set_calibration(Calibration.load(filename[0]))
+            except (OSError, ValueError) as error:
+                Qtw.QMessageBox.warning(self, "Warning", str(error))
+
+    def set_calibration(self, calibration):
+        self.calibration = calibration
+        width, height = calibration.image_size
+        self.calibration_qlabel.setText(f'{width}x{height}, {calibration.nb_views} {STR_VIEWS}, '
+                                        f'RMS {calibration.rms:.2f} pix')
+        self.use_calibration_checkbox.setEnabled(True)
+        self.use_calibration_checkbox.setChecked(True)
+
     @Qtc.pyqtSlot()
     def start_calculation(self):
         if not self.calculating:
@@ -173,6 +299,7 @@ class MeasurementInVideoTab(Qtw.QMainWindow):
             self.calculate_btn.setText(STR_START_CALCULATION)
             self.calculating = False
             self.fps_qlabel.setText('')
+            self.latency_qlabel.setText('')
 
     @Qtc.pyqtSlot(np.ndarray)
     def update_video_qlabel(self, cv_img):
@@ -182,6 +309,8 @@ class MeasurementInVideoTab(Qtw.QMainWindow):
         if is_gray(cv_img):
             self.calculate_btn.setEnabled(True)
             self.set_scale_btn.setEnabled(True)
+            self.capture_view_btn.setEnabled(True)
+            self.raw_cv_img = cv_img
             self.screenshot_btn.setEnabled(True)
             self.clipboard_btn.setEnabled(True)
 
@@ -189,84 +318,154 @@ class MeasurementInVideoTab(Qtw.QMainWindow):
             self.fps_qlabel.setText(str(int(1 / d_t)))
 
             if self.calculating:
-
-                binary_img = gray_to_binary(cv_img, self.threshold_spinbox.value(), self.opening_checkbox.isChecked(),
-                                            self.closing_checkbox.isChecked(), self.blur_checkbox.isChecked())
-
-                contours_list = func_contours_list(binary_img, self.min_area_spinbox.value(), self.max_area_spinbox.value())
-
-                if self.show_binary_checkbox.isChecked():
-                    contours_img = cv2.merge([binary_img, binary_img, binary_img])
-                else:
-                    contours_img = cv2.merge([cv_img, cv_img, cv_img])
-
-                good_contours_list = []
-
-                for cnt in contours_list:
-                    if not is_outside(cnt, cv_img.shape):
-                        good_contours_list.append(cnt)
-
-                for cnt in good_contours_list:
-                    rect = cv2.minAreaRect(cnt)
-                    box = cv2.boxPoints(rect)
-                    box = np.int0(box)
-                    cv2.drawContours(contours_img, [box], 0, (0, 0, 255), 2)
-
-                    (tl, tr, br, bl) = box  # tl = top left, tr = top right, br = bottom right, bl = bottom left
-                    (tl_tr_X, tl_tr_Y) = midpoint(tl, tr)
-                    (bl_br_X, bl_br_Y) = midpoint(bl, br)
-
-                    (tl_bl_X, tl_bl_Y) = midpoint(tl, bl)
-                    (tr_br_X, tr_br_Y) = midpoint(tr, br)
-
-                    cv2.circle(contours_img, (int(tl_tr_X), int(tl_tr_Y)), 5, (255, 0, 0), -1)
-                    cv2.circle(contours_img, (int(bl_br_X), int(bl_br_Y)), 5, (255, 0, 0), -1)
-                    cv2.circle(contours_img, (int(tl_bl_X), int(tl_bl_Y)), 5, (255, 0, 0), -1)
-                    cv2.circle(contours_img, (int(tr_br_X), int(tr_br_Y)), 5, (255, 0, 0), -1)
-
-                    cv2.line(contours_img, (int(tl_tr_X), int(tl_tr_Y)), (int(bl_br_X), int(bl_br_Y)), (255, 0, 255), 2)
-                    cv2.line(contours_img, (int(tl_bl_X), int(tl_bl_Y)), (int(tr_br_X), int(tr_br_Y)), (255, 0, 255), 2)
-
-                    dA = distance((tl_tr_X, tl_tr_Y), (bl_br_X, bl_br_Y))
-                    dB = distance((tl_bl_X, tl_bl_Y), (tr_br_X, tr_br_Y))
-
-                    if self.distance_pix is None:
-                        unit = 'pix'
-                    else:
-                        unit = 'mm'
-                    cv2.putText(contours_img, "{:.1f}".format(dA*self.scale)+unit,
-                                (int(tl_tr_X - 15), int(tl_tr_Y - 10)), cv2.FONT_HERSHEY_SIMPLEX,
-                                0.65, (0, 0, 255), 2)
-                    cv2.putText(contours_img, "{:.1f}".format(dB*self.scale)+unit,
-                                (int(tr_br_X + 10), int(tr_br_Y)), cv2.FONT_HERSHEY_SIMPLEX,
-                                0.65, (0, 0, 255), 2)
-
-                self.shown_cv_img = contours_img
-
+                # The processing is done by the worker, the result is shown by show_result
+                unit = 'pix' if self.distance_pix is None else 'mm'
+                calibration = self.calibration if self.use_calibration_checkbox.isChecked() else None
+                self.worker.submit(cv_img, self.threshold_spinbox.value(), self.opening_checkbox.isChecked(),
+                                   self.closing_checkbox.isChecked(), self.blur_checkbox.isChecked(),
+                                   self.min_area_spinbox.value(), self.max_area_spinbox.value(),
+                                   self.show_binary_checkbox.isChecked(), self.scale, unit, self.tracker,
+                                   calibration, self.undistort_frames_checkbox.isChecked(),
+                                   self.subpixel_checkbox.isChecked())
             else:
                 self.shown_cv_img = cv_img
-
-            qt_img = convert_cv_to_qpixmap(self.shown_cv_img, self.video_qlabel.size())
-            self.video_qlabel.setPixmap(qt_img)
+                self.video_display.show(self.shown_cv_img)
         else:
             self.calculating = False
             self.calculate_btn.setEnabled(False)
             self.calculate_btn.setText(STR_START_CALCULATION)
             self.set_scale_btn.setEnabled(False)
+            self.capture_view_btn.setEnabled(False)
             self.screenshot_btn.setEnabled(False)
             self.clipboard_btn.setEnabled(False)
             self.video_qlabel.setText(STR_COLOR_TO_GRAY)
             self.shown_cv_img = None
             self.fps_qlabel.setText('')
+            self.latency_qlabel.setText('')
+
+    @Qtc.pyqtSlot(bool)
+    def set_separate_process(self, checked):
+        """Slot connected to the toggled signal of separate_process_checkbox"""
+        self.worker.result_signal.disconnect(self.show_result)
+        self.worker.shutdown()
+        if checked:
+            self.worker = BusProcessingWorker(measure_objects_in_frame, self.get_video_thread, parent=self)
+        else:
+            self.worker = ProcessingWorker(measure_objects_in_frame, max_workers=1, parent=self)
+        self.worker.result_signal.connect(self.show_result)
+
+    @Qtc.pyqtSlot(object)
+    def show_result(self, contours_img):
+        """Slot connected to the result_signal signal of the ProcessingWorker"""
+        if not self.calculating:
+            return
+        self.shown_cv_img = contours_img
+        self.video_display.show(self.shown_cv_img)
+        self.latency_qlabel.setText(f'{self.worker.latency * 1000:.0f} ms')
 
     def resizeEvent(self, event):
         """Overriding the resizeEvent methode for resize the Qlabels containing image each time the main window
          is resized """
         Qtw.QWidget.resizeEvent(self, event)  # Calling the basic resizeEvent of QWidget
         if self.shown_cv_img is not None:
-            qt = convert_cv_to_qpixmap(self.shown_cv_img, self.video_qlabel.size())
-            self.video_qlabel.setPixmap(qt)
-
-
-
-
+            self.video_display.show(self.shown_cv_img)
+
+
+_CONTEXT = ProcessingContext()
+
+
+def measure_objects_in_frame(cv_img, threshold, opening, closing, blur, min_area, max_area, show_binary, scale, unit,
+                             tracker=None, calibration=None, undistort_frame=False, subpixel=False):
+    """
+    Measure the length and the width of the objects of a grayscale frame. Called in the threads of the
+    ProcessingWorker of MeasurementInVideoTab.
+
+    :param scale: size of a pixel in unit
+    :param tracker: ObjectTracker following the objects, an object is only measured again when its size changes
+    :param calibration: Calibration of the camera, the dimensions are then in mm (scale and unit are ignored). Not
+    used if the frame does not have the calibrated size (sensor AOI...)
+    :param undistort_frame: the whole frame is undistorted (remap), otherwise only the contours of the objects
+    :param subpixel: the dimensions are measured on the sub-pixel edges of the objects in the gray frame (see
+    edge_measurement.py), otherwise on their boxes in the binary frame
+    :return: image with the boxes and the dimensions of the objects
+    """
+    if calibration is not None and not calibration.matches(cv_img):
+        calibration = None
+    if calibration is not None:
+        unit = 'mm'
+        if undistort_frame:
+            cv_img = _CONTEXT.run(calibration.remap, cv_img)
+
+    binary_img = gray_to_binary(cv_img, threshold, opening, closing, blur, _CONTEXT)
+
+    # Objects touching the border of the frame are removed, only the contours of the remaining objects are extracted
+    good_contours_list = func_components_list(binary_img, min_area, max_area, border_margin=5)[0]
+
+    if show_binary:
+        contours_img = cv2.merge([binary_img, binary_img, binary_img])
+    else:
+        contours_img = cv2.merge([cv_img, cv_img, cv_img])
+
+    tracks = [None] * len(good_contours_list)
+    if tracker is not None:
+        boxes = [cv2.boundingRect(cnt) for cnt in good_contours_list]
+        centers = [(x + w / 2, y + h / 2) for x, y, w, h in boxes]
+        tracks = tracker.update(centers, boxes)
+
+    rects = [cv2.minAreaRect(cnt) for cnt in good_contours_list]
+    key = ('size' if calibration is None else 'size_mm') + ('_edges' if subpixel else '')
+    to_measure = [i for i, track in enumerate(tracks) if track is None or track.needs_update(key, 0.02)]
+    edge_sizes = {}
+    if subpixel:
+        # The edges of all the objects to measure are fitted at once, NaN if not found (box measure instead)
+        sizes = measure_rects(cv_img, [rects[i] for i in to_measure], calibration, undistorted=undistort_frame)
+        edge_sizes = {i: size for i, size in zip(to_measure, sizes) if not np.isnan(size).any()}
+
+    for i, (cnt, track, rect) in enumerate(zip(good_contours_list, tracks, rects)):
+        box = cv2.boxPoints(rect)
+        box = np.intp(box)
+        cv2.drawContours(contours_img, [box], 0, (0, 0, 255), 2)
+
+        (tl, tr, br, bl) = box  # tl = top left, tr = top right, br = bottom right, bl = bottom left
+        (tl_tr_X, tl_tr_Y) = midpoint(tl, tr)
+        (bl_br_X, bl_br_Y) = midpoint(bl, br)
+
+        (tl_bl_X, tl_bl_Y) = midpoint(tl, bl)
+        (tr_br_X, tr_br_Y) = midpoint(tr, br)
+
+        cv2.circle(contours_img, (int(tl_tr_X), int(tl_tr_Y)), 5, (255, 0, 0), -1)
+        cv2.circle(contours_img, (int(bl_br_X), int(bl_br_Y)), 5, (255, 0, 0), -1)
+        cv2.circle(contours_img, (int(tl_bl_X), int(tl_bl_Y)), 5, (255, 0, 0), -1)
+        cv2.circle(contours_img, (int(tr_br_X), int(tr_br_Y)), 5, (255, 0, 0), -1)
+
+        cv2.line(contours_img, (int(tl_tr_X), int(tl_tr_Y)), (int(bl_br_X), int(bl_br_Y)), (255, 0, 255), 2)
+        cv2.line(contours_img, (int(tl_bl_X), int(tl_bl_Y)), (int(tr_br_X), int(tr_br_Y)), (255, 0, 255), 2)
+
+        # Dimensions in unit, the ones in pixels are multiplied by the scale
+        if i in edge_sizes:
+            dA, dB = edge_sizes[i]  # Sides (tl, tr) - (br, bl) and (tr, br) - (bl, tl) of cv2.boxPoints
+            if track is not None:
+                track.set_result(key, (dA, dB))
+        elif i in to_measure:
+            dA = distance((tl_tr_X, tl_tr_Y), (bl_br_X, bl_br_Y))
+            dB = distance((tl_bl_X, tl_bl_Y), (tr_br_X, tr_br_Y))
+            if calibration is not None:
+                length, width = calibration.measure_box(cnt, undistorted=undistort_frame)
+                dA, dB = (length, width) if dA >= dB else (width, length)
+            if track is not None:
+                track.set_result(key, (dA, dB))
+        else:
+            dA, dB = track.get_result(key)
+        factor = scale if calibration is None else 1
+        if track is not None:
+            cv2.putText(contours_img, f'#{track.id}', (int(rect[0][0]), int(rect[0][1])), cv2.FONT_HERSHEY_SIMPLEX,
+                        0.65, (255, 0, 0), 2)
+
+        cv2.putText(contours_img, "{:.1f}".format(dA*factor)+unit,
+                    (int(tl_tr_X - 15), int(tl_tr_Y - 10)), cv2.FONT_HERSHEY_SIMPLEX,
+                    0.65, (0, 0, 255), 2)
+        cv2.putText(contours_img, "{:.1f}".format(dB*factor)+unit,
+                    (int(tr_br_X + 10), int(tr_br_Y)), cv2.FONT_HERSHEY_SIMPLEX,
+                    0.65, (0, 0, 255), 2)
+
+    return contours_img
@@ -1,79 +1,153 @@
 import numpy as np
 import cv2
-import io
-
-import matplotlib
-
-import matplotlib.pyplot as plt
-from Utils import convert_CV_64F_to_uint8
-
-
-# def hist_curve(im):
-#     bins = np.arange(256).reshape(256, 1)
-#     h = np.zeros((300,256,3))
-#
-#     if len(im.shape) == 2:
-#         color = [(255,255,255)]
-#     elif im.shape[2] == 3:
-#         color = [(255, 0, 0), (0, 255, 0), (0, 0, 255)]
-#
-#     for ch, col in enumerate(color):
-#         hist_item = cv2.calcHist([im], [ch], None, [256], [0, 256])
-#         cv2.normalize(hist_item, hist_item, 0, 255, cv2.NORM_MINMAX)
-#         hist = np.int32(np.around(hist_item))
-#         pts = np.int32(np.column_stack((bins, hist)))
-#
-#         cv2.polylines(h, [pts], False, col, 1)
-#     y = np.flipud(h)
-#
-#     return y
+import functools
+import threading
+
+
+class HistogramRenderer:
+    """
+    Draw the histograms of an image (one curve for each channel) on a white BGR canvas with cv2.polylines. The
+    background and the axes are drawn once, a render costs a calcHist and a polyline for each channel.
+    """
+
+    GRAY_COLORS = [(0, 0, 0)]
+    BGR_COLORS = [(255, 0, 0), (0, 160, 0), (0, 0, 255)]
+
+    def __init__(self, width=512, height=300, margin=10):
+        self.width = width
+        self.height = height
+        self.margin = margin
+        self.canvas = np.empty((height, width, 3), np.uint8)
+
+        self._x = np.int32(np.around(np.linspace(margin, width - margin - 1, 256)))
+        self._bottom = height - margin - 1
+        self._top = margin
+        self._background = np.full((height, width, 3), 255, np.uint8)
+        for value in (0, 64, 128, 192, 255):
+            x = int(self._x[value])
+            cv2.line(self._background, (x, self._top), (x, self._bottom), (220, 220, 220), 1)
+        cv2.line(self._background, (int(self._x[0]), self._bottom), (int(self._x[-1]), self._bottom), (0, 0, 0), 1)
+        self._background.flags.writeable = False
+
+    def render(self, im, dst=None, step=1):
+        """
+        :param im: gray or BGR uint8 image
+        :param dst: image (height, width, 3) receiving the drawing, the canvas of the renderer (overwritten by the
+        next render) if None
+        :param step: only one row out of step is counted, for live histograms of large frames (the rows stay
+        contiguous, which calcHist needs to be fast)
+        :return: BGR image of the histograms
+        """
+        if dst is None:
+            dst = self.canvas
+        np.copyto(dst, self._background)
+        if step > 1:
+            im = im[::step]
+        colors = self.GRAY_COLORS if len(im.shape) == 2 else self.BGR_COLORS
+
+        hists = [cv2.calcHist([im], [ch], None, [256], [0, 256]).ravel() for ch in range(len(colors))]
+        scale = (self._bottom - self._top) / max(max(hist.max() for hist in hists), 1)  # Same scale for all channels
+        points = np.empty((256, 2), np.int32)
+        points[:, 0] = self._x
+        for hist, color in zip(hists, colors):
+            points[:, 1] = self._bottom - hist * scale
+            cv2.polylines(dst, [points], False, color, 1, cv2.LINE_AA)
+        return dst
+
+
+@functools.lru_cache(maxsize=None)
+def get_histogram_renderer(width=512, height=300):
+    return HistogramRenderer(width, height)
+
 
 def hist_curve(im):
-    bins = np.arange(256).reshape(256, 1)
-    h = np.zeros((300,256,3))
+    """
+    :param im: gray or BGR uint8 image
+    :return: new BGR image of the histograms of im
+    """
+    renderer = get_histogram_renderer()
+    return renderer.render(im, dst=np.empty_like(renderer.canvas))
+
+
+@functools.lru_cache(maxsize=64)
+def get_kernel(kernel_size, shape=cv2.MORPH_RECT):
+    """
+    Structuring element of the morphological operations, built once for each (size, shape)
 
-    if len(im.shape) == 2:
-        color = 'k'
-    elif im.shape[2] == 3:
-        color = ('b','g','r')
+    :param kernel_size: size of the square structuring element
+    :param shape: cv2.MORPH_RECT (np.ones), cv2.MORPH_ELLIPSE or cv2.MORPH_CROSS
+    :return: read-only uint8 array
+    """
+    kernel = cv2.getStructuringElement(shape, (kernel_size, kernel_size))
+    kernel.flags.writeable = False
+    return kernel
+
+
+class ProcessingContext:
+    """
+    Reusable output images of the processing functions (which all have a dst parameter), so that processing frames
+    of the same format allocates no new image. The buffers are kept for each thread: a context can be shared by the
+    threads of a ProcessingWorker. The video tabs keep one context at module level (_CONTEXT) for the function of
+    their worker, so each thread reuses its intermediate images from frame to frame.
+
+    Example, the result of each step is overwritten by the next frame processed in the same thread:
+        context = ProcessingContext()
+        binary = context.run(func_otsu_thresholding, img)
+        binary = context.run(func_opening, binary, 5)
+    """
+
+    def __init__(self):
+        self._local = threading.local()
 
-    fig = plt.figure()
-    for ch, col in enumerate(color):
-        hist_item = cv2.calcHist([im], [ch], None, [256], [0, 256])
-        plt.plot(hist_item, color=col)
+    def run(self, function, img, *args, key=None, **kwargs):
+        """
+        Call function(img, *args, dst=buffer, **kwargs) with the buffer of this step for the format of img
 
-    fig.canvas.draw()
+        :param key: name of the step (the name of the function if None), different for each call of a same function
+        on the same frame
+        :return: result of the function, stored in the buffer of the step
+        """
+        buffers = self._buffers()
+        buffer_key = (key or function.__name__, img.shape, img.dtype)
+        result = function(img, *args, dst=buffers.get(buffer_key), **kwargs)
+        buffers[buffer_key] = result  # Same array as the buffer, except on the first call or if the format changed
+        return result
 
-    # Now we can save it to a numpy array.
-    data = np.frombuffer(fig.canvas.tostring_rgb(), dtype=np.uint8)
-    data = data.reshape(fig.canvas.get_width_height()[::-1] + (3,))
+    def clear(self):
+        """Free the buffers of the calling thread"""
+        self._buffers().clear()
 
-    return data
+    def _buffers(self):
+        if not hasattr(self._local, 'buffers'):
+            self._local.buffers = {}
+        return self._local.buffers
 
 
-def func_erosion(img, kernel_size):
+def func_erosion(img, kernel_size, dst=None):
     """
 
     :param img:
     :param kernel_size:
+    :param dst: output image, allocated if None
     :return:
     """
-    kernel = np.ones((kernel_size, kernel_size), np.uint8)
-    return cv2.erode(img, kernel, iterations=1)
+    kernel = get_kernel(kernel_size)
+    return cv2.erode(img, kernel, dst=dst, iterations=1)
 
 
-def func_dilatation(img, kernel_size):
+def func_dilatation(img, kernel_size, dst=None):
     """
 
     :param img:
     :param kernel_size:
+    :param dst: output image, allocated if None
     :return:
     """
-    kernel = np.ones((kernel_size, kernel_size), np.uint8)
-    return cv2.dilate(img, kernel, iterations = 1)
+    kernel = get_kernel(kernel_size)
+    return cv2.dilate(img, kernel, dst=dst, iterations = 1)
 
 
-def func_opening(img, kernel_size=3):
+def func_opening(img, kernel_size=3, dst=None):
     """
     !!! INPUT IMAGE MUST BE BINARIZED !!!
 
@@ -82,14 +156,15 @@ def func_opening(img, kernel_size=3):
 
     :param img: Input image, must be binarized (ei: pixel = 0 or 1)
     :param kernel_size: Size of the matrix of convolution, default value = 3
+    :param dst: output image, allocated if None
     :return: Image after the opening process
     """
-    kernel = np.ones((kernel_size, kernel_size), np.uint8)
-    img = cv2.morphologyEx(img, cv2.MORPH_OPEN, kernel)
+    kernel = get_kernel(kernel_size)
+    img = cv2.morphologyEx(img, cv2.MORPH_OPEN, kernel, dst=dst)
     return img
 
 
-def func_closing(img, kernel_size=3):
+def func_closing(img, kernel_size=3, dst=None):
     """
     !!! INPUT IMAGE MUST BE BINARIZED !!!
 
@@ -98,106 +173,193 @@ def func_closing(img, kernel_size=3):
 
     :param img: Input image, must be binarized (ei: pixel = 0 or 1)
     :param kernel_size: Size of the matrix of convolution, default value = 3
+    :param dst: output image, allocated if None
     :return: Image after the closing process
     """
-    kernel = np.ones((kernel_size, kernel_size), np.uint8)
-    img = cv2.morphologyEx(img, cv2.MORPH_CLOSE, kernel)
+    kernel = get_kernel(kernel_size)
+    img = cv2.morphologyEx(img, cv2.MORPH_CLOSE, kernel, dst=dst)
     return img
 
 
-def func_gaus_blurring(img, kernel_size, sigma):
+def func_gaus_blurring(img, kernel_size, sigma, dst=None):
     """
 
     :param img:
     :param kernel_size:
     :param sigma:
+    :param dst: output image, allocated if None
     :return:
     """
 
-    return cv2.GaussianBlur(img, (kernel_size, kernel_size), sigmaX=sigma, sigmaY=sigma, borderType=cv2.BORDER_DEFAULT)
+    return cv2.GaussianBlur(img, (kernel_size, kernel_size), dst=dst, sigmaX=sigma, sigmaY=sigma,
+                            borderType=cv2.BORDER_DEFAULT)
 
 
-def func_median_blur(img, kernel_size):
+def func_median_blur(img, kernel_size, dst=None):
     """
 
     :param img:
     :param kernel_size:
+    :param dst: output image, allocated if None (must not be img)
     :return:
     """
-    return cv2.medianBlur(img, kernel_size)
+    return cv2.medianBlur(img, kernel_size, dst=dst)
 
 
-def func_bilateral_filter(img, size, sigma):
+def func_bilateral_filter(img, size, sigma, dst=None):
     """
 
     :param img:
     :param size:
     :param sigma:
+    :param dst: output image, allocated if None (must not be img)
     :return:
     """
-    return cv2.bilateralFilter(img, size, sigma, sigma)
+    return cv2.bilateralFilter(img, size, sigma, sigma, dst=dst)
 
 
-def func_equalization(img):
+def func_equalization(img, dst=None):
     """
 
     :param img:
+    :param dst: output image, allocated if None
     :return:
     """
-    return cv2.equalizeHist(img)
+    return cv2.equalizeHist(img, dst=dst)
 
 
-def func_simple_thresholding(img, threshold):
+def func_simple_thresholding(img, threshold, dst=None):
     """
     Apply a thresholding on the input image (MUST BE IN GRAYSCALE). Pixels with a value above threshold will be set
     at 1 and those below at 0
 
     :param img: Input image, must be in grayscale (8 bit)
     :param threshold: Threshold
+    :param dst: output image, allocated if None
     :return: Image after thresholding, binarized image (ei: pixel = 0 or 1)
     """
 
-    return cv2.threshold(img, threshold, 255, cv2.THRESH_BINARY)[1]
+    return cv2.threshold(img, threshold, 255, cv2.THRESH_BINARY, dst=dst)[1]
 
 
-def func_adaptive_thresholding(img, method, block_size, c):
+def func_adaptive_thresholding(img, method, block_size, c, dst=None):
     """
 
     :param img:
     :param method:
     :param block_size:
     :param c:
+    :param dst: output image, allocated if None (must not be img)
     :return:
     """
     if method == 0:
-        return cv2.adaptiveThreshold(img, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, block_size, c)
+        return cv2.adaptiveThreshold(img, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, block_size, c, dst=dst)
     else:
-        return cv2.adaptiveThreshold(img, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, block_size, c)
+        return cv2.adaptiveThreshold(img, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, block_size, c,
+                                     dst=dst)
 
 
-def func_otsu_thresholding(img):
+def func_otsu_thresholding(img, dst=None):
     """
 
+    :param dst: output image, allocated if None
     :return:
     """
-    return cv2.threshold(img, 0, 255, cv2.THRESH_BINARY+cv2.THRESH_OTSU)[1]
+    return cv2.threshold(img, 0, 255, cv2.THRESH_BINARY+cv2.THRESH_OTSU, dst=dst)[1]
 
 
-def func_ft(img):
-    """
+def _even_dft_size(size):
+    """Smallest size >= size that the DFT handles fast (product of 2, 3 and 5), even for the CCS packing"""
+    size = cv2.getOptimalDFTSize(size)
+    while size % 2:
+        size = cv2.getOptimalDFTSize(size + 1)
+    return size
 
-    :param img:
-    :return:
-    """
 
+class _SpectrumPlan:
+    """Sizes and window of the spectrum of the frames of a shape, read-only and shared by the threads"""
+
+    def __init__(self, height, width):
+        self.height, self.width = height, width
+        self.dft_height, self.dft_width = _even_dft_size(height), _even_dft_size(width)
+        # Apodization, so that the borders of the frame do not draw a cross through the spectrum
+        self.window = cv2.createHanningWindow((width, height), cv2.CV_32F)
+        self.window.flags.writeable = False
+
+
+@functools.lru_cache(maxsize=8)
+def _get_spectrum_plan(height, width):
+    return _SpectrumPlan(height, width)
+
+
+_spectrum_buffers = threading.local()
+
+
+def _get_spectrum_buffers(plan):
+    """Work buffers of the calling thread for plan: padded frame, its CCS spectrum, log magnitude of the half plane"""
+    if not hasattr(_spectrum_buffers, 'buffers'):
+        _spectrum_buffers.buffers = {}
+    buffers = _spectrum_buffers.buffers.get(plan)
+    if buffers is None:
+        m, n = plan.dft_height, plan.dft_width
+        buffers = (np.zeros((m, n), np.float32), np.empty((m, n), np.float32), np.empty((m, n // 2 + 1), np.float32),
+                   np.empty((m, n // 2 + 1), np.uint8))
+        _spectrum_buffers.buffers = {plan: buffers}  # Only the buffers of the last frame shape are kept
+    return buffers
+
+
+def func_ft(img, dst=None, low_percentile=1., high_percentile=99.9):
+    """
+    Magnitude of the Fourier transform of an image, centered and in log scale, for display. The frame is apodized by
+    a Hanning window and padded to a size fast for the DFT (cv2.getOptimalDFTSize). The real-input DFT only gives
+    half of the plane, the other half is its point reflection.
+
+    :param img: gray or BGR image
+    :param dst: output image, allocated if None
+    :param low_percentile: percentile of the log magnitude shown as black
+    :param high_percentile: percentile of the log magnitude shown as white (the few peaks above are saturated)
+    :return: uint8 image of the spectrum, of the padded size (the size of img for most sensors), zero frequency at
+    the center
+    """
     if len(img.shape) == 3:
         img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
-    dft = cv2.dft(np.float32(img), flags=cv2.DFT_COMPLEX_OUTPUT)
-    dft_shift = np.fft.fftshift(dft)
-    magnitude_spectrum = 20 * np.log(cv2.magnitude(dft_shift[:, :, 0], dft_shift[:, :, 1]))
-
-    return convert_CV_64F_to_uint8(magnitude_spectrum)
+    plan = _get_spectrum_plan(*img.shape[:2])
+    padded, ccs, log_half, half = _get_spectrum_buffers(plan)
+    m, n = plan.dft_height, plan.dft_width
+    if dst is None or dst.shape != (m, n) or dst.dtype != np.uint8:
+        dst = np.empty((m, n), np.uint8)
+
+    np.multiply(img, plan.window, out=padded[:plan.height, :plan.width])  # The padding stays at 0
+    cv2.dft(padded, ccs)
+
+    # Squared magnitude of the columns 0 to n / 2 from the CCS packing: columns 1 to n / 2 - 1 are (Re, Im) pairs,
+    # the columns 0 and n / 2 are the spectra of real signals, packed along the first and the last columns
+    np.square(ccs, out=ccs)
+    np.add(ccs[:, 1:n - 1:2], ccs[:, 2:n - 1:2], out=log_half[:, 1:n // 2])
+    for k, column in ((0, ccs[:, 0]), (n // 2, ccs[:, n - 1])):
+        power = np.empty(m // 2 + 1, np.float32)
+        power[0], power[-1] = column[0], column[-1]
+        power[1:-1] = column[1:-1:2] + column[2:-1:2]
+        log_half[:m // 2 + 1, k] = power
+        log_half[m // 2 + 1:, k] = power[m // 2 - 1:0:-1]
+    log_half += 1  # log(1 + |F|^2), never -inf
+    cv2.log(log_half, log_half)
+
+    # Robust scaling on a subsample: a few bright peaks (the zero frequency) do not darken the whole spectrum
+    low, high = np.percentile(log_half[::4, ::4], [low_percentile, high_percentile])
+    cv2.max(log_half, float(low), log_half)
+    alpha = 255. / max(high - low, 1e-6)
+    cv2.convertScaleAbs(log_half, half, alpha, -low * alpha)
+
+    # Zero frequency at (m / 2, n / 2): the right half is the half plane with its rows rolled by m / 2, the left half
+    # is the point reflection of the half plane (spectrum of a real image)
+    h, w = m // 2, n // 2
+    dst[:h, w:] = half[h:, :w]
+    dst[h:, w:] = half[:h, :w]
+    dst[:h + 1, :w] = half[h::-1, w:0:-1]
+    dst[h + 1:, :w] = half[m - 1:h:-1, w:0:-1]
+    return dst
 
 
 def func_contours_list(img, area_min=0,area_max=100000):
@@ -211,30 +373,82 @@ def func_contours_list(img, area_min=0,area_max=100000):
 # donne la liste des coordonnes des points des contours des formes détectées dont l'aire est superieure à 50
 
 
-def func_find_draw_contours(img, surface_min=0, contours_list=None):
+def func_components_list(img, area_min=0, area_max=100000, border_margin=None):
+    """
+    Detection of the objects of a binary image by connected components, faster than func_contours_list with many
+    objects: the objects are filtered with array operations on the statistics of all the components, the contours
+    are only extracted for the remaining objects (in their bounding box).
+
+    :param img: binary image (the non-zero pixels are the objects)
+    :param area_min: minimum area of an object in pixels (excluded)
+    :param area_max: maximum area of an object in pixels (excluded)
+    :param border_margin: objects closer to the border of the image than this margin are removed (as with
+    FormDetectionFunction.is_outside), None to keep them
+    :return: list of the outer contours of the objects, array (nb objects, 5) of their statistics (x, y, width,
+    height, area), array (nb objects, 2) of their centroids (x, y)
+    """
+    # BBDT: the fastest labelling algorithm on our frames (about twice as fast as the default one)
+    _, labels, stats, centroids = cv2.connectedComponentsWithStatsWithAlgorithm(img, 8, cv2.CV_32S, cv2.CCL_BBDT)
+    x, y, w, h, area = stats.T
+    keep = (area > area_min) & (area < area_max)
+    keep[0] = False  # Background
+    if border_margin is not None:
+        height, width = img.shape[:2]
+        keep &= (x > border_margin) & (y > border_margin) & (x + w - 1 < width - border_margin) & \
+                (y + h - 1 < height - border_margin)
+    objects = np.flatnonzero(keep)
+
+    contours_list = []
+    for label in objects:
+        x0, y0, w0, h0 = stats[label, :4]
+        mask = cv2.compare(labels[y0:y0 + h0, x0:x0 + w0], int(label), cv2.CMP_EQ)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(int(x0), int(y0)))
+        contours_list.append(max(contours, key=len))
+    return contours_list, stats[objects], centroids[objects]
+
+
+def func_find_draw_contours(img, surface_min=0, contours_list=None, dst=None):
     if contours_list is None:
         contours_list = func_contours_list(img, surface_min)
 
-    contours_img = cv2.merge([img, img, img])
+    contours_img = cv2.merge([img, img, img], dst=dst)
     cv2.drawContours(contours_img, contours_list, -1, (0, 0, 255), 3)
 
     return contours_img
 
 
-def gray_to_binary(img, threshold, opening, closing, blur):
+def gray_to_binary(img, threshold, opening, closing, blur, context=None):
+    """
+    :param context: ProcessingContext holding the intermediate images (new images are allocated if None). The result
+    is then overwritten by the next call in the same thread.
+    """
+    if context is None:
+        context = _NO_CONTEXT
+
     if threshold == -1:
-        binary_img = func_otsu_thresholding(img)
+        binary_img = context.run(func_otsu_thresholding, img)
     else:
-        binary_img = func_simple_thresholding(img, threshold)
+        binary_img = context.run(func_simple_thresholding, img, threshold)
 
     if opening:
-        binary_img = func_opening(binary_img)
+        binary_img = context.run(func_opening, binary_img)
     if closing:
-        binary_img = func_closing(binary_img)
+        binary_img = context.run(func_closing, binary_img)
     if blur:
-        binary_img = func_gaus_blurring(binary_img, 5, 2)
+        binary_img = context.run(func_gaus_blurring, binary_img, 5, 2)
 
     return binary_img
 
 
+class _NoContext:
+    """Context without buffers: the functions allocate their result"""
+
+    @staticmethod
+    def run(function, img, *args, key=None, **kwargs):
+        return function(img, *args, **kwargs)
+
+
+_NO_CONTEXT = _NoContext()
+
+
 
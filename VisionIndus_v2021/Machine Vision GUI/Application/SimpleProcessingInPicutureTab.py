@@ -4,11 +4,17 @@ from PyQt5 import QtCore as Qtc
 from PyQt5 import Qt as Qt
 from PyQt5 import QtGui as Qtg
 import cv2
+from functools import partial
 
 from PreProcessingFunction import *
 from Utils import h_line, convert_cv_to_qpixmap, convert_CV_64F_to_uint8, open_img, save_img, WarningWidget
+from recipe import save_recipe, load_recipe, tree_to_recipe, recipe_to_tree
+from history import ImageHistory
+from tiling import TiledStep
 from Dictionary_EN import *
 
+HISTORY_BUDGET_MB = 256  # Default memory budget of the output images
+
 
 class SimpleProcessingInPictureTab(Qtw.QMainWindow):
     """The image processing tab widget is build here"""
@@ -22,9 +28,9 @@ class SimpleProcessingInPictureTab(Qtw.QMainWindow):
         self.input_img_cv = None
         self.input_histo_cv = None
 
-        # Those lists will store all the output image and histo (after each process, at index 0 after the process 1
-        # and so on)
-        self.output_img_list = []
+        # The input image and the output images (at index 1 after the process 1 and so on), within a memory budget:
+        # the older images are compressed or dropped and computed again (see history.py)
+        self.history = ImageHistory(HISTORY_BUDGET_MB * 2 ** 20)
         self.output_histo_list = []
 
         # Dockable widget used for the process and algo choices
@@ -57,6 +63,21 @@ class SimpleProcessingInPictureTab(Qtw.QMainWindow):
         up_btn.setIcon(Qtg.QIcon(":/up_arrow_icon.png"))
         up_btn.clicked.connect(self.up_item)
 
+        # Buttons for saving the process tree as a recipe file and for loading one (see recipe.py)
+        save_recipe_btn = Qtw.QPushButton(STR_SAVE_RECIPE)
+        save_recipe_btn.clicked.connect(self.save_recipe_file)
+        load_recipe_btn = Qtw.QPushButton(STR_LOAD_RECIPE)
+        load_recipe_btn.clicked.connect(self.load_recipe_file)
+
+        # Memory budget of the output images
+        history_budget_spinbox = Qtw.QSpinBox()
+        history_budget_spinbox.setRange(16, 16384)
+        history_budget_spinbox.setSingleStep(64)
+        history_budget_spinbox.setPrefix(STR_HISTORY_MEMORY)
+        history_budget_spinbox.setSuffix(' MB')
+        history_budget_spinbox.setValue(HISTORY_BUDGET_MB)
+        history_budget_spinbox.valueChanged.connect(lambda value: self.history.set_budget(value * 2 ** 20))
+
         # Button for launching the image processing according the selected process
         calculate_btn = Qtw.QPushButton(STR_CALCULATE)
         calculate_btn.setIcon(Qtg.QIcon(":/setting_icon.png"))
@@ -81,6 +102,9 @@ class SimpleProcessingInPictureTab(Qtw.QMainWindow):
         selection_layout.addWidget(del_all_btn, 3, 1)
         selection_layout.addWidget(down_btn, 4, 0)
         selection_layout.addWidget(up_btn, 4, 1)
+        selection_layout.addWidget(save_recipe_btn, 5, 0)
+        selection_layout.addWidget(load_recipe_btn, 5, 1)
+        selection_layout.addWidget(history_budget_spinbox, 6, 0, 1, 2)
 
         layout = Qtw.QVBoxLayout()
         layout.addLayout(selection_layout)
@@ -154,6 +178,26 @@ class SimpleProcessingInPictureTab(Qtw.QMainWindow):
         process = self.process_list.currentText()  # Name of the process
         self.sort_by_process(process, 'add')  # This will add the correct process and parameters in process_tree
 
+    @Qtc.pyqtSlot()
+    def save_recipe_file(self):
+        """Slot connected to save_recipe_btn, save the process tree as a recipe file"""
+        filename = Qtw.QFileDialog.getSaveFileName(self, STR_SAVE_RECIPE, '', STR_RECIPE_FORMAT)
+        if filename[0] != "":
+            try:
+                save_recipe(filename[0], tree_to_recipe(self.process_tree))
+            except OSError as error:
+                Qtw.QMessageBox.warning(self, "Warning", str(error))
+
+    @Qtc.pyqtSlot()
+    def load_recipe_file(self):
+        """Slot connected to load_recipe_btn, replace the process tree by the steps of a recipe file"""
+        filename = Qtw.QFileDialog.getOpenFileName(self, STR_LOAD_RECIPE, '', STR_RECIPE_FORMAT)
+        if filename[0] != "":
+            try:
+                recipe_to_tree(load_recipe(filename[0]), self.process_tree)
+            except (OSError, ValueError) as error:
+                Qtw.QMessageBox.warning(self, "Warning", str(error))
+
     @Qtc.pyqtSlot()
     def up_item(self):
         """
@@ -185,8 +229,7 @@ class SimpleProcessingInPictureTab(Qtw.QMainWindow):
         # Clear the previous outputs for storing the next ones
         if self.input_img_cv is not None:
             self.data_tab_widget.del_all_output_tab()
-            self.output_img_list.clear()
-            self.output_img_list.append(self.input_img_cv)
+            self.history.reset(self.input_img_cv)
             self.output_histo_list.clear()
             self.output_histo_list.append(self.input_histo_cv)
 
@@ -223,7 +266,7 @@ class SimpleProcessingInPictureTab(Qtw.QMainWindow):
             elif mode == 'calculate':
                 kernel_size = self.process_tree.itemWidget(item.child(0), 0).value()
 
-                self.add_output(func_erosion(self.output_img_list[-1], kernel_size), STR_AFTER_EROSION)
+                self.add_output(partial(func_erosion, kernel_size=kernel_size), STR_AFTER_EROSION)
 
         elif process == STR_DILATATION:
             if mode == 'move':
@@ -239,7 +282,7 @@ class SimpleProcessingInPictureTab(Qtw.QMainWindow):
             elif mode == 'calculate':
                 kernel_size = self.process_tree.itemWidget(item.child(0), 0).value()
 
-                self.add_output(func_dilatation(self.output_img_list[-1], kernel_size), STR_AFTER_DILATATION)
+                self.add_output(partial(func_dilatation, kernel_size=kernel_size), STR_AFTER_DILATATION)
 
         elif process == STR_OPENING:
             if mode == 'move':
@@ -255,7 +298,7 @@ class SimpleProcessingInPictureTab(Qtw.QMainWindow):
             elif mode == 'calculate':
                 kernel_size = self.process_tree.itemWidget(item.child(0), 0).value()
 
-                self.add_output(func_opening(self.output_img_list[-1], kernel_size), STR_AFTER_OPENING)
+                self.add_output(partial(func_opening, kernel_size=kernel_size), STR_AFTER_OPENING)
 
         elif process == STR_CLOSING:
             if mode == 'move':
@@ -271,7 +314,7 @@ class SimpleProcessingInPictureTab(Qtw.QMainWindow):
             elif mode == 'calculate':
                 kernel_size = self.process_tree.itemWidget(item.child(0), 0).value()
 
-                self.add_output(func_closing(self.output_img_list[-1], kernel_size), STR_AFTER_CLOSING)
+                self.add_output(partial(func_closing, kernel_size=kernel_size), STR_AFTER_CLOSING)
 
         elif process == STR_GAUSSIAN_BLURRING:
             if mode == 'move':
@@ -289,7 +332,7 @@ class SimpleProcessingInPictureTab(Qtw.QMainWindow):
                 kernel_size = self.process_tree.itemWidget(item.child(0), 0).value()
                 sigma = self.process_tree.itemWidget(item.child(1), 0).value()
 
-                self.add_output(func_gaus_blurring(self.output_img_list[-1], kernel_size, sigma),
+                self.add_output(partial(func_gaus_blurring, kernel_size=kernel_size, sigma=sigma),
                                 STR_AFTER_GAUSSIAN_BLURRING)
 
         elif process == STR_EQUALIZATION:
@@ -303,8 +346,8 @@ class SimpleProcessingInPictureTab(Qtw.QMainWindow):
                 self.process_tree.equalization_item(-1)
 
             elif mode == 'calculate':
-                self.add_output(func_equalization(self.output_img_list[-1]), STR_AFTER_EQUALIZATION)
-                #self.add_output(func_fft(self.output_img_list[-1]))
+                self.add_output(func_equalization, STR_AFTER_EQUALIZATION)
+                #self.add_output(func_fft)
 
         elif process == STR_SIMPLE_THRESHOLD:
             if mode == 'move':
@@ -320,7 +363,7 @@ class SimpleProcessingInPictureTab(Qtw.QMainWindow):
             elif mode == 'calculate':
                 threshold = self.process_tree.itemWidget(item.child(0), 0).value()
 
-                self.add_output(func_simple_thresholding(self.output_img_list[-1], threshold), STR_AFTER_THRESHOLDING)
+                self.add_output(partial(func_simple_thresholding, threshold=threshold), STR_AFTER_THRESHOLDING)
 
         elif process == STR_ADAPTIVE_THRESHOLD:
             if mode == 'move':
@@ -340,7 +383,7 @@ class SimpleProcessingInPictureTab(Qtw.QMainWindow):
                 block_size = self.process_tree.itemWidget(item.child(1), 0).value()
                 c = self.process_tree.itemWidget(item.child(2), 0).value()
 
-                self.add_output(func_adaptive_thresholding(self.output_img_list[-1], method, block_size, c),
+                self.add_output(partial(func_adaptive_thresholding, method=method, block_size=block_size, c=c),
                                 STR_AFTER_THRESHOLDING)
 
         elif process == STR_OTSUS_THRESHOLD:
@@ -354,7 +397,7 @@ class SimpleProcessingInPictureTab(Qtw.QMainWindow):
                 self.process_tree.otsu_thresholding_item(-1)
 
             elif mode == 'calculate':
-                self.add_output(func_otsu_thresholding(self.output_img_list[-1]), STR_AFTER_THRESHOLDING)
+                self.add_output(func_otsu_thresholding, STR_AFTER_THRESHOLDING)
 
         elif process == STR_MEDIAN_BLUR:
             if mode == 'move':
@@ -371,7 +414,7 @@ class SimpleProcessingInPictureTab(Qtw.QMainWindow):
             elif mode == 'calculate':
                 kernel_size = self.process_tree.itemWidget(item.child(0), 0).value()
 
-                self.add_output(func_median_blur(self.output_img_list[-1], kernel_size), STR_AFTER_MEDIAN_BLUR)
+                self.add_output(partial(func_median_blur, kernel_size=kernel_size), STR_AFTER_MEDIAN_BLUR)
 
         elif process == STR_BILATERAL_FILTER:
             if mode == 'move':
@@ -389,7 +432,7 @@ class SimpleProcessingInPictureTab(Qtw.QMainWindow):
                 size = self.process_tree.itemWidget(item.child(0), 0).value()
                 sigma = self.process_tree.itemWidget(item.child(1), 0).value()
 
-                self.add_output(func_bilateral_filter(self.output_img_list[-1], size, sigma),
+                self.add_output(partial(func_bilateral_filter, size=size, sigma=sigma),
                                 STR_AFTER_BILATERAL_FILTER)
 
         elif process == STR_FT:
@@ -403,7 +446,7 @@ class SimpleProcessingInPictureTab(Qtw.QMainWindow):
                 self.process_tree.ft_item(-1)
 
             elif mode == 'calculate':
-                self.add_output(func_ft(self.output_img_list[-1]), STR_FT_MAGNITUDE)
+                self.add_output(func_ft, STR_FT_MAGNITUDE)
 
         elif process == STR_OUTLINE_DETECTION:
             if mode == 'move':
@@ -419,26 +462,35 @@ class SimpleProcessingInPictureTab(Qtw.QMainWindow):
             elif mode == 'calculate':
                 min_surface = self.process_tree.itemWidget(item.child(0), 0).value()
 
-                img = func_find_draw_contours(self.output_img_list[-1], min_surface)
+                step = TiledStep(partial(func_find_draw_contours, surface_min=min_surface))
+                index = self.history.append(step(self.history.get(-1)), step)
 
-                self.output_img_list.append(img)
                 self.output_histo_list.append(None)
-                self.data_tab_widget.add_outline_detection_tab(STR_OUTLINE_DETECTION, img)
+                self.data_tab_widget.add_outline_detection_tab(STR_OUTLINE_DETECTION, self.history, index)
+
+    def add_output(self, step, title=STR_DEFAULT):
+        """
+        Apply a process to the last image of the history and add its output in a new tab
 
-    def add_output(self, output_img, title=STR_DEFAULT):
-        self.output_img_list.append(output_img)
+        :param step: process, function of the image with its parameters bound (applied by tiles to large images)
+        :param title: title of the tab
+        :return: No return
+        """
+        step = TiledStep(step)
+        output_img = step(self.history.get(-1))
+        index = self.history.append(output_img, step)
 
-        self.output_histo_list.append(convert_CV_64F_to_uint8(hist_curve(output_img)))
+        self.output_histo_list.append(hist_curve(output_img))
 
-        self.data_tab_widget.add_tab(title, self.output_img_list[-1], self.output_histo_list[-1])
+        self.data_tab_widget.add_tab(title, self.history, index, self.output_histo_list[-1])
 
     @Qtc.pyqtSlot()
     def load_img(self):
-        img = open_img(self)
+        img = open_img(self, mmap=True)  # Large images are processed from the file (see tiling.py)
         if img is not None:
             self.input_img_cv = img
 
-            self.input_histo_cv = convert_CV_64F_to_uint8(hist_curve(self.input_img_cv))
+            self.input_histo_cv = hist_curve(self.input_img_cv)
 
             self.data_tab_widget.input_tab.show_data(self.input_img_cv, self.input_histo_cv)
 
@@ -450,7 +502,7 @@ class SimpleProcessingInPictureTab(Qtw.QMainWindow):
     def receive_screenshot(self, screenshot):
         if screenshot.size != 0:
             self.input_img_cv = screenshot
-            self.input_histo_cv = convert_CV_64F_to_uint8(hist_curve(self.input_img_cv))
+            self.input_histo_cv = hist_curve(self.input_img_cv)
 
             self.data_tab_widget.input_tab.show_data(self.input_img_cv, self.input_histo_cv)
         else:
@@ -729,24 +781,29 @@ class DataTabWidget(Qtw.QTabWidget):
         self.input_tab = InputTab()
         self.addTab(self.input_tab, STR_INPUT)
 
-    def add_tab(self, title, img, histo):
+        # Only the tab shown is updated, the images of the other ones may have to be decompressed or computed again
+        self.currentChanged.connect(self.update_current_tab)
+
+    @Qtc.pyqtSlot(int)
+    def update_current_tab(self, i):
+        if self.currentWidget() is not None:
+            self.currentWidget().update_size()
+
+    def add_tab(self, title, history, index, histo):
         """
-        Add a tab to the TabWidget, displaying the image img, histogram histo (if given) and the parameters
-         given in param.
+        Add a tab to the TabWidget, displaying an image of the history and its histogram histo (if given)
 
         :param title: title of the tab to add
-        :param img: image to display (np.ndarray)
+        :param history: ImageHistory containing the image to display
+        :param index: index of the image in history
         :param histo: histogram to display (np.ndarray), send None if no histogram
-        :param param: array containing the parameters to display
         :return: No return
         """
-        output_tab = OutputTab(img, histo)
-        self.currentChanged.connect(output_tab.update_size)
+        output_tab = OutputTab(history, index, histo)
         self.addTab(output_tab, title)
 
-    def add_outline_detection_tab(self, title, img):
-        output_tab = OutputOutlineDetectionTab(img)
-        self.currentChanged.connect(output_tab.update_size)
+    def add_outline_detection_tab(self, title, history, index):
+        output_tab = OutputOutlineDetectionTab(history, index)
         self.addTab(output_tab, title)
 
     def del_all_output_tab(self):
@@ -801,7 +858,7 @@ class InputTab(Qtw.QTabWidget):
         self.histo_cv = histo
 
         self.img_qlabel.setPixmap(convert_cv_to_qpixmap(img, self.img_qlabel.size()))
-        self.histo_qlabel.setPixmap(convert_cv_to_qpixmap(histo, self.histo_qlabel.size(), False))
+        self.histo_qlabel.setPixmap(convert_cv_to_qpixmap(histo, self.histo_qlabel.size()))
 
     def update_size(self, i=None):
 
@@ -813,17 +870,19 @@ class InputTab(Qtw.QTabWidget):
                 self.img_qlabel.setPixmap(qt)
 
             elif index == 1:
-                qt = convert_cv_to_qpixmap(self.histo_cv, self.histo_qlabel.size(), False)
+                qt = convert_cv_to_qpixmap(self.histo_cv, self.histo_qlabel.size())
                 self.histo_qlabel.setPixmap(qt)
 
 
 class OutputTab(Qtw.QTabWidget):
-    def __init__(self, img, histo):
+    def __init__(self, history, index, histo):
         super().__init__()
 
         self.currentChanged.connect(self.update_size)
 
-        self.img_cv = img
+        # The image is not kept by the tab, it is taken from the history when needed
+        self.history = history
+        self.index = index
         self.histo_cv = histo
 
         self.img_qlabel = Qtw.QLabel()
@@ -862,12 +921,16 @@ class OutputTab(Qtw.QTabWidget):
 
         self.show_data(self.img_cv, self.histo_cv)
 
+    @property
+    def img_cv(self):
+        return self.history.get(self.index)
+
     def show_data(self, img, histo):
         #self.img_cv = img
         #self.histo_cv = histo
 
         self.img_qlabel.setPixmap(convert_cv_to_qpixmap(img, self.img_qlabel.size()))
-        self.histo_qlabel.setPixmap(convert_cv_to_qpixmap(histo, self.histo_qlabel.size(), False))
+        self.histo_qlabel.setPixmap(convert_cv_to_qpixmap(histo, self.histo_qlabel.size()))
 
     def update_size(self, i=None):
         index = self.currentIndex()
@@ -876,7 +939,7 @@ class OutputTab(Qtw.QTabWidget):
             self.img_qlabel.setPixmap(qt)
 
         elif index == 1:
-            qt = convert_cv_to_qpixmap(self.histo_cv, self.histo_qlabel.size(), False)
+            qt = convert_cv_to_qpixmap(self.histo_cv, self.histo_qlabel.size())
             self.histo_qlabel.setPixmap(qt)
 
     @Qtc.pyqtSlot()
@@ -897,10 +960,11 @@ class OutputTab(Qtw.QTabWidget):
 
 
 class OutputOutlineDetectionTab(Qtw.QWidget):
-    def __init__(self, img):
+    def __init__(self, history, index):
         super().__init__()
 
-        self.img_cv = img
+        self.history = history
+        self.index = index
 
         self.img_qlabel = Qtw.QLabel()
 
@@ -917,6 +981,10 @@ class OutputOutlineDetectionTab(Qtw.QWidget):
 
         self.show_data(self.img_cv)
 
+    @property
+    def img_cv(self):
+        return self.history.get(self.index)
+
     def show_data(self, img):
         self.img_qlabel.setPixmap(convert_cv_to_qpixmap(img, self.img_qlabel.size()))
 
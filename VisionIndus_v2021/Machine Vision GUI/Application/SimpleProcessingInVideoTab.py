@@ -4,9 +4,13 @@ from PyQt5 import QtCore as Qtc
 from PyQt5 import Qt as Qt
 from PyQt5 import QtGui as Qtg
 import cv2
+import time
+from functools import partial
 
 from PreProcessingFunction import *
-from Utils import h_line, convert_cv_to_qpixmap, convert_CV_64F_to_uint8, open_img, save_img, WarningWidget
+from Utils import h_line, convert_cv_to_qpixmap, ImageDisplay, convert_CV_64F_to_uint8, open_img, save_img, \
+    WarningWidget, ProcessingWorker, StageTimings
+from recipe import save_recipe, load_recipe, tree_to_recipe, recipe_to_tree
 from Dictionary_EN import *
 
 
@@ -27,9 +31,23 @@ class SimpleProcessingInVideoTab(Qtw.QMainWindow):
 
         self.calculating = False
 
-        # Those lists will store all the output image and histo (after each process, at index 0 after the process 1
-        # and so on)
-        self.output_img_list = []
+        # The process tree is compiled into a list of functions with their parameters bound (see compile_pipeline),
+        # each one called as step(img, dst=buffer). The intermediate images go into two ping-pong buffers (a pair for
+        # each image format if a process changes the size or the type of the image)
+        self.pipeline = []
+        self.pipeline_formats = []
+        self.pipeline_buffers = {}
+        self.pipeline_input_format = None
+        self.pipeline_dirty = True
+
+        # Duration of each stage of the pipeline, shown next to its item in process_tree (see update_stage_timings)
+        self.stage_timings = StageTimings([])
+        self.stage_timings_shown_time = 0.
+
+        # The pipeline runs out of the GUI thread. A single thread and a single pending frame: the ping-pong buffers
+        # are never used by two frames at the same time
+        self.worker = ProcessingWorker(self.run_pipeline, max_workers=1, max_pending=1, parent=self)
+        self.worker.result_signal.connect(self.show_result)
 
         # Dockable widget used for the process and algo choices
         self.process_dock = Qtw.QDockWidget(STR_SELECTION, self)
@@ -37,6 +55,9 @@ class SimpleProcessingInVideoTab(Qtw.QMainWindow):
 
         # QTreeWidget that will contain the added process
         self.process_tree = ProcessTreeWidget()
+        self.process_tree.params_changed.connect(self.invalidate_pipeline)
+        self.process_tree.model().rowsInserted.connect(self.invalidate_pipeline)
+        self.process_tree.model().rowsRemoved.connect(self.invalidate_pipeline)
 
         # Buttons for adding deleteing and moving an item (process) in the list
         add_btn = Qtw.QPushButton(STR_ADD)
@@ -54,6 +75,16 @@ class SimpleProcessingInVideoTab(Qtw.QMainWindow):
         up_btn.setIcon(Qtg.QIcon(":/up_arrow_icon.png"))
         up_btn.clicked.connect(self.up_item)
 
+        # Buttons for saving the process tree as a recipe file and for loading one (see recipe.py)
+        save_recipe_btn = Qtw.QPushButton(STR_SAVE_RECIPE)
+        save_recipe_btn.clicked.connect(self.save_recipe_file)
+        load_recipe_btn = Qtw.QPushButton(STR_LOAD_RECIPE)
+        load_recipe_btn.clicked.connect(self.load_recipe_file)
+
+        # Button for exporting the durations of the stages of the pipeline
+        export_timings_btn = Qtw.QPushButton(STR_EXPORT_TIMINGS)
+        export_timings_btn.clicked.connect(self.export_stage_timings)
+
         # Button for launching the image processing according the selected process
         calculate_btn = Qtw.QPushButton(STR_CALCULATE)
         calculate_btn.setIcon(Qtg.QIcon(":/setting_icon.png"))
@@ -75,6 +106,9 @@ class SimpleProcessingInVideoTab(Qtw.QMainWindow):
         selection_layout.addWidget(del_all_btn, 3, 1)
         selection_layout.addWidget(down_btn, 4, 0)
         selection_layout.addWidget(up_btn, 4, 1)
+        selection_layout.addWidget(save_recipe_btn, 5, 0)
+        selection_layout.addWidget(load_recipe_btn, 5, 1)
+        selection_layout.addWidget(export_timings_btn, 6, 0, 1, 2)
 
         layout = Qtw.QVBoxLayout()
         layout.addLayout(selection_layout)
@@ -95,9 +129,13 @@ class SimpleProcessingInVideoTab(Qtw.QMainWindow):
         self.copy_screenshot_btn.clicked.connect(self.copy_screenshot)
 
         self.video_qlabel = Qtw.QLabel()
+        self.video_display = ImageDisplay(self.video_qlabel)
+        self.latency_qlabel = Qtw.QLabel()
 
         central_layout = Qtw.QGridLayout()
         central_layout.addWidget(self.video_qlabel, 0, 0, 1, 2)
+        central_layout.addWidget(Qtw.QLabel(STR_LATENCY), 1, 0)
+        central_layout.addWidget(self.latency_qlabel, 1, 1)
         central_layout.addWidget(self.save_screenshot_btn, 2, 0)
         central_layout.addWidget(self.copy_screenshot_btn, 2, 1)
         central_widget = Qtw.QWidget()
@@ -126,26 +164,93 @@ class SimpleProcessingInVideoTab(Qtw.QMainWindow):
         with a new opencv image from the camera """
 
         if self.calculating:
-            self.output_img_list.clear()
-            self.output_img_list.append(cv_img)
-
-            iterator = Qtw.QTreeWidgetItemIterator(self.process_tree)
-
-            while iterator.value():
-                item = iterator.value()
-                if not item.parent():
-                    process = item.text(0)
-                    self.sort_by_process(process, 'calculate', item)
-                iterator += 1
-
-            self.shown_cv_img = self.output_img_list[-1]
-
+            # The pipeline is compiled in the GUI thread (it reads process_tree) and given to the worker with the
+            # frame, the result is shown by show_result
+            if self.pipeline_dirty:
+                self.compile_pipeline()
+            self.worker.submit(cv_img, self.pipeline, self.pipeline_formats, self.stage_timings)
 
         else:
             self.shown_cv_img = cv_img
+            self.video_display.show(self.shown_cv_img)
+
+    @Qtc.pyqtSlot(object)
+    def show_result(self, img):
+        """Slot connected to the result_signal of the processing worker"""
+        if not self.calculating:
+            return
+        self.shown_cv_img = img
+        self.video_display.show(self.shown_cv_img)
+        self.latency_qlabel.setText(f'{self.worker.latency * 1000:.0f} ms')
+        if time.perf_counter() - self.stage_timings_shown_time > 0.5:
+            self.update_stage_timings()
+
+    def update_stage_timings(self):
+        """Show the mean and the 95th percentile of the duration of each stage next to its item in process_tree"""
+        self.stage_timings_shown_time = time.perf_counter()
+        if self.pipeline_dirty or self.process_tree.topLevelItemCount() != len(self.stage_timings.names):
+            return
+        mean, p95 = self.stage_timings.statistics()
+        for i in range(len(self.stage_timings.names)):
+            self.process_tree.topLevelItem(i).setText(1, f'{mean[i]:.1f} ms (p95 {p95[i]:.1f})')
+
+    @Qtc.pyqtSlot()
+    def export_stage_timings(self):
+        """Slot connected to export_timings_btn, save the durations of the stages in a CSV file"""
+        filename = Qtw.QFileDialog.getSaveFileName(self, STR_EXPORT_TIMINGS, '', STR_CSV_FORMAT)
+        if filename[0] != "":
+            try:
+                self.stage_timings.save_csv(filename[0])
+            except OSError as error:
+                Qtw.QMessageBox.warning(self, "Warning", str(error))
+
+    @Qtc.pyqtSlot()
+    def invalidate_pipeline(self):
+        """Slot connected to the changes of process_tree (items and parameters), the pipeline is compiled again
+        before the next frame"""
+        self.pipeline_dirty = True
+
+    def compile_pipeline(self):
+        """Build the list of processing steps from the top items of process_tree and their parameters"""
+        self.pipeline = []
+        names = []
+        for i in range(self.process_tree.topLevelItemCount()):
+            item = self.process_tree.topLevelItem(i)
+            self.sort_by_process(item.text(0), 'compile', item)
+            item.setText(1, '')
+            names.append(item.text(0))
+        self.pipeline_formats = [None] * len(self.pipeline)
+        # New statistics: the frame being processed still adds its durations to the previous ones
+        self.stage_timings = StageTimings(names)
+        self.pipeline_dirty = False
+
+    def run_pipeline(self, img, pipeline, pipeline_formats, stage_timings):
+        """
+        Apply a compiled pipeline to an image, called in the thread of the processing worker
 
-        qt_img = convert_cv_to_qpixmap(self.shown_cv_img, self.video_qlabel.size())
-        self.video_qlabel.setPixmap(qt_img)
+        :param img: input image, not modified
+        :param pipeline: list of steps built by compile_pipeline
+        :param pipeline_formats: output format of each step, updated
+        :param stage_timings: StageTimings receiving the duration of each step
+        :return: output image, a copy of the last ping-pong buffer (kept by the GUI while the next frame is processed)
+        """
+        input_format = (img.shape, img.dtype)
+        if input_format != self.pipeline_input_format:
+            self.pipeline_buffers.clear()
+            self.pipeline_input_format = input_format
+
+        durations = [0] * len(pipeline)
+        for i, step in enumerate(pipeline):
+            # The output format of a step is the one of the previous frame, OpenCV allocates a new buffer on the
+            # first frame or if the format is not the expected one
+            dst = self.pipeline_buffers.get((pipeline_formats[i], i % 2))
+            t0 = time.perf_counter_ns()
+            img = step(img, dst=dst)
+            durations[i] = time.perf_counter_ns() - t0
+            pipeline_formats[i] = (img.shape, img.dtype)
+            self.pipeline_buffers[(pipeline_formats[i], i % 2)] = img
+        stage_timings.add(durations)
+        return img.copy() if pipeline else img
 
     @Qtc.pyqtSlot()
     def del_item(self):
@@ -199,6 +304,26 @@ class SimpleProcessingInVideoTab(Qtw.QMainWindow):
         process = self.process_list.currentText()  # Name of the process
         self.sort_by_process(process, 'add')  # This will add the correct process and parameters in process_tree
 
+    @Qtc.pyqtSlot()
+    def save_recipe_file(self):
+        """Slot connected to save_recipe_btn, save the process tree as a recipe file"""
+        filename = Qtw.QFileDialog.getSaveFileName(self, STR_SAVE_RECIPE, '', STR_RECIPE_FORMAT)
+        if filename[0] != "":
+            try:
+                save_recipe(filename[0], tree_to_recipe(self.process_tree))
+            except OSError as error:
+                Qtw.QMessageBox.warning(self, "Warning", str(error))
+
+    @Qtc.pyqtSlot()
+    def load_recipe_file(self):
+        """Slot connected to load_recipe_btn, replace the process tree by the steps of a recipe file"""
+        filename = Qtw.QFileDialog.getOpenFileName(self, STR_LOAD_RECIPE, '', STR_RECIPE_FORMAT)
+        if filename[0] != "":
+            try:
+                recipe_to_tree(load_recipe(filename[0]), self.process_tree)
+            except (OSError, ValueError) as error:
+                Qtw.QMessageBox.warning(self, "Warning", str(error))
+
     @Qtc.pyqtSlot()
     def up_item(self):
         """
@@ -229,6 +354,8 @@ class SimpleProcessingInVideoTab(Qtw.QMainWindow):
         """
 
         self.calculating = not self.calculating
+        if not self.calculating:
+            self.latency_qlabel.setText('')
 
 
 
@@ -254,9 +381,9 @@ class SimpleProcessingInVideoTab(Qtw.QMainWindow):
             elif mode == 'add':
                 self.process_tree.erosion_item(-1)
 
-            elif mode == 'calculate':
+            elif mode == 'compile':
                 kernel_size = self.process_tree.itemWidget(item.child(0), 0).value()
-                self.output_img_list.append(func_erosion(self.output_img_list[-1], kernel_size))
+                self.pipeline.append(partial(func_erosion, kernel_size=kernel_size))
 
         elif process == STR_DILATATION:
             if mode == 'move':
@@ -269,9 +396,9 @@ class SimpleProcessingInVideoTab(Qtw.QMainWindow):
             elif mode == 'add':
                 self.process_tree.dilatation_item(-1)
 
-            elif mode == 'calculate':
+            elif mode == 'compile':
                 kernel_size = self.process_tree.itemWidget(item.child(0), 0).value()
-                self.output_img_list.append(func_dilatation(self.output_img_list[-1], kernel_size))
+                self.pipeline.append(partial(func_dilatation, kernel_size=kernel_size))
 
         elif process == STR_OPENING:
             if mode == 'move':
@@ -284,9 +411,9 @@ class SimpleProcessingInVideoTab(Qtw.QMainWindow):
             elif mode == 'add':
                 self.process_tree.opening_item(-1)
 
-            elif mode == 'calculate':
+            elif mode == 'compile':
                 kernel_size = self.process_tree.itemWidget(item.child(0), 0).value()
-                self.output_img_list.append(func_opening(self.output_img_list[-1], kernel_size))
+                self.pipeline.append(partial(func_opening, kernel_size=kernel_size))
 
         elif process == STR_CLOSING:
             if mode == 'move':
@@ -299,9 +426,9 @@ class SimpleProcessingInVideoTab(Qtw.QMainWindow):
             elif mode == 'add':
                 self.process_tree.closing_item(-1)
 
-            elif mode == 'calculate':
+            elif mode == 'compile':
                 kernel_size = self.process_tree.itemWidget(item.child(0), 0).value()
-                self.output_img_list.append(func_closing(self.output_img_list[-1], kernel_size))
+                self.pipeline.append(partial(func_closing, kernel_size=kernel_size))
 
         elif process == STR_GAUSSIAN_BLURRING:
             if mode == 'move':
@@ -315,10 +442,10 @@ class SimpleProcessingInVideoTab(Qtw.QMainWindow):
             elif mode == 'add':
                 self.process_tree.gaus_blurring_item(-1)
 
-            elif mode == 'calculate':
+            elif mode == 'compile':
                 kernel_size = self.process_tree.itemWidget(item.child(0), 0).value()
                 sigma = self.process_tree.itemWidget(item.child(1), 0).value()
-                self.output_img_list.append(func_gaus_blurring(self.output_img_list[-1], kernel_size, sigma))
+                self.pipeline.append(partial(func_gaus_blurring, kernel_size=kernel_size, sigma=sigma))
 
         elif process == STR_EQUALIZATION:
             if mode == 'move':
@@ -330,8 +457,8 @@ class SimpleProcessingInVideoTab(Qtw.QMainWindow):
             elif mode == 'add':
                 self.process_tree.equalization_item(-1)
 
-            elif mode == 'calculate':
-                self.output_img_list.append(func_equalization(self.output_img_list[-1]))
+            elif mode == 'compile':
+                self.pipeline.append(func_equalization)
 
         elif process == STR_SIMPLE_THRESHOLD:
             if mode == 'move':
@@ -344,9 +471,9 @@ class SimpleProcessingInVideoTab(Qtw.QMainWindow):
             elif mode == 'add':
                 self.process_tree.simple_thresholding_item(-1)
 
-            elif mode == 'calculate':
+            elif mode == 'compile':
                 threshold = self.process_tree.itemWidget(item.child(0), 0).value()
-                self.output_img_list.append(func_simple_thresholding(self.output_img_list[-1], threshold))
+                self.pipeline.append(partial(func_simple_thresholding, threshold=threshold))
 
 
         elif process == STR_ADAPTIVE_THRESHOLD:
@@ -362,11 +489,11 @@ class SimpleProcessingInVideoTab(Qtw.QMainWindow):
             elif mode == 'add':
                 self.process_tree.adaptive_thresholding_item(-1)
 
-            elif mode == 'calculate':
+            elif mode == 'compile':
                 method = self.process_tree.itemWidget(item.child(0), 0).currentIndex()
                 block_size = self.process_tree.itemWidget(item.child(1), 0).value()
                 c = self.process_tree.itemWidget(item.child(2), 0).value()
-                self.output_img_list.append(func_adaptive_thresholding(self.output_img_list[-1], method, block_size, c))
+                self.pipeline.append(partial(func_adaptive_thresholding, method=method, block_size=block_size, c=c))
 
         elif process == STR_OTSUS_THRESHOLD:
             if mode == 'move':
@@ -378,8 +505,8 @@ class SimpleProcessingInVideoTab(Qtw.QMainWindow):
             elif mode == 'add':
                 self.process_tree.otsu_thresholding_item(-1)
 
-            elif mode == 'calculate':
-                self.output_img_list.append(func_otsu_thresholding(self.output_img_list[-1]))
+            elif mode == 'compile':
+                self.pipeline.append(func_otsu_thresholding)
 
         elif process == STR_MEDIAN_BLUR:
             if mode == 'move':
@@ -393,9 +520,9 @@ class SimpleProcessingInVideoTab(Qtw.QMainWindow):
             elif mode == 'add':
                 self.process_tree.median_blurring_item(-1)
 
-            elif mode == 'calculate':
+            elif mode == 'compile':
                 kernel_size = self.process_tree.itemWidget(item.child(0), 0).value()
-                self.output_img_list.append(func_median_blur(self.output_img_list[-1], kernel_size))
+                self.pipeline.append(partial(func_median_blur, kernel_size=kernel_size))
 
         elif process == STR_BILATERAL_FILTER:
             if mode == 'move':
@@ -409,10 +536,10 @@ class SimpleProcessingInVideoTab(Qtw.QMainWindow):
             elif mode == 'add':
                 self.process_tree.bilateral_filtering_item(-1)
 
-            elif mode == 'calculate':
+            elif mode == 'compile':
                 size = self.process_tree.itemWidget(item.child(0), 0).value()
                 sigma = self.process_tree.itemWidget(item.child(1), 0).value()
-                self.output_img_list.append(func_bilateral_filter(self.output_img_list[-1], size, sigma))
+                self.pipeline.append(partial(func_bilateral_filter, size=size, sigma=sigma))
 
         elif process == STR_FT:
             if mode == 'move':
@@ -424,8 +551,8 @@ class SimpleProcessingInVideoTab(Qtw.QMainWindow):
             elif mode == 'add':
                 self.process_tree.ft_item(-1)
 
-            elif mode == 'calculate':
-                self.output_img_list.append(func_ft(self.output_img_list[-1]))
+            elif mode == 'compile':
+                self.pipeline.append(func_ft)
 
         elif process == STR_OUTLINE_DETECTION:
             if mode == 'move':
@@ -438,11 +565,9 @@ class SimpleProcessingInVideoTab(Qtw.QMainWindow):
             elif mode == 'add':
                 self.process_tree.outline_detection_item(-1)
 
-            elif mode == 'calculate':
+            elif mode == 'compile':
                 min_surface = self.process_tree.itemWidget(item.child(0), 0).value()
-
-                img = func_find_draw_contours(self.output_img_list[-1], min_surface)
-                self.output_img_list.append(img)
+                self.pipeline.append(partial(func_find_draw_contours, surface_min=min_surface))
 
 
     def resizeEvent(self, event):
@@ -450,8 +575,7 @@ class SimpleProcessingInVideoTab(Qtw.QMainWindow):
          is resized """
         Qtw.QMainWindow.resizeEvent(self, event)
         if self.shown_cv_img is not None:
-            qt = convert_cv_to_qpixmap(self.shown_cv_img, self.video_qlabel.size())
-            self.video_qlabel.setPixmap(qt)
+            self.video_display.show(self.shown_cv_img)
 
 
 class ParamSpinBox(Qtw.QSpinBox):
@@ -468,13 +592,24 @@ class ParamSpinBox(Qtw.QSpinBox):
 
 
 class ProcessTreeWidget(Qtw.QTreeWidget):
+
+    params_changed = Qtc.pyqtSignal()
+
     def __init__(self):
         super().__init__()
 
-        self.setColumnCount(1)
+        self.setColumnCount(2)  # Process and its parameters, duration of the process (see update_stage_timings)
         self.setHeaderHidden(True)
         self.setColumnWidth(0, 300)
 
+    def setItemWidget(self, item, column, widget):
+        """Overriding setItemWidget for emitting params_changed each time a parameter widget is changed"""
+        super().setItemWidget(item, column, widget)
+        if isinstance(widget, Qtw.QComboBox):
+            widget.currentIndexChanged.connect(self.params_changed)
+        else:
+            widget.valueChanged.connect(self.params_changed)
+
     def erosion_item(self, index, value=5, expanded=False):
         erosion = Qtw.QTreeWidgetItem([STR_EROSION])
 
@@ -4,10 +4,17 @@ from PyQt5 import QtGui as Qtg
 from PyQt5 import QtWidgets as Qtw
 import numpy as np
 from math import sqrt
-from pyueye import ueye
 import cv2
+import csv
 import time
-
+import threading
+import multiprocessing
+import queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from tiling import map_image
+from frame_bus import FrameBus, consume
 from Dictionary_EN import *
 
 
@@ -27,10 +34,20 @@ def h_line():
     return line
 
 
-def open_img(parent):
-    filename = Qtw.QFileDialog.getOpenFileName(parent, STR_OPEN_IMAGE, '', STR_IMAGE_FORMAT)
+def open_img(parent, mmap=False):
+    """
+    :param mmap: the images whose format allows it are memory-mapped instead of loaded (see tiling.map_image)
+    :return: image chosen by the user, None if cancelled
+    """
+    filename = Qtw.QFileDialog.getOpenFileName(parent, STR_OPEN_IMAGE, '', STR_LARGE_IMAGE_FORMAT if mmap
+                                               else STR_IMAGE_FORMAT)
 
     if filename[0] != "":
+        if mmap:
+            img = map_image(filename[0])
+            if img is not None:
+                return img
+
         img = cv2.imread(filename[0], cv2.IMREAD_COLOR)
 
         if np.array_equal(img[:, :, 2], img[:, :, 1]) \
@@ -49,28 +66,73 @@ def save_img(parent, img):
         cv2.imwrite(filename[0], img)
 
 
-def convert_cv_to_qpixmap(cv_img, qsize=None, bgr2rgb=True):
-    """Convert from an opencv image to QPixmap of size qsize (given in argument)"""
+def fit_size(width, height, max_width, max_height):
+    """Size of an image of width x height scaled to fit in max_width x max_height, keeping its aspect ratio (as
+    Qt.KeepAspectRatio)"""
+    max_width, max_height = max(max_width, 1), max(max_height, 1)
+    scaled_width = max_height * width // height
+    if scaled_width <= max_width:
+        return max(scaled_width, 1), max_height
+    return max_width, max(max_width * height // width, 1)
 
-    shape = cv_img.shape
-    if len(shape) == 3:  # if image is RGB
-        h, w, ch = shape
-        bytes_per_line = ch * w
-        if bgr2rgb:
-            cv_img = cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB)
-        converted_to_qimage = Qtg.QImage(cv_img.data, w, h, bytes_per_line, Qtg.QImage.Format_RGB888)
 
-    else:  # else it's grayscale
-        h, w = shape
-        ch = 1
-        bytes_per_line = ch * w
-        converted_to_qimage = Qtg.QImage(cv_img.data, w, h, bytes_per_line, Qtg.QImage.Format_Grayscale8)
+def convert_cv_to_qimage(cv_img, bgr2rgb=True):
+    """
+    Wrap an opencv image in a QImage, without copy. The QImage uses the buffer of cv_img: it is kept as the ndarray
+    attribute of the QImage, so that it outlives the image.
 
-    if qsize is None:  # If no scale indicated then full scale
-        qsize = Qtc.QSize(w, h)
+    :param bgr2rgb: True if cv_img is in the opencv order (BGR), False if it is RGB
+    """
+    cv_img = np.ascontiguousarray(cv_img)
+    h, w = cv_img.shape[:2]
+    if len(cv_img.shape) == 3:
+        image_format = Qtg.QImage.Format_BGR888 if bgr2rgb else Qtg.QImage.Format_RGB888
+    else:
+        image_format = Qtg.QImage.Format_Grayscale8
+    qimage = Qtg.QImage(cv_img.data, w, h, cv_img.strides[0], image_format)
+    qimage.ndarray = cv_img
+    return qimage
 
-    p = converted_to_qimage.scaled(qsize, Qtc.Qt.KeepAspectRatio)
-    return Qtg.QPixmap.fromImage(p)
+
+def convert_cv_to_qpixmap(cv_img, qsize=None, bgr2rgb=True):
+    """Convert from an opencv image to QPixmap of size qsize (given in argument)"""
+    if qsize is not None:
+        h, w = cv_img.shape[:2]
+        size = fit_size(w, h, qsize.width(), qsize.height())
+        if size != (w, h):
+            cv_img = cv2.resize(cv_img, size, interpolation=cv2.INTER_NEAREST)
+    return Qtg.QPixmap.fromImage(convert_cv_to_qimage(cv_img, bgr2rgb))
+
+
+class ImageDisplay:
+    """
+    Show the successive opencv images of a video in a QLabel, scaled to the label size with their aspect ratio. The
+    scaled size is only computed again when the label or the image size changes, the buffer of the scaled image is
+    reused from frame to frame. The QPixmap is new for each frame: the label shares the data of the pixmap it shows,
+    converting a new frame into the same pixmap would copy it anyway.
+    """
+
+    def __init__(self, label, bgr2rgb=True):
+        self.label = label
+        self.bgr2rgb = bgr2rgb
+        self._key = None  # (image shape, label width, label height) of the scaled size
+        self._size = None
+        self._buffer = None
+
+    def show(self, cv_img):
+        """Show cv_img in the label and return the shown QPixmap"""
+        key = (cv_img.shape, self.label.width(), self.label.height())
+        if key != self._key:
+            h, w = cv_img.shape[:2]
+            self._key = key
+            self._size = fit_size(w, h, key[1], key[2])
+            self._buffer = None
+
+        if self._size != (cv_img.shape[1], cv_img.shape[0]):
+            cv_img = self._buffer = cv2.resize(cv_img, self._size, self._buffer, interpolation=cv2.INTER_NEAREST)
+        pixmap = Qtg.QPixmap.fromImage(convert_cv_to_qimage(cv_img, self.bgr2rgb))
+        self.label.setPixmap(pixmap)
+        return pixmap
 
 
 def convert_CV_64F_to_uint8(img):
@@ -203,33 +265,289 @@ class QLabelLin(Qtw.QLabel):
 
 
 class GetVideoThread(Qtc.QThread):
+    """
+    Thread waiting for the frames of the camera backend. Only the newest frame is kept in a single-slot mailbox: if
+    the GUI has not taken the previous one yet, it is replaced (and counted as dropped) instead of queuing up, so the
+    video tabs always work on the latest frame at the sensor rate.
+    """
 
     new_cv_img_signal = Qtc.pyqtSignal(np.ndarray)
     stopped_signal = Qtc.pyqtSignal()
+    fps_signal = Qtc.pyqtSignal(float, float, float)  # acquisition, processing and display FPS, every second
+    _frame_ready_signal = Qtc.pyqtSignal()
 
     def __init__(self, cam):
         super().__init__()
         self.run_flag = True
         self.cam = cam
 
-    def run(self):
-
+        self._lock = threading.Lock()
+        self._mailbox = None
+        self.nb_dropped = 0  # Frames replaced in the mailbox before the GUI took them
+        self.nb_missed = 0  # Frames of the camera never seen by the thread
+        self.roi = None  # Software ROI (x, y, width, height) of the delivered frames, None for the full frames
+        self._frame_buses = []  # FrameBus receiving the frames, for the processing in other processes
+        self._buses_lock = threading.Lock()
+
+        self.acquisition_fps = 0.0
+        self.processing_fps = 0.0
+        self.display_fps = 0.0
+        self._nb_acquired = 0
+        self._nb_displayed = 0
+        self._processing_time = 0.0
+        self._fps_time = time.perf_counter()
+
+        # Queued connection: the frame is delivered in the GUI thread
+        self._frame_ready_signal.connect(self._deliver_frame, Qtc.Qt.QueuedConnection)
+
+    def start(self, *args):
+        # Setting the flag here keeps the thread alive when start() follows stop() before the thread is finished
         self.run_flag = True
+        super().start(*args)
+
+    def run(self):
+        last_index = self.cam.frame_index
         while self.run_flag:
-            array = self.cam.get_image()
-            frame = np.reshape(array, (self.cam.height.value, self.cam.width.value, int(self.cam.nBitsPerPixel / 8)))
-            frame = cv2.resize(frame, (0, 0), fx=1, fy=1)
-            # frame = cv2.flip(frame, 1)
-            self.new_cv_img_signal.emit(frame)
+            if self.cam.wait_frame(last_index, timeout=0.2) is None:
+                if not self.cam.is_running():
+                    time.sleep(0.05)
+                continue
+            frame, index, _ = self.cam.get_frame_info()
+            if last_index > 0:
+                self.nb_missed += index - last_index - 1
+            last_index = index
+
+            # The GUI owns the frame (screenshots keep a reference), the camera buffer will be reused: only the ROI is
+            # copied, so the processing of all the tabs scales with its area
+            roi = self.roi
+            if roi is not None:
+                x, y, w, h = roi
+                crop = frame[y:y + h, x:x + w]
+                if crop.size:  # Else the ROI is out of the frame (smaller sensor AOI), the full frame is delivered
+                    frame = crop
+            with self._buses_lock:
+                for bus in self._frame_buses:
+                    if bus.shape == frame.shape and bus.dtype == frame.dtype:
+                        bus.publish(frame)
+            frame = frame.copy()
+            with self._lock:
+                pending = self._mailbox is not None
+                if pending:
+                    self.nb_dropped += 1
+                self._mailbox = frame
+                self._nb_acquired += 1
+            if not pending:
+                self._frame_ready_signal.emit()
 
-            time.sleep(1/15)
+    @Qtc.pyqtSlot()
+    def _deliver_frame(self):
+        with self._lock:
+            frame, self._mailbox = self._mailbox, None
+        if frame is None:
+            return
+
+        t0 = time.perf_counter()
+        self.new_cv_img_signal.emit(frame)  # All the tabs process and display the frame here
+        t1 = time.perf_counter()
+        self._processing_time += t1 - t0
+        self._nb_displayed += 1
+
+        if t1 - self._fps_time >= 1:
+            with self._lock:
+                nb_acquired, self._nb_acquired = self._nb_acquired, 0
+            self.acquisition_fps = nb_acquired / (t1 - self._fps_time)
+            self.display_fps = self._nb_displayed / (t1 - self._fps_time)
+            self.processing_fps = self._nb_displayed / self._processing_time if self._processing_time > 0 else 0.0
+            self._nb_displayed = 0
+            self._processing_time = 0.0
+            self._fps_time = t1
+            self.fps_signal.emit(self.acquisition_fps, self.processing_fps, self.display_fps)
+
+    def set_roi(self, roi):
+        """
+        Crop the delivered frames to roi, without interrupting the acquisition (the camera keeps its AOI)
+
+        :param roi: (x, y, width, height) in the frames of the camera, None for the full frames
+        :return: No return
+        """
+        self.roi = None if roi is None else tuple(int(v) for v in roi)
+
+    def add_frame_bus(self, bus):
+        """Publish the frames (after the ROI crop) into bus, when they have its format"""
+        with self._buses_lock:
+            self._frame_buses.append(bus)
+
+    def remove_frame_bus(self, bus):
+        """Stop publishing into bus, it can be closed once this returns"""
+        with self._buses_lock:
+            self._frame_buses.remove(bus)
 
     def stop(self):
-        """Sets run flag to False and waits for thread to finish"""
+        """Sets run flag to False, the thread finishes after the current frame"""
         self.run_flag = False
         self.stopped_signal.emit()
 
 
+class ProcessingWorker(Qtc.QObject):
+    """
+    Runs the processing of the video tabs in a thread pool (OpenCV releases the GIL), out of the GUI thread. The GUI
+    slot submits the newest frame and receives the result through result_signal. A frame is dropped when max_pending
+    frames are already submitted and not yet delivered, so the processing never falls behind the camera.
+    """
+
+    result_signal = Qtc.pyqtSignal(object)
+    _done_signal = Qtc.pyqtSignal(object)
+
+    def __init__(self, function, max_workers=2, max_pending=2, parent=None):
+        """
+        :param function: function(frame, *args) returning the result, called in a thread of the pool
+        :param max_workers: number of threads of the pool
+        :param max_pending: maximum number of frames submitted and not yet delivered
+        :param parent: parent QObject
+        """
+        super().__init__(parent)
+        self.function = function
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers)
+        self.nb_pending = 0
+        self.nb_dropped = 0
+        self.latency = 0.0  # Mean time between the submission of a frame and the delivery of its result, in s
+        self._seq = 0
+        self._last_delivered = 0
+        self._done_signal.connect(self._deliver)
+
+    def submit(self, frame, *args):
+        """
+        Submit a frame to the processing (to be called in the GUI thread)
+
+        :return: True if the frame is submitted, False if it is dropped
+        """
+        if self.nb_pending >= self.max_pending:
+            self.nb_dropped += 1
+            return False
+        self.nb_pending += 1
+        self._seq += 1
+        self.executor.submit(self._run, self._seq, time.perf_counter(), frame, args)
+        return True
+
+    def _run(self, seq, t0, frame, args):
+        try:
+            result = self.function(frame, *args)
+        except Exception as e:
+            print(f'{self.function.__name__} ERROR: {e}')
+            result = None
+        self._done_signal.emit((seq, t0, result))  # Queued: delivered in the GUI thread
+
+    @Qtc.pyqtSlot(object)
+    def _deliver(self, done):
+        seq, t0, result = done
+        self.nb_pending -= 1
+        if seq < self._last_delivered or result is None:  # Finished after a newer frame
+            return
+        self._last_delivered = seq
+        self.latency = 0.9 * self.latency + 0.1 * (time.perf_counter() - t0) if self.latency else \
+            time.perf_counter() - t0
+        self.result_signal.emit(result)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+class BusProcessingWorker(Qtc.QObject):
+    """
+    Runs the processing of a video tab in another process, with the same interface as ProcessingWorker. The frames are
+    published by the GetVideoThread into a FrameBus and read by the process without copy (see frame_bus.consume), the
+    GUI only sends the arguments of the processing when they change. The process always works on the newest frame.
+    The function, its arguments and its results must be picklable.
+    """
+
+    result_signal = Qtc.pyqtSignal(object)
+
+    def __init__(self, function, video_thread, nb_slots=4, parent=None):
+        """
+        :param function: function(frame, *args) returning the result, defined at the top level of a module
+        :param video_thread: GetVideoThread publishing the frames
+        :param nb_slots: number of frames of the bus
+        :param parent: parent QObject
+        """
+        super().__init__(parent)
+        self.function = function
+        self.video_thread = video_thread
+        self.nb_slots = nb_slots
+        self.latency = 0.0  # Mean time between the delivery of a frame to the GUI and of its result, in s
+        self.bus = None
+        self._process = None
+        self._args = None
+        self._submit_times = deque(maxlen=64)  # (number of the last published frame, time) of the submissions
+        # The GUI process has threads, the processing process is spawned instead of forked
+        self._context = multiprocessing.get_context('spawn')
+
+        self._timer = Qtc.QTimer(self)
+        self._timer.setInterval(5)
+        self._timer.timeout.connect(self._poll)
+        Qtw.QApplication.instance().aboutToQuit.connect(self.shutdown)
+
+    def submit(self, frame, *args):
+        """
+        Send the arguments of the processing if they changed (to be called in the GUI thread). The frame is only used
+        for its format, the process reads it from the bus: the process is started again if the format changes.
+
+        :return: True
+        """
+        if self.bus is None or self.bus.shape != frame.shape or self.bus.dtype != frame.dtype:
+            self._start(frame.shape, frame.dtype)
+        if args != self._args:
+            self._args = args
+            self._args_queue.put(args)
+        self._submit_times.append((self.bus.head, time.perf_counter()))
+        return True
+
+    def _start(self, shape, dtype):
+        self.shutdown()
+        self.bus = FrameBus(shape, dtype, self.nb_slots)
+        self._args = None
+        self._results = self._context.Queue()
+        self._args_queue = self._context.Queue()
+        self._stop_event = self._context.Event()
+        self._process = self._context.Process(target=consume, args=(self.bus.name, self.function, self._results,
+                                                                    self._stop_event, self._args_queue), daemon=True)
+        self._process.start()
+        self.video_thread.add_frame_bus(self.bus)
+        self._timer.start()
+
+    @Qtc.pyqtSlot()
+    def _poll(self):
+        result = None
+        try:
+            while True:
+                seq, result = self._results.get_nowait()
+        except queue.Empty:
+            pass
+        if result is None:
+            return
+        # The frame seq was published before the first submission that saw it
+        t0 = next((t for head, t in self._submit_times if head >= seq), None)
+        if t0 is not None:
+            self.latency = 0.9 * self.latency + 0.1 * (time.perf_counter() - t0) if self.latency else \
+                time.perf_counter() - t0
+        self.result_signal.emit(result)
+
+    @Qtc.pyqtSlot()
+    def shutdown(self):
+        """Stop the process and destroy the bus"""
+        if self.bus is None:
+            return
+        self._timer.stop()
+        self.video_thread.remove_frame_bus(self.bus)
+        self._stop_event.set()
+        self._process.join(1)
+        if self._process.is_alive():
+            self._process.terminate()
+        self.bus.close()
+        self.bus = None
+        self._process = None
+
+
 class Timer:
     def __init__(self):
         self._start_time = None
@@ -259,6 +577,59 @@ class Timer:
         return self.last_elapsed_time
 
 
+class StageTimings:
+    """
+    Rolling statistics of the duration of each stage of a processing pipeline, over its last runs. The durations
+    (time.perf_counter_ns) of the last window runs are kept in a ring buffer: add() is called by the processing
+    thread, statistics() and save_csv() by the GUI thread.
+    """
+
+    def __init__(self, names, window=100):
+        """
+        :param names: name of each stage
+        :param window: number of runs of the statistics
+        """
+        self.names = list(names)
+        self.window = window
+        self.nb_runs = 0
+        # A row for each stage and a last row for the whole pipeline, a column for each run, in ns
+        self._durations = np.zeros((len(self.names) + 1, window), np.int64)
+        self._lock = threading.Lock()
+
+    def add(self, durations):
+        """
+        :param durations: duration of each stage of a run, in ns
+        :return: No return
+        """
+        with self._lock:
+            column = self.nb_runs % self.window
+            self._durations[:-1, column] = durations
+            self._durations[-1, column] = sum(durations)
+            self.nb_runs += 1
+
+    def statistics(self):
+        """
+        :return: arrays of the mean and of the 95th percentile of the duration of each stage then of the whole
+        pipeline, in ms (zeros before the first run)
+        """
+        with self._lock:
+            samples = self._durations[:, :min(self.nb_runs, self.window)] * 1e-6
+        if not samples.shape[1]:
+            return np.zeros(len(samples)), np.zeros(len(samples))
+        return samples.mean(axis=1), np.percentile(samples, 95, axis=1)
+
+    def save_csv(self, filename):
+        """Write the statistics of each stage and of the whole pipeline in a CSV file"""
+        mean, p95 = self.statistics()
+        total = max(mean[-1], 1e-12)
+        with open(filename, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['stage', 'process', 'runs', 'mean_ms', 'p95_ms', 'share_percent'])
+            for i, name in enumerate(self.names + ['total']):
+                writer.writerow([i + 1 if i < len(self.names) else '', name, min(self.nb_runs, self.window),
+                                 f'{mean[i]:.3f}', f'{p95[i]:.3f}', f'{100 * mean[i] / total:.1f}'])
+
+
 def midpoint(a, b):
     return (a[0]+b[0])/2, (a[1]+b[1])/2
 
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Background writers
+
+Serial commands and image files are written by threads, so the video loop never waits for the serial port or the
+disk. The queues are bounded: if the device or the disk is too slow, the new items are dropped and counted instead of
+piling up in memory.
+
+Laboratoire d Enseignement Experimental - Institut d Optique Graduate School
+"""
+
+import os
+import queue
+import threading
+
+import cv2
+
+
+class _BackgroundWriter:
+    """
+    Thread writing the items of a bounded queue. Counters:
+        - nb_written: items written
+        - nb_dropped: items dropped because the queue was full
+        - nb_errors: items whose writing failed (last_error is the last exception)
+    """
+
+    def __init__(self, max_pending, name):
+        self._queue = queue.Queue(max_pending)
+        self.nb_written = 0
+        self.nb_dropped = 0
+        self.nb_errors = 0
+        self.last_error = None
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        """Queue an item without blocking, return False if it is dropped"""
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            self.nb_dropped += 1
+            return False
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                self._write(item)
+                self.nb_written += 1
+            except Exception as error:  # serial.SerialException, OSError... the thread must go on
+                self.nb_errors += 1
+                self.last_error = error
+
+    def _write(self, item):
+        raise NotImplementedError
+
+    def close(self, wait=True):
+        """Stop the thread once the queued items are written"""
+        self._queue.put(None)
+        if wait:
+            self._thread.join()
+
+
+class SerialWriter(_BackgroundWriter):
+    """Send commands to a serial port (serial.Serial) from a thread. Commands are skipped while the port is closed."""
+
+    def __init__(self, ser, max_pending=16):
+        self.ser = ser
+        super().__init__(max_pending, 'SerialWriter')
+
+    def send(self, command):
+        """
+        :param command: string sent in utf-8
+        :return: False if the command is dropped (too many commands pending)
+        """
+        return self._put(command)
+
+    def _write(self, command):
+        if self.ser.is_open:
+            self.ser.write(command.encode('utf-8'))
+
+
+class ImageSaver(_BackgroundWriter):
+    """Save images with cv2.imwrite from a thread, into directory (created if needed)"""
+
+    def __init__(self, directory, max_pending=8):
+        self.directory = directory
+        super().__init__(max_pending, 'ImageSaver')
+
+    def save(self, img, filename):
+        """
+        :param img: image to save, must not be modified afterwards (it is not copied)
+        :param filename: name of the file in the current directory, its extension gives the format
+        :return: False if the image is dropped (the disk is too slow)
+        """
+        return self._put((os.path.join(self.directory, filename), img))
+
+    def _write(self, item):
+        path, img = item
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not cv2.imwrite(path, img):
+            raise OSError(f'Cannot write {path}')
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Batch processing of images and videos
+
+Applies a processing recipe (see recipe.py) to all the images of a folder or to all the frames of a video, detects
+the objects of the result and writes one CSV row per object (and one row for each image without object):
+    - contours: center, area and perimeter of the objects,
+    - shapes: same, with the shape identified from the test shapes of a directory (see FormDetectionFunction.py),
+    - measure: same, with the length and the width of the minimum area rectangle of the objects.
+The images, or chunks of frames of the video, are processed in parallel by a ProcessPoolExecutor, without the GUI.
+
+Example:
+    python batch.py recipe.json images/ results.csv --analysis shapes --templates test_shapes --workers 8
+
+Laboratoire d Enseignement Experimental - Institut d Optique Graduate School
+"""
+
+import argparse
+import csv
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from recipe import load_recipe, compile_recipe, apply_recipe
+from PreProcessingFunction import func_components_list, func_otsu_thresholding
+from FormDetectionFunction import get_template_index, get_shape_features, SHAPES_NAME_LIST
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+ANALYSES = ('contours', 'shapes', 'measure')
+COLUMNS = ['source', 'frame', 'nb_objects', 'object', 'x', 'y', 'area', 'perimeter']
+ANALYSIS_COLUMNS = {'contours': [], 'shapes': ['shape'], 'measure': ['length', 'width', 'unit']}
+IMAGES_PER_TASK = 16
+
+# Set in each process of the pool by _init_worker
+_pipeline = None
+_options = None
+
+
+def _init_worker(steps, options):
+    global _pipeline, _options
+    _pipeline = compile_recipe(steps)
+    _options = options
+
+
+def analyze_image(img, source, frame, pipeline, options):
+    """
+    Apply the recipe to an image and analyze its objects
+
+    :param img: gray (or color if options['color']) image
+    :param source: name of the image file or of the video, written in the rows
+    :param frame: index of the frame in the video (None for an image file)
+    :param pipeline: compiled recipe
+    :param options: dictionary of the options of the command line (analysis, min_area, max_area...)
+    :return: list of the CSV rows (dictionaries)
+    """
+    binary_img = apply_recipe(img, pipeline)
+    if len(binary_img.shape) == 3:
+        binary_img = cv2.cvtColor(binary_img, cv2.COLOR_BGR2GRAY)
+    if binary_img.dtype != np.uint8:
+        binary_img = cv2.normalize(binary_img, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
+    if cv2.countNonZero(cv2.inRange(binary_img, 1, 254)):  # The recipe does not end with a thresholding
+        binary_img = func_otsu_thresholding(binary_img)
+
+    contours_list, stats, centers = func_components_list(binary_img, options['min_area'], options['max_area'],
+                                                         border_margin=options['border_margin'])
+    base = {'source': source, 'frame': '' if frame is None else frame, 'nb_objects': len(contours_list)}
+    if not contours_list:
+        return [base]
+
+    analysis = options['analysis']
+    if analysis == 'shapes':
+        features = get_shape_features(contours_list)
+        shape_indexes = get_template_index(options['templates']).classify(features['hu'])
+
+    rows = []
+    for i, cnt in enumerate(contours_list):
+        row = dict(base, object=i, x=round(float(centers[i][0]), 2), y=round(float(centers[i][1]), 2),
+                   area=int(stats[i][cv2.CC_STAT_AREA]), perimeter=round(cv2.arcLength(cnt, True), 2))
+        if analysis == 'shapes':
+            row['shape'] = SHAPES_NAME_LIST[shape_indexes[i]]
+        elif analysis == 'measure':
+            size = cv2.minAreaRect(cnt)[1]
+            row['length'] = round(max(size) * options['scale'], 3)
+            row['width'] = round(min(size) * options['scale'], 3)
+            row['unit'] = options['unit']
+        rows.append(row)
+    return rows
+
+
+def _process_images(paths):
+    flag = cv2.IMREAD_COLOR if _options['color'] else cv2.IMREAD_GRAYSCALE
+    rows = []
+    for path in paths:
+        img = cv2.imread(path, flag)
+        if img is None:
+            print(f'{path}: not an image, skipped', file=sys.stderr)
+            continue
+        rows += analyze_image(img, os.path.basename(path), None, _pipeline, _options)
+    return rows
+
+
+def _process_video(task):
+    path, start, stop = task
+    capture = cv2.VideoCapture(path)
+    capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+    rows = []
+    frame = start
+    while stop is None or frame < stop:
+        ok, img = capture.read()
+        if not ok:
+            break
+        if not _options['color'] and len(img.shape) == 3:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        rows += analyze_image(img, os.path.basename(path), frame, _pipeline, _options)
+        frame += 1
+    capture.release()
+    return rows
+
+
+def make_tasks(input_path, nb_workers):
+    """
+    :return: function processing a task in a process of the pool, list of the tasks (chunks of images or of frames)
+    """
+    if os.path.isdir(input_path):
+        paths = sorted(os.path.join(input_path, name) for name in os.listdir(input_path)
+                       if name.lower().endswith(IMAGE_EXTENSIONS))
+        return _process_images, [paths[i:i + IMAGES_PER_TASK] for i in range(0, len(paths), IMAGES_PER_TASK)]
+
+    capture = cv2.VideoCapture(input_path)
+    if not capture.isOpened():
+        raise ValueError(f'{input_path} is neither a folder nor a video')
+    nb_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    capture.release()
+    if nb_frames <= 0:  # Unknown length, the video is read by a single process
+        return _process_video, [(input_path, 0, None)]
+    # Several chunks per process, so that the processes finish at about the same time
+    chunk = max(-(-nb_frames // (4 * nb_workers)), 1)
+    tasks = [(input_path, start, min(start + chunk, nb_frames)) for start in range(0, nb_frames, chunk)]
+    tasks[-1] = (input_path, tasks[-1][1], None)  # The frame count of some containers is not exact
+    return _process_video, tasks
+
+
+def run_batch(recipe_filename, input_path, output_filename, nb_workers=None, **options):
+    """
+    Process a folder of images or a video with a recipe and write the results in a CSV file
+
+    :param options: analysis, min_area, max_area, border_margin, templates, scale, unit, color (see main)
+    :return: number of rows written
+    """
+    steps = load_recipe(recipe_filename)
+    nb_workers = nb_workers or os.cpu_count()
+    function, tasks = make_tasks(input_path, nb_workers)
+    columns = COLUMNS + ANALYSIS_COLUMNS[options['analysis']]
+
+    nb_rows = 0
+    with open(output_filename, 'w', newline='') as file, \
+            ProcessPoolExecutor(nb_workers, initializer=_init_worker, initargs=(steps, options)) as executor:
+        writer = csv.DictWriter(file, columns)
+        writer.writeheader()
+        # The results come in the order of the tasks
+        for i, rows in enumerate(executor.map(function, tasks)):
+            writer.writerows(rows)
+            nb_rows += len(rows)
+            print(f'\r{i + 1} / {len(tasks)} chunks', end='', file=sys.stderr)
+    print(file=sys.stderr)
+    return nb_rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Apply a processing recipe to a folder of images or to a video and '
+                                                 'write the objects found in a CSV file')
+    parser.add_argument('recipe', help='recipe file saved by a processing tab (.json)')
+    parser.add_argument('input', help='folder of images or video file')
+    parser.add_argument('output', help='CSV file of the results')
+    parser.add_argument('--analysis', choices=ANALYSES, default='contours')
+    parser.add_argument('--min-area', type=int, default=0, help='minimum area of the objects [pix^2]')
+    parser.add_argument('--max-area', type=int, default=1000000000, help='maximum area of the objects [pix^2]')
+    parser.add_argument('--border-margin', type=int, default=5,
+                        help='objects closer to the border are ignored [pix], -1 to keep them')
+    parser.add_argument('--templates', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_shapes'),
+                        help='directory of the test shapes (shapes analysis)')
+    parser.add_argument('--scale', type=float, default=1., help='size of a pixel (measure analysis)')
+    parser.add_argument('--unit', default='pix', help='unit of the scale (measure analysis)')
+    parser.add_argument('--color', action='store_true', help='apply the recipe to the color images')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (all the cores by default)')
+    args = parser.parse_args(argv)
+
+    nb_rows = run_batch(args.recipe, args.input, args.output, args.workers, analysis=args.analysis,
+                        min_area=args.min_area, max_area=args.max_area,
+                        border_margin=None if args.border_margin < 0 else args.border_margin,
+                        templates=args.templates, scale=args.scale, unit=args.unit, color=args.color)
+    print(f'{nb_rows} rows written in {args.output}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Camera calibration for the measurements
+
+A calibration is computed from views of a checkerboard:
+    - the camera matrix and the distortion coefficients (cv2.calibrateCamera) from all the views,
+    - a homography from the undistorted image to the plane of the checkerboard of the last view, in mm. The last view
+      must be taken with the checkerboard on the plane of the objects to measure.
+It is saved as JSON. The frames are corrected either entirely, with undistortion maps computed once
+(cv2.initUndistortRectifyMap then cv2.remap on each frame), or only at the measured points (cv2.undistortPoints),
+which is much cheaper.
+
+Laboratoire d Enseignement Experimental - Institut d Optique Graduate School
+"""
+
+import json
+
+import cv2
+import numpy as np
+
+CALIBRATION_VERSION = 1
+CORNERS_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+
+
+def find_checkerboard(gray_img, pattern_size):
+    """
+    :param gray_img: 8-bit grayscale image of the checkerboard
+    :param pattern_size: number of inner corners (columns, rows)
+    :return: array (number of corners, 1, 2) of the corners refined to sub-pixel, None if not found
+    """
+    found, corners = cv2.findChessboardCorners(gray_img, pattern_size,
+                                               flags=cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_NORMALIZE_IMAGE)
+    if not found:
+        return None
+    return cv2.cornerSubPix(gray_img, corners, (11, 11), (-1, -1), CORNERS_CRITERIA)
+
+
+def checkerboard_points(pattern_size, square_size):
+    """:return: array (number of corners, 3) of the corners on the checkerboard plane (z = 0), in mm"""
+    columns, rows = pattern_size
+    points = np.zeros((columns * rows, 3), np.float32)
+    points[:, :2] = np.mgrid[0:columns, 0:rows].T.reshape(-1, 2) * square_size
+    return points
+
+
+class Calibration:
+    """Intrinsic calibration of the camera and homography to the plane of measurement (mm)"""
+
+    def __init__(self, image_size, camera_matrix, dist_coeffs, homography, rms=0., nb_views=0):
+        """
+        :param image_size: (width, height) of the calibrated frames
+        :param camera_matrix: 3x3 camera matrix
+        :param dist_coeffs: distortion coefficients
+        :param homography: 3x3 homography from the undistorted image (pixels) to the plane of measurement (mm)
+        :param rms: reprojection error of the calibration, in pixels
+        :param nb_views: number of checkerboard views used
+        """
+        self.image_size = tuple(int(v) for v in image_size)
+        self.camera_matrix = np.asarray(camera_matrix, np.float64).reshape(3, 3)
+        self.dist_coeffs = np.asarray(dist_coeffs, np.float64).ravel()
+        self.homography = np.asarray(homography, np.float64).reshape(3, 3)
+        self.rms = float(rms)
+        self.nb_views = int(nb_views)
+        # Undistortion maps of the whole frames, computed once (fixed point maps, the fastest for cv2.remap)
+        self.map1, self.map2 = cv2.initUndistortRectifyMap(self.camera_matrix, self.dist_coeffs, None,
+                                                           self.camera_matrix, self.image_size, cv2.CV_16SC2)
+
+    @classmethod
+    def from_views(cls, views, pattern_size, square_size, image_size):
+        """
+        :param views: list of the corners found in each view (see find_checkerboard), the last one on the plane of
+        measurement
+        :param pattern_size: number of inner corners (columns, rows)
+        :param square_size: size of the squares, in mm
+        :param image_size: (width, height) of the frames
+        :return: Calibration
+        """
+        object_points = checkerboard_points(pattern_size, square_size)
+        # k3 is only useful for wide-angle lenses, and diverges out of the field covered by the views
+        rms, camera_matrix, dist_coeffs, _, _ = cv2.calibrateCamera([object_points] * len(views), views, image_size,
+                                                                    None, None, flags=cv2.CALIB_FIX_K3)
+        undistorted = cv2.undistortPoints(views[-1], camera_matrix, dist_coeffs, P=camera_matrix)
+        homography = cv2.findHomography(undistorted.reshape(-1, 2), object_points[:, :2])[0]
+        return cls(image_size, camera_matrix, dist_coeffs, homography, rms, len(views))
+
+    def matches(self, img):
+        """Return True if img has the size of the calibrated frames"""
+        return (img.shape[1], img.shape[0]) == self.image_size
+
+    def remap(self, img, dst=None):
+        """
+        :param dst: output image, allocated if None (must not be img)
+        :return: undistorted image
+        """
+        return cv2.remap(img, self.map1, self.map2, cv2.INTER_LINEAR, dst=dst)
+
+    def undistort_points(self, points):
+        """
+        :param points: array (n, 2) or (n, 1, 2) of points of a raw frame, in pixels
+        :return: array (n, 2) of the points in the undistorted frame, in pixels
+        """
+        points = np.asarray(points, np.float64).reshape(-1, 1, 2)
+        return cv2.undistortPoints(points, self.camera_matrix, self.dist_coeffs, P=self.camera_matrix).reshape(-1, 2)
+
+    def to_mm(self, points, undistorted=False):
+        """
+        :param points: array (n, 2) or (n, 1, 2) of points, in pixels
+        :param undistorted: True if the points are in an undistorted frame (see remap), False in a raw frame
+        :return: array (n, 2) of the points on the plane of measurement, in mm
+        """
+        points = np.asarray(points, np.float64).reshape(-1, 2)
+        if not undistorted:
+            points = self.undistort_points(points)
+        return cv2.perspectiveTransform(points.reshape(-1, 1, 2), self.homography).reshape(-1, 2)
+
+    def measure_box(self, contour, undistorted=False):
+        """
+        Dimensions of an object, from the minimum area rectangle of its contour on the plane of measurement (the
+        rectangle of the pixels is not one in mm if the plane is tilted)
+
+        :param contour: contour of the object, in pixels
+        :param undistorted: True if the contour is in an undistorted frame (see remap), False in a raw frame
+        :return: length and width of the object (length >= width), in mm
+        """
+        points = self.to_mm(contour, undistorted)
+        size = cv2.minAreaRect(points.astype(np.float32))[1]
+        return max(size), min(size)
+
+    def save(self, filename):
+        data = {'version': CALIBRATION_VERSION, 'image_size': self.image_size,
+                'camera_matrix': self.camera_matrix.tolist(), 'dist_coeffs': self.dist_coeffs.tolist(),
+                'homography': self.homography.tolist(), 'rms': self.rms, 'nb_views': self.nb_views}
+        with open(filename, 'w') as file:
+            json.dump(data, file, indent=2)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as file:
+            data = json.load(file)
+        if data.get('version', 0) > CALIBRATION_VERSION:
+            raise ValueError(f'{filename}: calibration version {data["version"]} is not supported')
+        try:
+            return cls(data['image_size'], data['camera_matrix'], data['dist_coeffs'], data['homography'],
+                       data.get('rms', 0.), data.get('nb_views', 0))
+        except KeyError as error:
+            raise ValueError(f'{filename}: {error.args[0]} missing') from None
@@ -0,0 +1,657 @@
+# -*- coding: utf-8 -*-
+"""
+Camera backends
+
+Common interface over the camera drivers used in the LEnsE labworks (uEye, Basler and UVC webcams) and a synthetic
+camera generating test scenes (fringes, laser beam, objects on a conveyor belt), so the applications can be run and
+benchmarked without any camera connected.
+
+All the backends acquire frames in their own thread: start() and stop() return immediately, wait_frame() blocks until
+a new frame is published and get_frame() returns the frame buffer itself (no copy).
+
+Laboratoire d Enseignement Experimental - Institut d Optique Graduate School
+"""
+
+import threading
+import time
+from enum import IntFlag
+
+import numpy as np
+import cv2
+
+try:
+    from pyueye import ueye
+except ImportError:  # No IDS driver installed, only the other backends can be used
+    ueye = None
+
+
+class Capability(IntFlag):
+    """Settings a backend can change on the camera"""
+    NONE = 0
+    EXPOSURE = 1
+    FRAME_RATE = 2
+    AOI = 4
+    COLOR = 8
+    PIXEL_CLOCK = 16
+
+
+class CameraBackend:
+    """
+    Base class of all the camera backends.
+
+    Subclasses implement _grab() (blocks until the next frame and returns it) and, if needed, _start_acquisition() and
+    _stop_acquisition(). The settings methods of the base class do nothing, check has_capability() before using them.
+    """
+
+    capabilities = Capability.NONE
+    name = 'Camera'
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._frame = None
+        self._frame_index = 0
+        self._frame_timestamp = 0.0
+        self._thread = None
+        self._run_flag = False
+
+    def has_capability(self, capability):
+        return bool(self.capabilities & capability)
+
+    def start(self):
+        """Start the acquisition thread and return immediately"""
+        if self.is_running():
+            return
+        self._run_flag = True
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, wait=False, timeout=None):
+        """
+        Ask the acquisition thread to stop.
+
+        :param wait: if True, block until the thread is finished (or timeout)
+        :param timeout: maximum waiting time in seconds
+        :return: No return
+        """
+        self._run_flag = False
+        with self._condition:
+            self._condition.notify_all()
+        if wait and self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def close(self):
+        self.stop(wait=True)
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def wait_frame(self, last_index=0, timeout=None):
+        """
+        Wait for a frame newer than last_index.
+
+        :param last_index: index of the last frame read by the caller
+        :param timeout: maximum waiting time in seconds (None to wait forever)
+        :return: index of the newest frame, or None if the timeout expired or the acquisition stopped
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._frame_index > last_index or not self._run_flag, timeout)
+            if self._frame_index > last_index:
+                return self._frame_index
+            return None
+
+    def get_frame(self):
+        """
+        Return the newest frame. The array is the acquisition buffer itself, it must be copied if it has to outlive
+        the next frames.
+        """
+        return self._frame
+
+    def get_frame_info(self):
+        """Return the newest frame with its index and its timestamp (time.perf_counter() of its publication)"""
+        with self._condition:
+            return self._frame, self._frame_index, self._frame_timestamp
+
+    @property
+    def frame_index(self):
+        return self._frame_index
+
+    def _run(self):
+        try:
+            self._start_acquisition()
+            while self._run_flag:
+                frame = self._grab()
+                if frame is not None:
+                    self._publish(frame)
+        finally:
+            self._stop_acquisition()
+            self._run_flag = False
+            with self._condition:
+                self._condition.notify_all()
+
+    def _publish(self, frame):
+        with self._condition:
+            self._frame = frame
+            self._frame_index += 1
+            self._frame_timestamp = time.perf_counter()
+            self._condition.notify_all()
+
+    def _reconfigure(self, function, *args):
+        """Call function(*args) with the acquisition stopped, then restart it if it was running"""
+        running = self.is_running()
+        if running:
+            self.stop(wait=True)
+        result = function(*args)
+        if running:
+            self.start()
+        return result
+
+    def _start_acquisition(self):
+        pass
+
+    def _stop_acquisition(self):
+        pass
+
+    def _grab(self):
+        raise NotImplementedError
+
+    def get_cam_info(self):
+        """Return the serial number and the ID of the camera"""
+        return None, None
+
+    def get_sensor_info(self):
+        """Return the maximum width and height of the sensor, its name and its pixel size (in 1/100 µm)"""
+        return None, None, self.name, None
+
+    def get_aoi(self):
+        return None
+
+    def set_aoi(self, x, y, w, h):
+        pass
+
+    def is_color(self):
+        return False
+
+    def set_color(self, color):
+        pass
+
+    def get_exposure(self):
+        return None
+
+    def set_exposure(self, exposure):
+        pass
+
+    def get_exposure_range(self):
+        return None, None
+
+    def get_frame_rate(self):
+        return None
+
+    def set_frame_rate(self, fps):
+        pass
+
+    def get_frame_rate_range(self):
+        return None, None
+
+    def get_pixel_clock(self):
+        return None
+
+
+def _first_method(obj, *names):
+    """Return the first existing method among names, the drivers do not all use the same method names"""
+    for name in names:
+        method = getattr(obj, name, None)
+        if method is not None:
+            return method
+    raise AttributeError(f'{type(obj).__name__} has none of the methods {names}')
+
+
+class UEyeBackend(CameraBackend):
+    """
+    Backend for the IDS uEye cameras, built on a uEyeCamera object of any of the camera.py / cameraIDS.py /
+    cameraUeye.py modules. New frames are waited with the uEye frame event.
+    """
+
+    capabilities = Capability.EXPOSURE | Capability.FRAME_RATE | Capability.AOI | Capability.COLOR | \
+        Capability.PIXEL_CLOCK
+    name = 'uEye camera'
+
+    def __init__(self, cam, timeout=1000):
+        """
+        :param cam: uEyeCamera object
+        :param timeout: maximum waiting time of a frame in ms
+        """
+        super().__init__()
+        if ueye is None:
+            raise ImportError('pyueye and the IDS driver are needed for the uEye cameras')
+
+        self.cam = cam
+        self.timeout = timeout
+        self._use_event = True
+
+        self._set_frame_rate = _first_method(cam, 'set_frame_rate', 'set_framerate')
+        self._set_exposure = _first_method(cam, 'set_exposure', 'set_exposure_time')
+
+        self.width_max = int(cam.width_max.value)
+        self.height_max = int(cam.height_max.value)
+        self.cam.set_display_mode(ueye.IS_SET_DM_DIB)
+        self.cam.set_colormode(ueye.IS_CM_MONO8)
+        self.cam.set_aoi(0, 0, self.width_max, self.height_max)
+        self.cam.alloc()
+
+    def _start_acquisition(self):
+        self.cam.capture_video()
+        try:
+            self._use_event = ueye.is_EnableEvent(self.cam.h_cam, ueye.IS_SET_EVENT_FRAME) == ueye.IS_SUCCESS
+        except NotImplementedError:  # Old driver without is_WaitEvent
+            self._use_event = False
+
+    def _stop_acquisition(self):
+        if self._use_event:
+            ueye.is_DisableEvent(self.cam.h_cam, ueye.IS_SET_EVENT_FRAME)
+        self.cam.stop_video()
+
+    def _grab(self):
+        if self._use_event:
+            if ueye.is_WaitEvent(self.cam.h_cam, ueye.IS_SET_EVENT_FRAME, self.timeout) != ueye.IS_SUCCESS:
+                return None
+        else:
+            time.sleep(1 / max(self.get_frame_rate() or 1, 1))
+
+        array = self.cam.get_image()
+        channels = int(self.cam.nBitsPerPixel) // 8
+        if channels == 1:
+            return np.reshape(array, (self.cam.height.value, self.cam.width.value))
+        return np.reshape(array, (self.cam.height.value, self.cam.width.value, channels))
+
+    def get_cam_info(self):
+        return self.cam.get_cam_info()
+
+    def get_sensor_info(self):
+        return self.width_max, self.height_max, self.cam.cam_name, self.cam.cam_pixel
+
+    def get_aoi(self):
+        return self.cam.get_aoi()
+
+    def set_aoi(self, x, y, w, h):
+        self._reconfigure(self._set_aoi, x, y, w, h)
+
+    def _set_aoi(self, x, y, w, h):
+        self.cam.un_alloc()
+        self.cam.set_aoi(x, y, w, h)
+        self.cam.alloc()
+
+    def is_color(self):
+        return self.cam.colormode != ueye.IS_CM_MONO8
+
+    def set_color(self, color):
+        self._reconfigure(self._set_color, color)
+
+    def _set_color(self, color):
+        self.cam.un_alloc()
+        self.cam.set_colormode(ueye.IS_CM_BGR8_PACKED if color else ueye.IS_CM_MONO8)
+        self.cam.alloc()
+
+    def get_exposure(self):
+        return self.cam.get_exposure()
+
+    def set_exposure(self, exposure):
+        self._set_exposure(exposure)
+
+    def get_exposure_range(self):
+        return self.cam.get_exposure_range()
+
+    def get_frame_rate(self):
+        return self.cam.get_frame_rate()
+
+    def set_frame_rate(self, fps):
+        self._set_frame_rate(fps)
+
+    def get_frame_rate_range(self):
+        min_t, max_t, _ = self.cam.get_frame_time_range()
+        return 1 / max_t, 1 / min_t
+
+    def get_pixel_clock(self):
+        return self.cam.get_pixel_clock()
+
+
+class BaslerBackend(CameraBackend):
+    """Backend for the Basler cameras, built on a BaslerCamera object (cameraBasler.py). Exposures are in ms."""
+
+    capabilities = Capability.EXPOSURE | Capability.FRAME_RATE | Capability.AOI
+    name = 'Basler camera'
+
+    def __init__(self, cam):
+        super().__init__()
+        self.cam = cam
+        self._set_frame_rate = _first_method(cam, 'set_frame_rate', 'set_framerate')
+        self._set_exposure = _first_method(cam, 'set_exposure', 'set_exposure_time')
+
+    def _start_acquisition(self):
+        self.cam.capture_video()
+
+    def _stop_acquisition(self):
+        self.cam.stop_video()
+
+    def _grab(self):
+        return self.cam.get_image()
+
+    def get_cam_info(self):
+        return self.cam.get_cam_info()
+
+    def get_sensor_info(self):
+        return self.cam.width_max, self.cam.height_max, self.cam.cam_name, None
+
+    def get_aoi(self):
+        return self.cam.get_aoi()
+
+    def set_aoi(self, x, y, w, h):
+        self._reconfigure(self.cam.set_aoi, x, y, w, h)
+
+    def get_exposure(self):
+        return self.cam.get_exposure() / 1000
+
+    def set_exposure(self, exposure):
+        self._set_exposure(exposure * 1000)
+
+    def get_exposure_range(self):
+        mini, maxi = self.cam.get_exposure_range()
+        return mini / 1000, maxi / 1000
+
+    def get_frame_rate(self):
+        return self.cam.get_frame_rate()
+
+    def set_frame_rate(self, fps):
+        self._set_frame_rate(fps)
+
+    def get_frame_rate_range(self):
+        mini, maxi, _ = self.cam.get_frame_time_range()
+        return mini, maxi
+
+
+class UVCBackend(CameraBackend):
+    """Backend for the UVC webcams, read through cv2.VideoCapture. Frames are BGR images."""
+
+    capabilities = Capability.FRAME_RATE
+    name = 'UVC camera'
+
+    def __init__(self, index=0, api=cv2.CAP_ANY, nb_buffers=3):
+        super().__init__()
+        self.index = index
+        self.api = api
+        self.cap = cv2.VideoCapture(index, api)
+        self._buffers = [None] * nb_buffers
+        self._count = 0
+
+    def _grab(self):
+        i = self._count % len(self._buffers)
+        ret, frame = self.cap.read(self._buffers[i])  # Decoded in place once the buffer has the right shape
+        if not ret:
+            time.sleep(0.01)
+            return None
+        self._buffers[i] = frame
+        self._count += 1
+        return frame
+
+    def close(self):
+        super().close()
+        self.cap.release()
+
+    def get_sensor_info(self):
+        width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        return width, height, self.name, None
+
+    def is_color(self):
+        return True
+
+    def get_frame_rate(self):
+        return self.cap.get(cv2.CAP_PROP_FPS)
+
+    def set_frame_rate(self, fps):
+        self.cap.set(cv2.CAP_PROP_FPS, fps)
+
+    def get_frame_rate_range(self):
+        return 1, self.cap.get(cv2.CAP_PROP_FPS)
+
+
+class SyntheticCamera(CameraBackend):
+    """
+    Camera generating test scenes at a given resolution and frame rate:
+        - 'fringes': moving sinusoidal fringes (structured illumination)
+        - 'beam': gaussian laser spot moving on a Lissajous curve
+        - 'objects': shapes moving on a conveyor belt (machine vision)
+
+    Frames are rendered in a ring of preallocated buffers, a frame stays valid during the nb_buffers - 1 next ones.
+    """
+
+    capabilities = Capability.EXPOSURE | Capability.FRAME_RATE | Capability.AOI | Capability.COLOR
+    name = 'Synthetic camera'
+    SCENES = ('fringes', 'beam', 'objects')
+    REFERENCE_EXPOSURE = 10  # ms, exposure time giving the nominal brightness
+
+    def __init__(self, width=1280, height=1024, frame_rate=30, scene='objects', color=False, noise=0,
+                 nb_buffers=3, seed=0):
+        """
+        :param width: width of the sensor in pixels
+        :param height: height of the sensor in pixels
+        :param frame_rate: frame rate in frames per second
+        :param scene: 'fringes', 'beam' or 'objects'
+        :param color: True for BGR frames, False for grayscale frames
+        :param noise: standard deviation of the additive noise in gray levels (0 for no noise)
+        :param nb_buffers: number of frame buffers in the ring
+        :param seed: seed of the random generator (noise and objects)
+        """
+        super().__init__()
+        if scene not in self.SCENES:
+            raise ValueError(f'Unknown scene {scene}, must be one of {self.SCENES}')
+
+        self.width_max = width
+        self.height_max = height
+        self.scene = scene
+        self.noise = noise
+        self.nb_buffers = nb_buffers
+        self.rng = np.random.default_rng(seed)
+
+        self._lock = threading.Lock()
+        self._color = color
+        self._aoi = (0, 0, width, height)
+        self._frame_rate = frame_rate
+        self._exposure = self.REFERENCE_EXPOSURE
+        self._exposure_lut = None
+        self._next_time = 0.0
+        self._count = 0
+
+        self._prepare()
+
+    def _prepare(self):
+        """Allocate the frame buffers and precompute everything the rendering of a frame needs"""
+        x0, y0, w, h = self._aoi
+        shape = (h, w, 3) if self._color else (h, w)
+        self._buffers = [np.zeros(shape, np.uint8) for _ in range(self.nb_buffers)]
+        self._gray = np.zeros((h, w), np.uint8)
+
+        if self.scene == 'fringes':
+            # One period of the fringes is sampled on 256 steps, the phase of each pixel is stored as a uint8 index
+            # so a frame is a single cv2.LUT with a rolled table
+            period, angle = 16, np.deg2rad(30)
+            y, x = np.mgrid[y0:y0 + h, x0:x0 + w].astype(np.float32)
+            phase = (x * np.cos(angle) + y * np.sin(angle)) * (256 / period)
+            self._phase_idx = np.mod(np.round(phase), 256).astype(np.uint8)
+            self._fringe_lut = np.round(127.5 * (1 + np.cos(2 * np.pi * np.arange(256) / 256))).astype(np.uint8)
+
+        elif self.scene == 'beam':
+            sigma = min(self.width_max, self.height_max) / 20
+            r = int(3 * sigma)
+            y, x = np.mgrid[-r:r + 1, -r:r + 1]
+            self._spot = np.round(250 * np.exp(-(x ** 2 + y ** 2) / (2 * sigma ** 2))).astype(np.uint8)
+
+        elif self.scene == 'objects':
+            self._belt = self._draw_belt()
+
+        if self.noise > 0:
+            noise = np.abs(self.rng.normal(0, self.noise, (4,) + shape))
+            self._noise_bank = np.clip(noise, 0, 255).astype(np.uint8)
+
+    def _draw_belt(self):
+        """Draw one period of the conveyor belt, twice side by side so any window of the sensor width is contiguous"""
+        x0, y0, w, h = self._aoi
+        width, height = self.width_max, self.height_max
+        pattern = np.full((height, width, 3), 30, np.uint8)
+        size = max(min(width, height) // 10, 8)
+        colors = [(0, 0, 220), (0, 200, 0), (220, 0, 0), (0, 220, 220), (220, 0, 220), (220, 220, 0)]
+        nb_objects = max(width // (3 * size), 1)
+        for i in range(nb_objects):
+            center = (int((i + 0.5) * width / nb_objects), int(self.rng.uniform(size, height - size)))
+            sides = [0, 3, 4, 5, 6, -5][i % 6]  # 0 is a circle, -5 a star
+            color = colors[i % len(colors)] if self._color else (230, 230, 230)
+            rotation = self.rng.uniform(0, 2 * np.pi)
+            if sides == 0:
+                cv2.circle(pattern, center, size // 2, color, -1, cv2.LINE_AA)
+            else:
+                cv2.fillPoly(pattern, [_polygon(center, size // 2, sides, rotation)], color, cv2.LINE_AA)
+
+        if not self._color:
+            pattern = cv2.cvtColor(pattern, cv2.COLOR_BGR2GRAY)
+        belt = np.concatenate([pattern, pattern], axis=1)
+        return belt[y0:y0 + h]
+
+    def _render(self, buf):
+        x0, y0, w, h = self._aoi
+        t = self._count / self._frame_rate
+
+        if self.scene == 'fringes':
+            lut = np.roll(self._fringe_lut, -int(self._count * 256 / 12) % 256)  # one period every 12 frames
+            target = self._gray if self._color else buf
+            cv2.LUT(self._phase_idx, lut, dst=target)
+            if self._color:
+                cv2.cvtColor(self._gray, cv2.COLOR_GRAY2BGR, dst=buf)
+
+        elif self.scene == 'beam':
+            target = self._gray if self._color else buf
+            target.fill(10)
+            r = self._spot.shape[0] // 2
+            cx = int(self.width_max / 2 * (1 + 0.6 * np.sin(2 * np.pi * 0.3 * t))) - x0
+            cy = int(self.height_max / 2 * (1 + 0.6 * np.sin(2 * np.pi * 0.2 * t))) - y0
+            xa, xb = max(cx - r, 0), min(cx + r + 1, w)
+            ya, yb = max(cy - r, 0), min(cy + r + 1, h)
+            if xa < xb and ya < yb:
+                target[ya:yb, xa:xb] = self._spot[ya - cy + r:yb - cy + r, xa - cx + r:xb - cx + r]
+            if self._color:
+                cv2.cvtColor(self._gray, cv2.COLOR_GRAY2BGR, dst=buf)
+
+        elif self.scene == 'objects':
+            offset = (self._count * max(self.width_max // 200, 1) + x0) % self.width_max
+            np.copyto(buf, self._belt[:, offset:offset + w])
+
+        if self._exposure_lut is not None:
+            cv2.LUT(buf, self._exposure_lut, dst=buf)
+        if self.noise > 0:
+            cv2.add(buf, self._noise_bank[self._count % len(self._noise_bank)], dst=buf)
+
+    def _grab(self):
+        now = time.perf_counter()
+        if self._next_time > now:
+            time.sleep(self._next_time - now)
+        else:
+            self._next_time = now  # Late (or first frame), no burst to catch up
+        self._next_time += 1 / self._frame_rate
+
+        with self._lock:
+            buf = self._buffers[self._count % self.nb_buffers]
+            self._render(buf)
+            self._count += 1
+        return buf
+
+    def get_cam_info(self):
+        return 'SYNTHETIC', 0
+
+    def get_sensor_info(self):
+        return self.width_max, self.height_max, f'{self.name} ({self.scene})', None
+
+    def get_aoi(self):
+        return self._aoi
+
+    def set_aoi(self, x, y, w, h):
+        x = int(np.clip(x, 0, self.width_max - 1))
+        y = int(np.clip(y, 0, self.height_max - 1))
+        w = int(np.clip(w, 1, self.width_max - x))
+        h = int(np.clip(h, 1, self.height_max - y))
+        with self._lock:
+            self._aoi = (x, y, w, h)
+            self._prepare()
+
+    def is_color(self):
+        return self._color
+
+    def set_color(self, color):
+        with self._lock:
+            self._color = color
+            self._prepare()
+
+    def get_exposure(self):
+        return self._exposure
+
+    def set_exposure(self, exposure):
+        mini, maxi = self.get_exposure_range()
+        self._exposure = min(max(exposure, mini), maxi)
+        gain = self._exposure / self.REFERENCE_EXPOSURE
+        if gain == 1:
+            self._exposure_lut = None
+        else:
+            self._exposure_lut = np.clip(np.arange(256) * gain, 0, 255).astype(np.uint8)
+
+    def get_exposure_range(self):
+        return 0.1, 1000 / self._frame_rate
+
+    def get_frame_rate(self):
+        return self._frame_rate
+
+    def set_frame_rate(self, fps):
+        mini, maxi = self.get_frame_rate_range()
+        self._frame_rate = min(max(fps, mini), maxi)
+
+    def get_frame_rate_range(self):
+        return 1, 1000
+
+
+def _polygon(center, radius, sides, rotation=0.0):
+    """
+    Return the vertices of a regular polygon (sides > 0) or of a star (sides < 0, with -sides branches)
+
+    :return: int32 array of shape (n, 1, 2), as expected by cv2.fillPoly
+    """
+    if sides > 0:
+        angles = rotation + 2 * np.pi * np.arange(sides) / sides
+        radii = np.full(sides, radius)
+    else:
+        angles = rotation + np.pi * np.arange(-2 * sides) / -sides
+        radii = np.where(np.arange(-2 * sides) % 2 == 0, radius, radius * 0.45)
+    points = np.stack([center[0] + radii * np.cos(angles), center[1] + radii * np.sin(angles)], axis=1)
+    return np.round(points).astype(np.int32).reshape(-1, 1, 2)
+
+
+def benchmark(backend, duration=2.0):
+    """
+    Read frames from a backend during duration seconds
+
+    :return: number of frames read per second
+    """
+    backend.start()
+    last_index = 0
+    nb_frames = 0
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < duration:
+        index = backend.wait_frame(last_index, timeout=1)
+        if index is None:
+            break
+        nb_frames += 1
+        last_index = index
+    backend.stop(wait=True)
+    return nb_frames / (time.perf_counter() - t0)
+
+
+if __name__ == '__main__':
+    for scene_name in SyntheticCamera.SCENES:
+        for is_color in (False, True):
+            synthetic = SyntheticCamera(1280, 1024, frame_rate=1000, scene=scene_name, color=is_color, noise=4)
+            print(f'{scene_name:8s} color={is_color!s:5s}: {benchmark(synthetic):7.1f} fps')
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Sub-pixel measurement of the dimensions of objects from their edges
+
+The minimum area rectangle of an object (cv2.minAreaRect of its thresholded contour) only gives its position to about
+a pixel, and depends on the threshold. Here, intensity profiles are sampled across the 4 sides of the rectangle, in
+the gray image, and the edge is located on each profile at the centroid of the gradient around its maximum. The edge
+of a side is the median over its profiles.
+The profiles of all the objects of a frame are sampled by a single cv2.remap call, on a grid computed once and scaled
+to each rectangle, and the edges are fitted with array operations.
+
+Laboratoire d Enseignement Experimental - Institut d Optique Graduate School
+"""
+
+import functools
+
+import cv2
+import numpy as np
+
+NB_PROFILES = 5  # Profiles across each side of a rectangle
+NB_SAMPLES = 25  # Samples of a profile
+PROFILE_HALF_LENGTH = 6.  # Length of a profile on each side of the rectangle, in pixels
+MIN_EDGE_CONTRAST = 10.  # Minimum gradient of an edge, in gray levels per pixel
+EDGE_WINDOW = 5  # Samples on each side of the maximum of the gradient for its centroid
+MAX_REMAP_ROWS = 32000  # cv2.remap maps must have less than 32767 rows
+
+
+@functools.lru_cache(maxsize=8)
+def get_sample_grid(nb_profiles, nb_samples):
+    """
+    :return: read-only arrays of the positions of the profiles along a side (fraction of its length, the corners are
+    avoided) and of the samples across it (fraction of the half length of the profiles)
+    """
+    along = np.linspace(-0.3, 0.3, nb_profiles)
+    across = np.linspace(-1., 1., nb_samples)
+    along.flags.writeable = False
+    across.flags.writeable = False
+    return along, across
+
+
+def find_edges(gray_img, rects, nb_profiles=NB_PROFILES, nb_samples=NB_SAMPLES, half_length=PROFILE_HALF_LENGTH):
+    """
+    Sub-pixel edges at the middle of the sides of the rectangles of the objects
+
+    :param gray_img: grayscale image of the objects
+    :param rects: list of rotated rectangles of the objects (cv2.minAreaRect)
+    :param nb_profiles: number of profiles across each side
+    :param nb_samples: number of samples of a profile
+    :param half_length: length of a profile on each side of the rectangle, in pixels (less for the small objects)
+    :return: array (number of objects, 4, 2) of the points of the edges, for the sides (p0, p1), (p1, p2), (p2, p3)
+    and (p3, p0) of cv2.boxPoints. NaN where no edge is found.
+    """
+    if not len(rects):
+        return np.zeros((0, 4, 2))
+    along, across = get_sample_grid(nb_profiles, nb_samples)
+
+    corners = np.array([cv2.boxPoints(rect) for rect in rects], np.float64)  # (objects, 4, 2)
+    centers = np.array([rect[0] for rect in rects], np.float64)
+    middles = (corners + np.roll(corners, -1, axis=1)) / 2
+    sides = np.roll(corners, -1, axis=1) - corners
+    lengths = np.linalg.norm(sides, axis=2)
+    tangents = sides / np.maximum(lengths, 1e-6)[..., None]
+    normals = middles - centers[:, None, :]  # Outwards
+    distances = np.linalg.norm(normals, axis=2)
+    normals /= np.maximum(distances, 1e-6)[..., None]
+    # The profiles do not reach the opposite side of the thin objects
+    half_lengths = np.minimum(half_length, 0.8 * distances)
+
+    # Samples (objects, sides, profiles, samples, xy)
+    points = (middles[:, :, None, None, :]
+              + (along[:, None, None] * lengths[:, :, None, None, None]) * tangents[:, :, None, None, :]
+              + (across[None, :, None] * half_lengths[:, :, None, None, None]) * normals[:, :, None, None, :])
+    sample_map = points.reshape(-1, nb_samples, 2).astype(np.float32)
+    profiles = np.empty(sample_map.shape[:2], np.float32)
+    for row in range(0, len(sample_map), MAX_REMAP_ROWS):
+        profiles[row:row + MAX_REMAP_ROWS] = cv2.remap(gray_img, sample_map[row:row + MAX_REMAP_ROWS], None,
+                                                       cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+    # Edge at the centroid of the gradient around its maximum (a parabola through the maximum would be biased, the
+    # gradient of linearly interpolated samples being constant between two pixels)
+    gradient = np.diff(profiles, axis=1)
+    peak = np.argmax(np.abs(gradient), axis=1)
+    rows = np.arange(len(gradient))
+    window = peak[:, None] + np.arange(-EDGE_WINDOW, EDGE_WINDOW + 1)
+    inside = (window[:, 0] >= 0) & (window[:, -1] < nb_samples - 1)
+    weights = gradient[rows[:, None], np.clip(window, 0, nb_samples - 2)] * np.sign(gradient[rows, peak])[:, None]
+    weights = np.maximum(weights, 0)  # Only the side of the edge of the maximum, the noise of the other is ignored
+    with np.errstate(all='ignore'):
+        position = (weights * window).sum(axis=1) / weights.sum(axis=1) + 0.5  # In samples
+
+    half_lengths_rows = half_lengths.repeat(nb_profiles, axis=1).ravel()
+    step = 2 * half_lengths_rows / (nb_samples - 1)  # Pixels between samples
+    valid = inside & (np.abs(gradient[rows, peak]) >= MIN_EDGE_CONTRAST * step)
+    offsets = (position * 2 / (nb_samples - 1) - 1) * half_lengths_rows
+    offsets = np.where(valid, offsets, np.nan).reshape(len(rects), 4, nb_profiles)
+    with np.errstate(all='ignore'):
+        counts = np.count_nonzero(~np.isnan(offsets), axis=2)
+        offsets = np.where(counts > 0, np.nanmedian(np.where(counts[..., None] > 0, offsets, 0), axis=2), np.nan)
+    return middles + offsets[..., None] * normals
+
+
+def measure_rects(gray_img, rects, calibration=None, undistorted=False):
+    """
+    Dimensions of the objects from the sub-pixel edges of their rectangles (see find_edges)
+
+    :param gray_img: grayscale image of the objects
+    :param rects: list of rotated rectangles of the objects (cv2.minAreaRect)
+    :param calibration: Calibration (see calibration.py), the dimensions are in pixels if None, in mm otherwise
+    :param undistorted: True if gray_img is undistorted (Calibration.remap), False if it is a raw frame
+    :return: array (number of objects, 2) of the distances between the sides (p0, p1) and (p2, p3), and between the
+    sides (p1, p2) and (p3, p0) of cv2.boxPoints. NaN if an edge is not found.
+    """
+    edges = find_edges(gray_img, rects)
+    if calibration is not None and len(edges):
+        edges = calibration.to_mm(edges.reshape(-1, 2), undistorted).reshape(edges.shape)
+    return np.stack([np.linalg.norm(edges[:, 0] - edges[:, 2], axis=1),
+                     np.linalg.norm(edges[:, 1] - edges[:, 3], axis=1)], axis=1)
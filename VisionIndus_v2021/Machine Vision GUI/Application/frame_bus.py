@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Shared-memory frame bus
+
+Publishes the frames of a camera into a ring of slots in a multiprocessing.shared_memory block, so analysis workers
+running in other processes (contours, histograms, reconstructions...) read them with no pickling and no copy, and
+the processing is not limited by the GIL of the GUI process. In the application, GetVideoThread publishes its frames
+into the buses added to it (see Utils.BusProcessingWorker, which runs the processing of a video tab with consume).
+
+Layout of the shared block:
+    - control: int64 values [magic, nb_slots, height, width, channels, itemsize, kind, head, seq of each slot]
+    - the slots, one frame each
+
+Frame n (from 1) goes into the slot (n - 1) % nb_slots. The sequence number of a slot is -n while frame n is being
+written and n once it is complete, head is the number of the last complete frame. A reader checks with is_valid()
+after its processing that the slot was not overwritten meanwhile (the ring is too small if it happens).
+
+Laboratoire d Enseignement Experimental - Institut d Optique Graduate School
+"""
+
+import queue
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+MAGIC = 0x4C454E5345425553  # 'LENSEBUS'
+_HEAD = 7  # Position of head in the control values, the slot sequence numbers follow
+
+
+def _control_size(nb_slots):
+    size = (_HEAD + 1 + nb_slots) * 8
+    return -(-size // 64) * 64  # Slots aligned on a cache line
+
+
+class FrameBus:
+    """Writer side of the bus, owns the shared memory block"""
+
+    def __init__(self, shape, dtype=np.uint8, nb_slots=8, name=None):
+        """
+        :param shape: shape of a frame, (height, width) or (height, width, channels)
+        :param dtype: type of the pixels
+        :param nb_slots: number of frames in the ring
+        :param name: name of the shared memory block (a random name if None), given to the readers
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.nb_slots = nb_slots
+        frame_size = int(np.prod(self.shape)) * self.dtype.itemsize
+        offset = _control_size(nb_slots)
+
+        self.shm = shared_memory.SharedMemory(name, create=True, size=offset + nb_slots * frame_size)
+        self.name = self.shm.name
+        self._control = np.ndarray((_HEAD + 1 + nb_slots,), np.int64, self.shm.buf)
+        self._slots = np.ndarray((nb_slots,) + self.shape, self.dtype, self.shm.buf, offset)
+
+        height, width = self.shape[:2]
+        channels = self.shape[2] if len(self.shape) == 3 else 1
+        self._control[:] = 0
+        self._control[:_HEAD] = [MAGIC, nb_slots, height, width, channels, self.dtype.itemsize,
+                                 ord(self.dtype.kind)]
+
+    @property
+    def head(self):
+        return int(self._control[_HEAD])
+
+    def publish(self, frame):
+        """
+        Copy a frame into the next slot of the ring
+
+        :return: number of the published frame
+        """
+        n = self.head + 1
+        slot = (n - 1) % self.nb_slots
+        self._control[_HEAD + 1 + slot] = -n
+        np.copyto(self._slots[slot], frame)
+        self._control[_HEAD + 1 + slot] = n
+        self._control[_HEAD] = n
+        return n
+
+    def close(self):
+        """Destroy the shared memory block (the publisher must not use the bus anymore)"""
+        del self._control, self._slots
+        self.shm.close()
+        self.shm.unlink()
+
+
+class FrameBusReader:
+    """Reader side of the bus, attaches to an existing bus by its name. Frames are read-only views."""
+
+    def __init__(self, name):
+        try:
+            # The block belongs to the writer, it must not be destroyed when the reader exits (Python >= 3.13)
+            self.shm = shared_memory.SharedMemory(name, track=False)
+        except TypeError:
+            # Older Python: the processes started by the writer share its resource tracker, which is fine
+            self.shm = shared_memory.SharedMemory(name)
+
+        header = np.ndarray((_HEAD,), np.int64, self.shm.buf)
+        magic, nb_slots, height, width, channels, itemsize, kind = (int(v) for v in header)
+        if magic != MAGIC:
+            raise ValueError(f'{name} is not a frame bus')
+        self.nb_slots = nb_slots
+        self.shape = (height, width, channels) if channels > 1 else (height, width)
+        self.dtype = np.dtype(f'{chr(kind)}{itemsize}')
+
+        self._control = np.ndarray((_HEAD + 1 + nb_slots,), np.int64, self.shm.buf)
+        self._control.flags.writeable = False
+        self._slots = np.ndarray((nb_slots,) + self.shape, self.dtype, self.shm.buf, _control_size(nb_slots))
+        self._slots.flags.writeable = False
+
+    @property
+    def head(self):
+        return int(self._control[_HEAD])
+
+    def wait_frame(self, last_seq=0, timeout=None, poll=0.0005):
+        """
+        Wait for a frame newer than last_seq
+
+        :param last_seq: number of the last frame read
+        :param timeout: maximum waiting time in seconds (None to wait forever)
+        :param poll: polling period in seconds
+        :return: (number of the newest frame, frame view), or (None, None) if the timeout expired
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            n = self.head
+            if n > last_seq:
+                return n, self._slots[(n - 1) % self.nb_slots]
+            if deadline is not None and time.perf_counter() > deadline:
+                return None, None
+            time.sleep(poll)
+
+    def is_valid(self, seq):
+        """Return True if the frame seq is still in its slot (not overwritten by a newer frame)"""
+        return int(self._control[_HEAD + 1 + (seq - 1) % self.nb_slots]) == seq
+
+    def close(self):
+        del self._control, self._slots
+        self.shm.close()
+
+
+def consume(name, function, results, stop_event, args_queue=None):
+    """
+    Loop of an analysis worker process: apply function to the newest frame of the bus and put (seq, result) into the
+    results queue. Frames published during the processing are skipped, results computed on an overwritten frame are
+    discarded.
+
+    :param name: name of the frame bus
+    :param function: function(frame, *args) returning a picklable result, the frame is read-only
+    :param results: multiprocessing.Queue receiving the results
+    :param stop_event: multiprocessing.Event ending the loop
+    :param args_queue: multiprocessing.Queue of the tuples of arguments of function, the last one received is used
+    (no frame is processed before the first one). No arguments if None.
+    :return: No return
+    """
+    reader = FrameBusReader(name)
+    seq = 0
+    args = () if args_queue is None else None
+    try:
+        while not stop_event.is_set():
+            if args_queue is not None:
+                try:
+                    while True:
+                        args = args_queue.get(timeout=0.1) if args is None else args_queue.get_nowait()
+                except queue.Empty:
+                    if args is None:
+                        continue
+            new_seq, frame = reader.wait_frame(seq, timeout=0.1)
+            if new_seq is None:
+                continue
+            seq = new_seq
+            try:
+                result = function(frame, *args)
+            except Exception as e:
+                print(f'{getattr(function, "__name__", function)} ERROR: {e}')
+                continue
+            if reader.is_valid(seq):
+                results.put((seq, result))
+    finally:
+        reader.close()
+
+
+def _count_objects(frame):
+    import cv2
+    _, binary = cv2.threshold(frame, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return cv2.connectedComponents(binary)[0] - 1
+
+
+def _histogram(frame):
+    return np.bincount(frame.ravel(), minlength=256)
+
+
+if __name__ == '__main__':
+    import multiprocessing as mp
+    import queue
+    from camera_backend import SyntheticCamera
+
+    camera = SyntheticCamera(1280, 1024, frame_rate=200, scene='objects')
+    camera.start()
+    bus = FrameBus((1024, 1280), np.uint8, nb_slots=8)
+
+    result_queue = mp.Queue()
+    stop = mp.Event()
+    workers = [mp.Process(target=consume, args=(bus.name, f, result_queue, stop)) for f in (_count_objects,
+                                                                                             _histogram)]
+    for worker in workers:
+        worker.start()
+    # Publishing loop, done by GetVideoThread in the application
+    last_index = camera.frame_index
+    end = time.perf_counter() + 3
+    while time.perf_counter() < end:
+        index = camera.wait_frame(last_index, timeout=0.5)
+        if index is not None:
+            last_index = index
+            bus.publish(camera.get_frame())
+    stop.set()
+
+    nb_results = 0
+    while any(worker.is_alive() for worker in workers) or not result_queue.empty():
+        try:
+            result_queue.get(timeout=0.2)
+            nb_results += 1
+        except queue.Empty:
+            pass
+    for worker in workers:
+        worker.join()
+    camera.stop(wait=True)
+    print(f'{bus.head} frames published, {nb_results} results from {len(workers)} workers')
+    bus.close()
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+High-speed frame recorder
+
+Records bursts of frames from a camera backend (see camera_backend.py) into a raw memory-mapped file:
+    - a fixed-size header (HEADER_SIZE bytes) describing the frames,
+    - a table with the camera index and the timestamp of each frame,
+    - the frames themselves, one after the other, starting at a page-aligned offset.
+
+The camera side only copies each frame into a free buffer of a preallocated ring, a writer thread moves the buffers
+to the file. When the ring is full, frames are dropped and counted instead of slowing down the acquisition.
+FrameReader gives a random access to the frames of a record without loading the file.
+
+Laboratoire d Enseignement Experimental - Institut d Optique Graduate School
+"""
+
+import queue
+import struct
+import threading
+import time
+
+import numpy as np
+
+MAGIC = b'LENSEREC'
+VERSION = 1
+HEADER_SIZE = 4096
+# magic, version, width, height, channels, dtype, max_frames, nb_frames, table_offset, data_offset, frame_size,
+# start time (time.time() at the start of the record)
+HEADER_FORMAT = '<8sIIII8sQQQQQd'
+TABLE_DTYPE = np.dtype([('index', '<u8'), ('timestamp', '<f8')])
+
+
+def _align(offset, alignment=HEADER_SIZE):
+    return -(-offset // alignment) * alignment
+
+
+class FrameRecorder:
+    """
+    Record frames into a memory-mapped raw file, through a ring of nb_buffers preallocated buffers.
+
+    Counters:
+        - nb_pushed: frames accepted in the ring
+        - nb_written: frames written in the file
+        - nb_dropped: frames dropped because the ring was full (the writer is too slow)
+        - nb_missed: frames lost by the camera before reaching the recorder (gaps in the camera indexes)
+        - nb_overflow: frames dropped because the file was full
+    """
+
+    def __init__(self, filename, shape, dtype=np.uint8, max_frames=1000, nb_buffers=64):
+        """
+        :param filename: path of the record file, overwritten if it exists
+        :param shape: shape of a frame, (height, width) or (height, width, channels)
+        :param dtype: type of the pixels
+        :param max_frames: maximum number of frames in the record (the file is preallocated)
+        :param nb_buffers: number of buffers of the ring between the camera and the writer thread
+        """
+        self.filename = filename
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.max_frames = max_frames
+
+        height, width = self.shape[:2]
+        channels = self.shape[2] if len(self.shape) == 3 else 1
+        frame_size = int(np.prod(self.shape)) * self.dtype.itemsize
+        table_offset = HEADER_SIZE
+        data_offset = _align(table_offset + max_frames * TABLE_DTYPE.itemsize)
+
+        self._mm = np.memmap(filename, np.uint8, 'w+', shape=(data_offset + max_frames * frame_size,))
+        self._header = (MAGIC, VERSION, width, height, channels, self.dtype.str.encode('ascii'), max_frames,
+                        table_offset, data_offset, frame_size)
+        self._table = self._mm[table_offset:table_offset + max_frames * TABLE_DTYPE.itemsize].view(TABLE_DTYPE)
+        self._frames = self._mm[data_offset:].view(self.dtype).reshape((max_frames,) + self.shape)
+        self._write_header(0, time.time())
+
+        self._buffers = np.empty((nb_buffers,) + self.shape, self.dtype)
+        self._free = queue.SimpleQueue()
+        for slot in range(nb_buffers):
+            self._free.put(slot)
+        self._filled = queue.SimpleQueue()
+
+        self._writer = None
+        self._feeder = None
+        self._recording = False
+        self._last_index = None
+
+        self.nb_pushed = 0
+        self.nb_written = 0
+        self.nb_dropped = 0
+        self.nb_missed = 0
+        self.nb_overflow = 0
+
+    def _write_header(self, nb_frames, start_time):
+        magic, version, width, height, channels, dtype, max_frames, table_offset, data_offset, frame_size = \
+            self._header
+        struct.pack_into(HEADER_FORMAT, self._mm, 0, magic, version, width, height, channels, dtype, max_frames,
+                         nb_frames, table_offset, data_offset, frame_size, start_time)
+        self._start_time = start_time
+
+    def start(self):
+        """Start the writer thread, frames can then be pushed"""
+        self._recording = True
+        self._writer = threading.Thread(target=self._write, name='FrameRecorder writer', daemon=True)
+        self._writer.start()
+
+    def record(self, camera, nb_frames=None):
+        """
+        Start recording the frames of a camera backend, in a thread of the recorder
+
+        :param camera: CameraBackend object, already started
+        :param nb_frames: number of frames to record (None to record until stop() or until the file is full)
+        :return: No return
+        """
+        if self._writer is None:
+            self.start()
+        self._feeder = threading.Thread(target=self._feed, args=(camera, nb_frames), name='FrameRecorder feeder',
+                                        daemon=True)
+        self._feeder.start()
+
+    def _feed(self, camera, nb_frames):
+        last_index = camera.frame_index
+        while self._recording and (nb_frames is None or self.nb_pushed + self.nb_dropped < nb_frames):
+            if camera.wait_frame(last_index, timeout=0.5) is None:
+                if not camera.is_running():
+                    break
+                continue
+            frame, last_index, timestamp = camera.get_frame_info()
+            self.push(frame, last_index, timestamp)
+        self._recording = False
+        self._filled.put(None)
+
+    def push(self, frame, index=None, timestamp=None):
+        """
+        Copy a frame into a free buffer of the ring, for the writer thread. Never blocks.
+
+        :param frame: array of the recorder shape
+        :param index: index of the frame given by the camera (the number of pushed frames if None)
+        :param timestamp: time.perf_counter() of the acquisition of the frame (now if None)
+        :return: True if the frame is recorded, False if it is dropped
+        """
+        if not self._recording:
+            return False
+        if index is None:
+            index = self.nb_pushed + self.nb_dropped + 1
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        if self._last_index is not None and index > self._last_index + 1:
+            self.nb_missed += index - self._last_index - 1
+        self._last_index = index
+
+        if self.nb_pushed >= self.max_frames:
+            self.nb_overflow += 1
+            self._recording = False
+            self._filled.put(None)
+            return False
+        try:
+            slot = self._free.get_nowait()
+        except queue.Empty:
+            self.nb_dropped += 1
+            return False
+        np.copyto(self._buffers[slot], frame)
+        self.nb_pushed += 1
+        self._filled.put((slot, index, timestamp))
+        return True
+
+    def _write(self):
+        while True:
+            item = self._filled.get()
+            if item is not None:
+                self._write_frame(*item)
+            elif not self._recording:
+                break
+        # The frames pushed just before the stop request can still be in the queue
+        while True:
+            try:
+                item = self._filled.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                self._write_frame(*item)
+        self._mm.flush()
+
+    def _write_frame(self, slot, index, timestamp):
+        n = self.nb_written
+        self._frames[n] = self._buffers[slot]
+        self._table[n] = (index, timestamp)
+        self._free.put(slot)
+        self.nb_written = n + 1
+        self._write_header(self.nb_written, self._start_time)
+
+    def stop(self, wait=True):
+        """Stop the record. If wait, block until all the pushed frames are written in the file."""
+        self._recording = False
+        if wait and self._feeder is not None and self._feeder is not threading.current_thread():
+            self._feeder.join()
+        self._filled.put(None)
+        if wait and self._writer is not None and self._writer is not threading.current_thread():
+            self._writer.join()
+
+    def is_recording(self):
+        return self._recording or (self._writer is not None and self._writer.is_alive())
+
+    def close(self):
+        self.stop(wait=True)
+        self._mm.flush()
+        del self._frames, self._table, self._mm
+
+
+class FrameReader:
+    """Random access to the frames of a record, the file is memory-mapped and not loaded"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._mm = np.memmap(filename, np.uint8, 'r')
+        magic, version, width, height, channels, dtype, max_frames, nb_frames, table_offset, data_offset, \
+            frame_size, self.start_time = struct.unpack_from(HEADER_FORMAT, self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{filename} is not a frame record')
+
+        self.version = version
+        self.dtype = np.dtype(dtype.rstrip(b'\0').decode('ascii'))
+        self.shape = (height, width, channels) if channels > 1 else (height, width)
+        self.max_frames = max_frames
+        self.nb_frames = nb_frames
+        table = self._mm[table_offset:table_offset + max_frames * TABLE_DTYPE.itemsize].view(TABLE_DTYPE)
+        self.table = table[:nb_frames]
+        self._frames = self._mm[data_offset:data_offset + max_frames * frame_size].view(self.dtype)
+        self._frames = self._frames.reshape((max_frames,) + self.shape)[:nb_frames]
+
+    def __len__(self):
+        return self.nb_frames
+
+    def __getitem__(self, item):
+        """Return a frame (or a slice of frames) as a read-only view of the file"""
+        return self._frames[item]
+
+    @property
+    def indexes(self):
+        """Index of each frame given by the camera"""
+        return self.table['index']
+
+    @property
+    def timestamps(self):
+        """Time of each frame in seconds, from the first frame of the record"""
+        timestamps = self.table['timestamp']
+        return timestamps - timestamps[0] if len(timestamps) else timestamps
+
+    def get_missed_frames(self):
+        """Return the number of frames lost by the camera during the record (gaps in the indexes)"""
+        if self.nb_frames < 2:
+            return 0
+        return int(self.indexes[-1] - self.indexes[0] + 1 - self.nb_frames)
+
+    def close(self):
+        del self._frames, self.table, self._mm
+
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+    from camera_backend import SyntheticCamera
+
+    camera = SyntheticCamera(1280, 1024, frame_rate=500, scene='beam')
+    camera.start()
+    path = os.path.join(tempfile.gettempdir(), 'record_test.raw')
+    recorder = FrameRecorder(path, (1024, 1280), max_frames=1000)
+    t0 = time.perf_counter()
+    recorder.record(camera, nb_frames=1000)
+    while recorder.is_recording():
+        time.sleep(0.05)
+    duration = time.perf_counter() - t0
+    camera.stop(wait=True)
+    print(f'{recorder.nb_written} frames written in {duration:.2f} s, dropped: {recorder.nb_dropped}, '
+          f'missed: {recorder.nb_missed}, overflow: {recorder.nb_overflow}')
+    recorder.close()
+
+    reader = FrameReader(path)
+    print(f'{len(reader)} frames of {reader.shape} {reader.dtype}, last timestamp {reader.timestamps[-1]:.3f} s, '
+          f'missed frames {reader.get_missed_frames()}')
+    reader.close()
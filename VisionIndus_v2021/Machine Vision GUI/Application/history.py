@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+History of the intermediate images of a processing chain
+
+The picture processing tab keeps the image after each step of its chain, so that all of them can be looked at. The
+history holds them within a memory budget:
+    - the most recently used images are kept as they are,
+    - the older ones are compressed without loss (PNG, or zlib for the types PNG does not handle) by a background
+      thread,
+    - if the budget is still exceeded once compressed, the least recently used images are dropped. An image dropped
+      is computed again when it is needed, by applying the steps of the chain to the nearest image kept before it.
+The first image (the input of the chain) is always kept as it is. The budget can be exceeded while the compressions
+are pending, and by the most recent images.
+
+Laboratoire d Enseignement Experimental - Institut d Optique Graduate School
+"""
+
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+
+def compress_img(img):
+    """
+    :return: lossless compressed image (shape, dtype, True if PNG, buffer), see decompress_img
+    """
+    if img.dtype in (np.uint8, np.uint16) and (img.ndim == 2 or img.shape[2] in (1, 3, 4)):
+        ok, buffer = cv2.imencode('.png', img, [cv2.IMWRITE_PNG_COMPRESSION, 1])  # Fast, still ~10x for binaries
+        if ok:
+            return img.shape, img.dtype, True, buffer
+    return img.shape, img.dtype, False, np.frombuffer(zlib.compress(np.ascontiguousarray(img), 1), np.uint8)
+
+
+def decompress_img(data):
+    shape, dtype, is_png, buffer = data
+    if is_png:
+        return cv2.imdecode(buffer, cv2.IMREAD_UNCHANGED).reshape(shape)
+    return np.frombuffer(zlib.decompress(buffer), dtype).reshape(shape)
+
+
+class _Entry:
+    __slots__ = ('step', 'img', 'data', 'last_use')
+
+    def __init__(self, img, step):
+        self.step = step  # Function computing the image from the previous one, None for the input image
+        self.img = img  # Image as it is, None if compressed or dropped
+        self.data = None  # Compressed image (see compress_img), None if not compressed
+        self.last_use = 0
+
+    @property
+    def nbytes(self):
+        return (0 if self.img is None else self.img.nbytes) + (0 if self.data is None else self.data[3].nbytes)
+
+
+class ImageHistory:
+    """
+    Images of a processing chain, image i + 1 being step(image i). The images must not be modified once added, the
+    steps must give the same result when they are applied again.
+    """
+
+    def __init__(self, budget=256 * 2 ** 20, nb_recent=2):
+        """
+        :param budget: memory budget of the images, in bytes
+        :param nb_recent: number of the most recently used images kept as they are
+        """
+        self.budget = budget
+        self.nb_recent = nb_recent
+        self.nb_compressed = 0
+        self.nb_dropped = 0
+        self.nb_recomputed = 0
+
+        self._entries = []
+        self._uncompressed = []  # Indexes of the images kept as they are (but the input), the most recently used last
+        self._pending = set()  # Indexes of the images being compressed
+        self._use_count = 0
+        self._generation = 0  # Incremented by reset, the compressions of the previous chain are ignored
+        self._lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(1)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def memory(self):
+        """Memory used by the images, in bytes"""
+        with self._lock:
+            return sum(entry.nbytes for entry in self._entries)
+
+    def set_budget(self, budget):
+        with self._lock:
+            self.budget = budget
+            self._enforce_budget()
+
+    def reset(self, img):
+        """Start a new chain from the input image img"""
+        with self._lock:
+            self._generation += 1
+            self._entries = [_Entry(img, None)]
+            self._uncompressed = []
+            self._pending = set()
+
+    def append(self, img, step):
+        """
+        :param img: image after step
+        :param step: function computing img from the last image of the history
+        :return: index of img
+        """
+        with self._lock:
+            self._entries.append(_Entry(img, step))
+            index = len(self._entries) - 1
+            self._uncompressed.append(index)
+            self._use(index)
+            return index
+
+    def get(self, index):
+        """
+        :param index: index of the image, negative from the end
+        :return: image, decompressed or computed again if needed (not to be modified)
+        """
+        with self._lock:
+            index = range(len(self._entries))[index]
+            entry = self._entries[index]
+            if entry.img is None:
+                entry.img = self._load(index)
+                self._uncompressed.append(index)
+            if index:
+                self._use(index)
+            return entry.img
+
+    def _load(self, index):
+        """Image of a compressed or dropped entry"""
+        entry = self._entries[index]
+        if entry.img is not None:
+            return entry.img
+        if entry.data is not None:
+            return decompress_img(entry.data)
+        # Computed again from the nearest image kept before it
+        start = index - 1
+        while self._entries[start].img is None and self._entries[start].data is None:
+            start -= 1
+        img = self._load(start)
+        for entry in self._entries[start + 1:index + 1]:
+            img = entry.step(img)
+        self.nb_recomputed += 1
+        return img
+
+    def _use(self, index):
+        self._use_count += 1
+        self._entries[index].last_use = self._use_count
+        self._uncompressed.remove(index)
+        self._uncompressed.append(index)
+        self._enforce_budget()
+
+    def _enforce_budget(self):
+        # The images no longer recent are compressed, or just released if they were compressed before
+        for index in self._uncompressed[:-self.nb_recent or None]:
+            entry = self._entries[index]
+            if entry.data is not None:
+                entry.img = None
+                self._uncompressed.remove(index)
+            elif index not in self._pending:
+                self._pending.add(index)
+                self._executor.submit(self._compress, self._generation, index, entry.img)
+
+        # The least recently used images are dropped once the compressions are done
+        if self._pending or self.memory <= self.budget:
+            return
+        recent = set(self._uncompressed[-self.nb_recent:])
+        candidates = [index for index in range(1, len(self._entries)) if index not in recent and
+                      (self._entries[index].img is not None or self._entries[index].data is not None)]
+        memory = self.memory
+        for index in sorted(candidates, key=lambda i: self._entries[i].last_use):
+            entry = self._entries[index]
+            memory -= entry.nbytes
+            entry.img = entry.data = None
+            if index in self._uncompressed:
+                self._uncompressed.remove(index)
+            self.nb_dropped += 1
+            if memory <= self.budget:
+                break
+
+    def _compress(self, generation, index, img):
+        """Called in the background thread"""
+        data = compress_img(img)
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._pending.discard(index)
+            entry = self._entries[index]
+            if entry.img is img:  # Not dropped meanwhile
+                entry.data = data
+                self.nb_compressed += 1
+                if index not in self._uncompressed[-self.nb_recent:]:
+                    entry.img = None
+                    self._uncompressed.remove(index)
+            self._enforce_budget()
@@ -7,6 +7,7 @@
 #
 # This application allows you to (non-exhaustive list):
 #   - Connect to a uEye camera (through USB)
+#   - Run without any camera, with a synthetic camera generating test scenes
 #   - Set the main parameters of the camera (frame rate, exposure time, colormode, AOI)
 #   - Show the video from the camera
 #   - Take screen shoot from the camera and save it into a file or into the clipboard
@@ -37,8 +38,12 @@ import numpy as np
 import cv2
 import resources
 import ctypes
-from pyueye import ueye
-from camera import uEyeCamera, get_cam_list
+try:
+    from camera import uEyeCamera, get_cam_list
+except ImportError:  # No IDS driver on this computer, only the synthetic camera is available
+    uEyeCamera = None
+    get_cam_list = list
+from camera_backend import UEyeBackend, SyntheticCamera
 from AcquisitionTab import AcquisitionTab
 from SimpleProcessingInPicutureTab import SimpleProcessingInPictureTab
 from SimpleProcessingInVideoTab import SimpleProcessingInVideoTab
@@ -52,6 +57,8 @@ import serial
 
 from Dictionary_EN import *
 
+SYNTHETIC_CAM_ID = -1
+
 
 class MainApp(Qtw.QApplication):
     """The main application object"""
@@ -101,6 +108,7 @@ class ChooseCameraWindow(Qtw.QWidget):
         for c in self.cam_list:
             item = STR_ID + str(c[0]) + STR_SER_NO + c[1] + STR_MODEL + c[2]
             self.camera_combo_box.addItem(item)
+        self.camera_combo_box.addItem(STR_SYNTHETIC_CAMERA)
 
         # QPushButton for validating the choice of camera
         select_button = Qtw.QPushButton(STR_SELECT)
@@ -118,7 +126,9 @@ class ChooseCameraWindow(Qtw.QWidget):
     @Qtc.pyqtSlot()
     def select_camera(self):
         index = self.camera_combo_box.currentIndex()-1
-        if index >= 0:
+        if index == len(self.cam_list):
+            self.camera_is_selected.emit(SYNTHETIC_CAM_ID)
+        elif index >= 0:
             self.camera_is_selected.emit(self.cam_list[index][0])
 
 
@@ -127,8 +137,10 @@ class MainWindow(Qtw.QMainWindow):
 
     def __init__(self, cam_id):
         super().__init__()
-        self.cam = uEyeCamera(cam_id)
-        self.cam.set_display_mode(ueye.IS_SET_DM_DIB)
+        if cam_id == SYNTHETIC_CAM_ID:
+            self.cam = SyntheticCamera()
+        else:
+            self.cam = UEyeBackend(uEyeCamera(cam_id))
         self.video_thread = GetVideoThread(self.cam)
 
         self.ser = serial.Serial()
@@ -230,6 +242,8 @@ class MainTabWindow(Qtw.QTabWidget):
     def delete_tab(self, index):
         tab = self.widget(index)
         self.removeTab(index)
+        if hasattr(tab, 'worker'):  # Video tabs: stop the processing threads or process
+            tab.worker.shutdown()
         tab.deleteLater()
 
 
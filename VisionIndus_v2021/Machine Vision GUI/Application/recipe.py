@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Processing recipes
+
+A recipe is the ordered list of the PreProcessingFunction calls of a processing chain, with their parameters. It is
+saved as JSON:
+    {"version": 1, "steps": [{"function": "func_gaus_blurring", "params": {"kernel_size": 5, "sigma": 0}},
+                             {"function": "func_otsu_thresholding", "params": {}}]}
+The processing tabs save and load their process tree as a recipe (tree_to_recipe, recipe_to_tree), batch.py applies
+a recipe to a folder of images or to a video without the GUI.
+
+Laboratoire d Enseignement Experimental - Institut d Optique Graduate School
+"""
+
+import json
+from functools import partial
+
+import PreProcessingFunction
+from Dictionary_EN import *
+
+RECIPE_VERSION = 1
+
+# Parameters of each function, in the order of the parameter widgets of its item in the process trees
+RECIPE_PARAMETERS = {
+    'func_erosion': ('kernel_size',),
+    'func_dilatation': ('kernel_size',),
+    'func_opening': ('kernel_size',),
+    'func_closing': ('kernel_size',),
+    'func_gaus_blurring': ('kernel_size', 'sigma'),
+    'func_median_blur': ('kernel_size',),
+    'func_bilateral_filter': ('size', 'sigma'),
+    'func_equalization': (),
+    'func_simple_thresholding': ('threshold',),
+    'func_adaptive_thresholding': ('method', 'block_size', 'c'),
+    'func_otsu_thresholding': (),
+    'func_ft': (),
+    'func_find_draw_contours': ('surface_min',),
+}
+
+# Item of the process trees of each function: (process name shown in the tree, method of ProcessTreeWidget adding it)
+RECIPE_TREE_ITEMS = {
+    'func_erosion': (STR_EROSION, 'erosion_item'),
+    'func_dilatation': (STR_DILATATION, 'dilatation_item'),
+    'func_opening': (STR_OPENING, 'opening_item'),
+    'func_closing': (STR_CLOSING, 'closing_item'),
+    'func_gaus_blurring': (STR_GAUSSIAN_BLURRING, 'gaus_blurring_item'),
+    'func_median_blur': (STR_MEDIAN_BLUR, 'median_blurring_item'),
+    'func_bilateral_filter': (STR_BILATERAL_FILTER, 'bilateral_filtering_item'),
+    'func_equalization': (STR_EQUALIZATION, 'equalization_item'),
+    'func_simple_thresholding': (STR_SIMPLE_THRESHOLD, 'simple_thresholding_item'),
+    'func_adaptive_thresholding': (STR_ADAPTIVE_THRESHOLD, 'adaptive_thresholding_item'),
+    'func_otsu_thresholding': (STR_OTSUS_THRESHOLD, 'otsu_thresholding_item'),
+    'func_ft': (STR_FT, 'ft_item'),
+    'func_find_draw_contours': (STR_OUTLINE_DETECTION, 'outline_detection_item'),
+}
+
+
+def check_recipe(steps):
+    """
+    Raise ValueError if a step of the recipe is not a known function with its parameters
+
+    :param steps: list of {'function': name, 'params': {name: value}}
+    :return: No return
+    """
+    for i, step in enumerate(steps):
+        name = step.get('function')
+        if name not in RECIPE_PARAMETERS:
+            raise ValueError(f'Step {i + 1}: unknown function {name}')
+        params = step.get('params', {})
+        if set(params) != set(RECIPE_PARAMETERS[name]):
+            raise ValueError(f'Step {i + 1}: {name} takes the parameters {", ".join(RECIPE_PARAMETERS[name])}')
+
+
+def save_recipe(filename, steps):
+    check_recipe(steps)
+    with open(filename, 'w') as file:
+        json.dump({'version': RECIPE_VERSION, 'steps': steps}, file, indent=2)
+
+
+def load_recipe(filename):
+    """
+    :return: list of the steps of the recipe saved in filename
+    """
+    with open(filename) as file:
+        recipe = json.load(file)
+    if recipe.get('version', 0) > RECIPE_VERSION:
+        raise ValueError(f'{filename}: recipe version {recipe["version"]} is not supported')
+    steps = recipe.get('steps', [])
+    check_recipe(steps)
+    return steps
+
+
+def compile_recipe(steps):
+    """
+    :return: list of the functions of the steps with their parameters bound, each one called as step(img, dst=None)
+    """
+    return [partial(getattr(PreProcessingFunction, step['function']), **step.get('params', {})) for step in steps]
+
+
+def apply_recipe(img, pipeline):
+    """
+    :param pipeline: compiled recipe (see compile_recipe)
+    :return: image after all the steps
+    """
+    for step in pipeline:
+        img = step(img)
+    return img
+
+
+def tree_to_recipe(process_tree):
+    """
+    :param process_tree: ProcessTreeWidget of a processing tab
+    :return: list of the steps of the process tree
+    """
+    functions = {process: name for name, (process, _) in RECIPE_TREE_ITEMS.items()}
+    steps = []
+    for i in range(process_tree.topLevelItemCount()):
+        item = process_tree.topLevelItem(i)
+        name = functions[item.text(0)]
+        values = []
+        for j in range(item.childCount()):
+            widget = process_tree.itemWidget(item.child(j), 0)
+            values.append(widget.currentIndex() if hasattr(widget, 'currentIndex') else widget.value())
+        steps.append({'function': name, 'params': dict(zip(RECIPE_PARAMETERS[name], values))})
+    return steps
+
+
+def recipe_to_tree(steps, process_tree):
+    """Replace the items of process_tree by the steps of a recipe"""
+    check_recipe(steps)
+    process_tree.clear()
+    for step in steps:
+        name = step['function']
+        add_item = getattr(process_tree, RECIPE_TREE_ITEMS[name][1])
+        add_item(-1, *(step['params'][param] for param in RECIPE_PARAMETERS[name]))
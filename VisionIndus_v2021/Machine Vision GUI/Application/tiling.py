@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+Tiled processing of large images
+
+The processes of PreProcessingFunction are applied tile by tile, in parallel, into a preallocated output:
+    - local operators (morphology, blurs, thresholds): each tile is read with a halo, a margin as large as the
+      radius of the operator, so the tiles give exactly the result of the whole image,
+    - Otsu's threshold and equalization: the histogram of the image is accumulated over the tiles, then the
+      threshold or the equalization table is applied to each tile,
+    - the other processes (Fourier transform, contours) are applied to the whole image.
+The outputs larger than MEMMAP_MIN_BYTES are memory-mapped temporary files. map_image opens the formats whose pixels
+can be memory-mapped (npy, binary PGM/PPM, uncompressed BMP, first frame of a record), so the source is read tile by
+tile instead of being loaded.
+
+Laboratoire d Enseignement Experimental - Institut d Optique Graduate School
+"""
+
+import functools
+import os
+import re
+import struct
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+TILE_SIZE = 1024
+TILED_MIN_PIXELS = 4096 * 4096  # Smaller images are processed in one piece
+MEMMAP_MIN_BYTES = 512 * 2 ** 20
+
+
+def _gaussian_radius(kernel_size, sigma):
+    if kernel_size > 0:
+        return kernel_size // 2
+    return int(round(sigma * 4 * 2 + 1)) // 2  # Size computed by cv2.GaussianBlur from sigma (4 sigma for floats)
+
+
+# Halo of the local operators, from the parameters of the function
+LOCAL_HALOS = {
+    'func_erosion': lambda kernel_size: kernel_size // 2,
+    'func_dilatation': lambda kernel_size: kernel_size // 2,
+    'func_opening': lambda kernel_size=3: 2 * (kernel_size // 2),  # Erosion then dilatation
+    'func_closing': lambda kernel_size=3: 2 * (kernel_size // 2),
+    'func_gaus_blurring': _gaussian_radius,
+    'func_median_blur': lambda kernel_size: kernel_size // 2,
+    'func_bilateral_filter': lambda size, sigma: size // 2 if size > 0 else int(round(sigma * 1.5)),
+    'func_simple_thresholding': lambda threshold: 0,
+    'func_adaptive_thresholding': lambda method, block_size, c: block_size // 2,
+}
+
+
+def otsu_lut(hist):
+    """
+    Table of Otsu's thresholding of an 8-bit image, same threshold as cv2.threshold with THRESH_OTSU
+
+    :param hist: histogram of the image (256 counts)
+    :return: uint8 table (256)
+    """
+    p = hist / max(hist.sum(), 1)
+    i = np.arange(256)
+    q1 = np.cumsum(p)
+    q2 = 1 - q1
+    mu = (i * p).sum()
+    cum_mu = np.cumsum(i * p)
+    eps = np.finfo(np.float32).eps
+    valid = (np.minimum(q1, q2) >= eps) & (np.maximum(q1, q2) <= 1 - eps)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mu1 = cum_mu / q1
+        mu2 = (mu - q1 * mu1) / q2
+        sigma = np.where(valid, q1 * q2 * (mu1 - mu2) ** 2, -1)
+    threshold = int(np.argmax(sigma)) if valid.any() else 0
+    return np.where(i > threshold, 255, 0).astype(np.uint8)
+
+
+def equalization_lut(hist):
+    """
+    Table of the equalization of an 8-bit image, same result as cv2.equalizeHist
+
+    :param hist: histogram of the image (256 counts)
+    :return: uint8 table (256)
+    """
+    hist = hist.astype(np.int64)
+    first = int(np.flatnonzero(hist)[0])
+    total = hist.sum()
+    if total == hist[first]:  # Uniform image
+        return np.full(256, first, np.uint8)
+    scale = np.float32(255. / (total - hist[first]))
+    # Rounded in float32, as cv2.equalizeHist (the values below first are not in the image)
+    lut = np.rint((np.cumsum(hist) - hist[first]).astype(np.float32) * scale)
+    lut[:first + 1] = 0
+    return np.clip(lut, 0, 255).astype(np.uint8)
+
+
+# Processes applied as a table computed from the histogram of the whole image
+HISTOGRAM_LUTS = {
+    'func_otsu_thresholding': otsu_lut,
+    'func_equalization': equalization_lut,
+}
+
+
+@functools.lru_cache(maxsize=1)
+def get_tile_executor():
+    """Thread pool of the tiles (OpenCV releases the GIL)"""
+    return ThreadPoolExecutor(os.cpu_count())
+
+
+def iter_tiles(height, width, tile_size=TILE_SIZE):
+    """Yield the (y0, y1, x0, x1) bounds of the tiles covering an image"""
+    for y0 in range(0, height, tile_size):
+        for x0 in range(0, width, tile_size):
+            yield y0, min(y0 + tile_size, height), x0, min(x0 + tile_size, width)
+
+
+def allocate_output(shape, dtype):
+    """Output image, in a memory-mapped temporary file if larger than MEMMAP_MIN_BYTES"""
+    if np.prod(shape) * np.dtype(dtype).itemsize < MEMMAP_MIN_BYTES:
+        return np.empty(shape, dtype)
+    with tempfile.TemporaryFile() as file:  # Deleted once the mapping is released
+        return np.memmap(file, dtype, 'w+', shape=shape)
+
+
+def process_tiled(function, img, halo, dst=None, tile_size=TILE_SIZE):
+    """
+    Apply a local operator to an image tile by tile
+
+    :param function: function(tile) returning the processed tile, same height and width
+    :param img: input image (array or memory-mapped array)
+    :param halo: radius of the operator, in pixels
+    :param dst: output image, allocated if None (by allocate_output)
+    :param tile_size: size of the tiles, without the halo
+    :return: output image
+    """
+    height, width = img.shape[:2]
+
+    def run(bounds):
+        y0, y1, x0, x1 = bounds
+        top, left = max(y0 - halo, 0), max(x0 - halo, 0)
+        tile = function(img[top:min(y1 + halo, height), left:min(x1 + halo, width)])
+        return bounds, tile[y0 - top:y1 - top, x0 - left:x1 - left]
+
+    tiles = iter_tiles(height, width, tile_size)
+    bounds, core = run(next(tiles))  # The first tile gives the format of the output
+    if dst is None:
+        dst = allocate_output((height, width) + core.shape[2:], core.dtype)
+    dst[bounds[0]:bounds[1], bounds[2]:bounds[3]] = core
+
+    def run_into_dst(bounds):
+        (y0, y1, x0, x1), core = run(bounds)
+        dst[y0:y1, x0:x1] = core
+
+    list(get_tile_executor().map(run_into_dst, tiles))
+    return dst
+
+
+def histogram_tiled(img, tile_size=TILE_SIZE):
+    """Histogram (256 counts) of an 8-bit single channel image, accumulated over its tiles"""
+    def hist(bounds):
+        y0, y1, x0, x1 = bounds
+        return cv2.calcHist([np.ascontiguousarray(img[y0:y1, x0:x1])], [0], None, [256], [0, 256]).ravel()
+
+    return np.sum(list(get_tile_executor().map(hist, iter_tiles(*img.shape[:2], tile_size))), axis=0)
+
+
+class TiledStep:
+    """
+    Process of a chain (function of the image, with its parameters bound by functools.partial) applied tile by tile
+    to the images of more than TILED_MIN_PIXELS pixels, and in one piece to the smaller ones
+    """
+
+    def __init__(self, step, tile_size=TILE_SIZE):
+        self.step = step
+        self.tile_size = tile_size
+        function = step.func if isinstance(step, functools.partial) else step
+        self.name = getattr(function, '__name__', '')
+        self.keywords = step.keywords if isinstance(step, functools.partial) else {}
+
+    def __call__(self, img):
+        if img.shape[0] * img.shape[1] < TILED_MIN_PIXELS:
+            return self.step(img)
+
+        if self.name in LOCAL_HALOS:
+            halo = LOCAL_HALOS[self.name](**self.keywords)
+            return process_tiled(self.step, img, halo, tile_size=self.tile_size)
+
+        if self.name in HISTOGRAM_LUTS and img.dtype == np.uint8 and len(img.shape) == 2:
+            lut = HISTOGRAM_LUTS[self.name](histogram_tiled(img, self.tile_size))
+            return process_tiled(lambda tile: cv2.LUT(tile, lut), img, 0, tile_size=self.tile_size)
+
+        return self.step(np.asarray(img))
+
+
+def map_image(filename):
+    """
+    Open an image without loading it, if its format allows it
+
+    :param filename: .npy, binary .pgm/.ppm (8 bits), uncompressed .bmp (8 bits gray or 24 bits) or .raw record
+    (see frame_recorder.py, its first frame)
+    :return: read-only memory-mapped image (BGR if in color), None if the format cannot be memory-mapped
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    try:
+        if extension == '.npy':
+            img = np.load(filename, mmap_mode='r')
+            return img if img.ndim in (2, 3) else None
+        if extension in ('.pgm', '.ppm'):
+            return _map_pnm(filename)
+        if extension == '.bmp':
+            return _map_bmp(filename)
+        if extension == '.raw':
+            from frame_recorder import FrameReader
+            reader = FrameReader(filename)
+            return reader[0] if len(reader) else None
+    except (OSError, ValueError, struct.error):
+        return None
+    return None
+
+
+def _map_pnm(filename):
+    with open(filename, 'rb') as file:
+        header = file.read(1024)
+    # Magic number, width, height and maximum value, then a single whitespace (comments are not handled)
+    match = re.match(rb'(P[56])\s+(\d+)\s+(\d+)\s+(\d+)\s', header)
+    if match is None or int(match.group(4)) > 255:
+        return None
+    width, height, offset = int(match.group(2)), int(match.group(3)), match.end()
+    if match.group(1) == b'P5':
+        return np.memmap(filename, np.uint8, 'r', offset, (height, width))
+    return np.memmap(filename, np.uint8, 'r', offset, (height, width, 3))[:, :, ::-1]  # RGB to BGR
+
+
+def _map_bmp(filename):
+    with open(filename, 'rb') as file:
+        header = file.read(54 + 1024)
+    if header[:2] != b'BM':
+        return None
+    offset, = struct.unpack_from('<I', header, 10)
+    dib_size, width, height, _, bits, compression = struct.unpack_from('<IiiHHI', header, 14)
+    if compression != 0 or bits not in (8, 24):
+        return None
+    if bits == 8:
+        palette = np.frombuffer(header, np.uint8, 1024, 14 + dib_size).reshape(256, 4)[:, :3]
+        if not np.array_equal(palette, np.repeat(np.arange(256, dtype=np.uint8)[:, None], 3, axis=1)):
+            return None  # Not a gray image
+    channels = bits // 8
+    stride = (width * channels + 3) & ~3  # Rows padded to 4 bytes
+    rows = np.memmap(filename, np.uint8, 'r', offset, (abs(height), stride))[:, :width * channels]
+    img = rows.reshape(abs(height), width, channels) if channels > 1 else rows
+    return img[::-1] if height > 0 else img  # Rows from the bottom if the height is positive
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-object tracker
+
+Links the objects detected in successive frames (centers and bounding boxes) to persistent tracks:
+    - the cost of associating a track and a detection combines the distance between their centers and the overlap
+      (IoU) of their boxes, computed for all the pairs at once,
+    - the assignment minimizes the total cost (Hungarian algorithm if scipy is installed, greedy otherwise).
+Each track keeps the results computed on its object (shape, colour, dimensions...), so they are only computed again
+when the object changes significantly. The tracks crossing a counting line are counted, for the throughput of a
+conveyor belt.
+
+Laboratoire d Enseignement Experimental - Institut d Optique Graduate School
+"""
+
+import threading
+
+import numpy as np
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+
+class Track:
+    """An object followed from frame to frame"""
+
+    def __init__(self, track_id, center, box):
+        self.id = track_id
+        self.center = np.asarray(center, float)
+        self.box = np.asarray(box, float)  # x, y, width, height
+        self.age = 1  # Number of frames where the object is detected
+        self.missed = 0  # Number of frames since the object was last detected
+        self.side = 0  # Side of the counting line (-1, 0 or 1)
+        self.crossings = 0  # Number of crossings of the counting line, signed by their direction
+        self._results = {}  # key: (area of the box when computed, result)
+
+    @property
+    def area(self):
+        return self.box[2] * self.box[3]
+
+    def needs_update(self, key, threshold=0.1):
+        """
+        Return True if the result key was never computed or if the object has changed since: the area of its box
+        changed by more than threshold (relative)
+        """
+        if key not in self._results:
+            return True
+        area = self._results[key][0]
+        return abs(self.area - area) > threshold * max(area, 1)
+
+    def get_result(self, key, default=None):
+        return self._results[key][1] if key in self._results else default
+
+    def set_result(self, key, result):
+        self._results[key] = (self.area, result)
+
+
+class ObjectTracker:
+    """
+    Give persistent IDs to the objects detected in successive frames. A tracker must be updated with the frames in
+    their order, update() is thread-safe.
+    """
+
+    def __init__(self, max_distance=100, max_missed=5, iou_weight=1., use_hungarian=True):
+        """
+        :param max_distance: maximum displacement of an object between two frames, in pixels
+        :param max_missed: number of frames a track is kept without detection (object hidden or not detected)
+        :param iou_weight: weight of 1 - IoU in the cost, added to distance / max_distance
+        :param use_hungarian: optimal assignment with scipy if available, greedy assignment otherwise
+        """
+        self.max_distance = max_distance
+        self.max_missed = max_missed
+        self.iou_weight = iou_weight
+        self.use_hungarian = use_hungarian and linear_sum_assignment is not None
+
+        self.line = None  # Counting line ((x0, y0), (x1, y1))
+        self._lock = threading.Lock()
+        self.reset()
+
+    def __getstate__(self):
+        # A copy sent to another process (see Utils.BusProcessingWorker) gets its own lock
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """Delete all the tracks and reset the counters"""
+        with self._lock:
+            self.tracks = []
+            self._next_id = 1
+            self.nb_crossings = 0  # Crossings of the counting line to its right (see set_line)
+            self.nb_crossings_back = 0  # Crossings in the opposite direction
+            self.crossed_tracks = []  # Tracks which crossed the line since the last call of pop_crossed_tracks
+
+    def set_line(self, p0, p1):
+        """Set the counting line, from p0 to p1 (pixels). The crossings to the right of p0 -> p1 as seen on the
+        image are counted in nb_crossings, e.g. the objects moving from left to right for a line drawn upwards."""
+        self.line = (np.asarray(p0, float), np.asarray(p1, float))
+
+    def update(self, centers, boxes):
+        """
+        Associate the detections of a new frame to the tracks
+
+        :param centers: array (number of detections, 2) of the centers (x, y)
+        :param boxes: array (number of detections, 4) of the bounding boxes (x, y, width, height)
+        :return: list of the Track of each detection
+        """
+        centers = np.asarray(centers, float).reshape(-1, 2)
+        boxes = np.asarray(boxes, float).reshape(-1, 4)
+        with self._lock:
+            rows, cols = self._assign(centers, boxes)
+
+            detection_tracks = [None] * len(centers)
+            matched = np.zeros(len(self.tracks), bool)
+            for row, col in zip(rows, cols):
+                track = self.tracks[row]
+                track.center = centers[col]
+                track.box = boxes[col]
+                track.age += 1
+                track.missed = 0
+                matched[row] = True
+                detection_tracks[col] = track
+
+            matched_tracks = []
+            for track, is_matched in zip(self.tracks, matched):
+                if is_matched:
+                    matched_tracks.append(track)
+                else:
+                    track.missed += 1
+
+            new_tracks = []
+            for i in range(len(centers)):
+                if detection_tracks[i] is None:
+                    track = Track(self._next_id, centers[i], boxes[i])
+                    self._next_id += 1
+                    detection_tracks[i] = track
+                    new_tracks.append(track)
+
+            self.tracks = [track for track in self.tracks if track.missed <= self.max_missed] + new_tracks
+            if self.line is not None:
+                self._count_crossings(matched_tracks, new_tracks)
+            return detection_tracks
+
+    def _assign(self, centers, boxes):
+        """Return the (track, detection) pairs of the assignment with the lowest cost"""
+        if not self.tracks or not len(centers):
+            return np.zeros(0, int), np.zeros(0, int)
+        track_centers = np.array([track.center for track in self.tracks])
+        track_boxes = np.array([track.box for track in self.tracks])
+
+        distances = np.linalg.norm(track_centers[:, None, :] - centers[None, :, :], axis=2)
+        cost = distances / self.max_distance + self.iou_weight * (1 - box_iou(track_boxes, boxes))
+        gated = distances > self.max_distance
+
+        if self.use_hungarian:
+            cost[gated] = 1e6  # Forbidden pairs, removed after the assignment
+            rows, cols = linear_sum_assignment(cost)
+            keep = ~gated[rows, cols]
+            return rows[keep], cols[keep]
+
+        # Greedy: pairs taken by increasing cost, each track and each detection only once
+        cost[gated] = np.inf
+        order = np.argsort(cost, axis=None)
+        order = order[:np.count_nonzero(~gated)]
+        rows, cols = np.unravel_index(order, cost.shape)
+        used_rows = np.zeros(cost.shape[0], bool)
+        used_cols = np.zeros(cost.shape[1], bool)
+        keep = []
+        for k, (row, col) in enumerate(zip(rows, cols)):
+            if not used_rows[row] and not used_cols[col]:
+                used_rows[row] = used_cols[col] = True
+                keep.append(k)
+        return rows[keep], cols[keep]
+
+    def _count_crossings(self, matched_tracks, new_tracks):
+        p0, p1 = self.line
+        direction = p1 - p0
+        for track in new_tracks:
+            track.side = _side(direction, track.center - p0)
+        if not matched_tracks:
+            return
+
+        centers = np.array([track.center for track in matched_tracks])
+        relative = centers - p0
+        sides = np.sign(direction[0] * relative[:, 1] - direction[1] * relative[:, 0]).astype(int)
+        # Position of the center along the line, the object must pass between p0 and p1
+        t = relative @ direction / max(direction @ direction, 1e-12)
+        for track, side, position in zip(matched_tracks, sides, t):
+            if side != 0 and track.side != 0 and side != track.side and 0 <= position <= 1:
+                if side > 0:
+                    self.nb_crossings += 1
+                    track.crossings += 1
+                else:
+                    self.nb_crossings_back += 1
+                    track.crossings -= 1
+                self.crossed_tracks.append(track)
+            if side != 0:
+                track.side = side
+
+    def pop_crossed_tracks(self):
+        """Return the tracks which crossed the line since the last call (to count them by class for example)"""
+        with self._lock:
+            tracks, self.crossed_tracks = self.crossed_tracks, []
+        return tracks
+
+
+def _side(direction, relative):
+    return int(np.sign(direction[0] * relative[1] - direction[1] * relative[0]))
+
+
+def box_iou(boxes_a, boxes_b):
+    """
+    Intersection over union of all the pairs of boxes
+
+    :param boxes_a: array (n, 4) of boxes (x, y, width, height)
+    :param boxes_b: array (m, 4) of boxes
+    :return: array (n, m)
+    """
+    a = boxes_a[:, None, :]
+    b = boxes_b[None, :, :]
+    width = np.minimum(a[..., 0] + a[..., 2], b[..., 0] + b[..., 2]) - np.maximum(a[..., 0], b[..., 0])
+    height = np.minimum(a[..., 1] + a[..., 3], b[..., 1] + b[..., 3]) - np.maximum(a[..., 1], b[..., 1])
+    intersection = np.clip(width, 0, None) * np.clip(height, 0, None)
+    union = a[..., 2] * a[..., 3] + b[..., 2] * b[..., 3] - intersection
+    return intersection / np.maximum(union, 1e-12)